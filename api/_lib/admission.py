@@ -0,0 +1,123 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, client):
+        self.client = client
+        self.granted = False
+        self.event = threading.Event()
+
+
+class Slot:
+    def __init__(self, controller):
+        self._controller = controller
+        self._released = False
+        self.acquired = time.monotonic()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """Caps how many requests run at once and queues the overflow.
+
+    Waiters are kept per client and a freed slot goes to clients in
+    round-robin order, so one client queueing many requests can't starve
+    everybody else. When the queue is full, or a waiter isn't admitted within
+    ``timeout`` seconds, ``acquire`` raises ``Overloaded`` with a suggested
+    ``retry_after``.
+    """
+
+    def __init__(self, name, limit, queue_size=32, timeout=10):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._queued = 0
+        self._waiters = OrderedDict()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.released = 0
+
+    def acquire(self, client):
+        start = time.monotonic()
+        with self._lock:
+            if self.active < self.limit and not self._queued:
+                self.active += 1
+                self.admitted += 1
+                return Slot(self)
+            if self._queued >= self.queue_size:
+                self.rejected += 1
+                raise Overloaded(f'{self.name} queue is full', self._retry_after())
+            waiter = _Waiter(client)
+            self._waiters.setdefault(client, deque()).append(waiter)
+            self._queued += 1
+
+        waiter.event.wait(self.timeout)
+
+        with self._lock:
+            if not waiter.granted:
+                queue = self._waiters.get(client)
+                queue.remove(waiter)
+                if not queue:
+                    del self._waiters[client]
+                self._queued -= 1
+                self.rejected += 1
+                raise Overloaded(f'Timed out waiting for a {self.name} slot', self._retry_after())
+            waited = time.monotonic() - start
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return Slot(self)
+
+    def _release(self, slot):
+        with self._lock:
+            self.hold_total += time.monotonic() - slot.acquired
+            self.released += 1
+            if not self._waiters:
+                self.active -= 1
+                return
+            # hand the slot straight to the next client in rotation
+            client, queue = next(iter(self._waiters.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(client)
+            else:
+                del self._waiters[client]
+            self._queued -= 1
+            self.admitted += 1
+            waiter.granted = True
+            waiter.event.set()
+
+    def _retry_after(self):
+        average_hold = self.hold_total / self.released if self.released else 5
+        return max(1, math.ceil(average_hold * (self._queued + 1) / max(self.limit, 1)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'queued': self._queued,
+                'queued_clients': len(self._waiters),
+                'queue_size': self.queue_size,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'wait_seconds_total': round(self.wait_total, 3),
+                'wait_seconds_max': round(self.wait_max, 3),
+            }
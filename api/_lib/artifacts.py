@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def artifact_key(extractor, video_id, format_id, format_type, **settings):
+    raw = json.dumps([extractor, video_id, format_id, format_type, settings], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ArtifactCache:
+    """Content-addressed store for finished media files.
+
+    Files live at ``<root>/<key[:2]>/<key>.<ext>``. The total size is capped
+    at ``max_bytes``; the least recently used files are deleted first. New
+    files are written next to their final location and renamed into place, so
+    a reader never sees a partial artifact.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name == 'tmp':
+                continue
+            for f in os.scandir(entry.path):
+                st = f.stat()
+                found.append((st.st_atime, f.name.split('.', 1)[0], f.path, st.st_size))
+        for _, key, path, size in sorted(found):
+            self._index[key] = (path, size)
+            self._total += size
+        shutil.rmtree(os.path.join(self.root, 'tmp'), ignore_errors=True)
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+        self._evict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def temp_file(self):
+        """Open a writable temp file on the same filesystem as the cache."""
+        return tempfile.NamedTemporaryFile(dir=os.path.join(self.root, 'tmp'), delete=False)
+
+    def publish(self, key, tmp_path, ext):
+        """Atomically move ``tmp_path`` (from ``temp_file``) into the cache."""
+        path = os.path.join(self.root, key[:2], f'{key}.{ext}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if key in self._index:
+                self._total -= self._index[key][1]
+            self._index[key] = (path, size)
+            self._total += size
+            self._evict()
+        return path
+
+    def store(self, key, src_path):
+        """Add a copy of ``src_path`` to the cache, hard-linking when possible."""
+        with self.temp_file() as tmp:
+            tmp_path = tmp.name
+        os.unlink(tmp_path)
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+        return self.publish(key, tmp_path, src_path.rsplit('.', 1)[-1])
+
+    def link_into(self, key, dest_dir):
+        """Hard-link (or copy) a cached file into ``dest_dir`` so the caller
+        keeps it even if the cache evicts the entry afterwards."""
+        path = self.get(key)
+        if path is None:
+            return None
+        dest = os.path.join(dest_dir, os.path.basename(path))
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copyfile(path, dest)
+        return dest
+
+    def _drop(self, key):
+        path, size = self._index.pop(key)
+        self._total -= size
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._index:
+            self._drop(next(iter(self._index)))
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._index),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def tee_to_cache(chunks, cache, key, ext):
+    """Pass ``chunks`` through while writing them to a cache temp file; the
+    file is published only if the stream ran to completion."""
+    tmp = cache.temp_file()
+    complete = False
+    try:
+        for chunk in chunks:
+            tmp.write(chunk)
+            yield chunk
+        complete = True
+    finally:
+        tmp.close()
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+        if complete:
+            cache.publish(key, tmp.name, ext)
+        else:
+            os.unlink(tmp.name)
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from yt_dlp.extractor import gen_extractor_classes
+
+
+_extractors = None
+
+
+def video_key(url):
+    """Return a stable identity for ``url`` so that different spellings of the
+    same video (youtu.be links, tracking params, mobile hosts) share one entry."""
+    global _extractors
+    if _extractors is None:
+        _extractors = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+
+    for ie in _extractors:
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                return f'{ie.ie_key()}:{video_id}'
+            break
+
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+def signed_url_expiry(info):
+    """Earliest ``expire=`` timestamp found in the format urls, if any."""
+    expiry = None
+    for f in info.get('formats') or []:
+        url = f.get('url') or ''
+        if 'expire' not in url:
+            continue
+        for key, value in parse_qsl(urlsplit(url).query):
+            if key == 'expire' and value.isdigit():
+                expiry = int(value) if expiry is None else min(expiry, int(value))
+        # googlevideo puts signature params in the path as well
+        path = urlsplit(url).path.split('/')
+        if 'expire' in path:
+            i = path.index('expire')
+            if i + 1 < len(path) and path[i + 1].isdigit():
+                value = int(path[i + 1])
+                expiry = value if expiry is None else min(expiry, value)
+    return expiry
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MetadataCache:
+    """LRU + TTL cache for ``extract_info`` results.
+
+    Concurrent misses for the same key are coalesced: the first caller runs
+    the loader and everyone else waits for its result instead of hitting the
+    upstream site again.
+    """
+
+    def __init__(self, maxsize=256, ttl=600, expiry_margin=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.expiry_margin = expiry_margin
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _ttl_for(self, value):
+        ttl = self.ttl
+        expiry = signed_url_expiry(value) if isinstance(value, dict) else None
+        if expiry is not None:
+            ttl = min(ttl, expiry - time.time() - self.expiry_margin)
+        return ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        ttl = self._ttl_for(value)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.put(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'inflight': len(self._inflight),
+            }
@@ -0,0 +1,49 @@
+import gzip
+import hashlib
+import json
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MIN_COMPRESS_SIZE = 1024
+
+
+def _encoders():
+    encoders = {'gzip': lambda body: gzip.compress(body, compresslevel=6)}
+    if brotli is not None:
+        encoders['br'] = lambda body: brotli.compress(body, quality=5)
+    return encoders
+
+
+def cached_json(payload, max_age):
+    """Build a compact JSON response that browsers and CDNs can reuse: a
+    content hash ETag (answering ``If-None-Match`` with 304), a public
+    ``Cache-Control`` and gzip/brotli encoding when the client accepts it."""
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+
+    encoders = _encoders()
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encoding = request.accept_encodings.best_match(list(encoders)[::-1])
+    if encoding:
+        etag = f'{etag}-{encoding}'
+
+    response = Response(mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}'
+    response.vary.add('Accept-Encoding')
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+
+    if encoding:
+        body = encoders[encoding](body)
+        response.headers['Content-Encoding'] = encoding
+    response.set_data(body)
+    return response
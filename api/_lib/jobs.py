@@ -0,0 +1,143 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = 'queued'
+        self.created = time.time()
+        self.finished = None
+        self.tmpdir = None
+        self.path = None
+        self.size = None
+        self.filename = None
+        self.mimetype = None
+        self.error = None
+        self.events = []
+        self._cond = threading.Condition()
+        self._last_progress = 0
+
+    def publish(self, event, **data):
+        with self._cond:
+            if event in ('finished', 'failed'):
+                self.status = event
+                self.finished = time.time()
+            elif event == 'phase':
+                self.status = data.get('phase', self.status)
+            self.events.append((event, data))
+            self._cond.notify_all()
+
+    def progress(self, d, min_interval=0.5):
+        """yt-dlp progress hook; rate-limited so a fast download doesn't
+        flood the event log."""
+        now = time.monotonic()
+        if d.get('status') == 'downloading' and now - self._last_progress < min_interval:
+            return
+        self._last_progress = now
+        self.publish(
+            'progress',
+            phase=d.get('status'),
+            downloaded_bytes=d.get('downloaded_bytes'),
+            total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+            speed=d.get('speed'),
+            eta=d.get('eta'),
+        )
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'failed')
+
+    def iter_events(self, start=0, keepalive=15):
+        """Yield ``(index, event, data)`` from ``start`` until the job is
+        done; yields ``None`` every ``keepalive`` seconds of silence."""
+        i = start
+        while True:
+            with self._cond:
+                if i >= len(self.events) and not self.done:
+                    self._cond.wait(keepalive)
+                pending = self.events[i:]
+                done = self.done
+            if not pending:
+                if done:
+                    return
+                yield None
+                continue
+            for event, data in pending:
+                yield i, event, data
+                i += 1
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'created': self.created,
+            'finished': self.finished,
+        }
+        if self.error:
+            data['error'] = self.error
+        if self.status == 'finished':
+            data['filename'] = self.filename
+        for event, payload in reversed(self.events):
+            if event == 'progress':
+                data['progress'] = payload
+                break
+        return data
+
+
+class JobManager:
+    """Runs download jobs on a bounded thread pool and keeps their results
+    around for ``ttl`` seconds after they finish."""
+
+    def __init__(self, run, workers=2, ttl=3600, max_jobs=256):
+        self.run = run
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def submit(self, **params):
+        self.reap()
+        job = Job(params)
+        with self._lock:
+            if len(self._jobs) >= self.max_jobs:
+                raise OverflowError('Too many jobs, try again later')
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        job.tmpdir = tempfile.mkdtemp(prefix=f'job-{job.id}-')
+        job.publish('phase', phase='started')
+        try:
+            self.run(job)
+        except Exception as e:
+            job.error = str(e)
+            job.publish('failed', error=job.error)
+        else:
+            job.publish('finished', filename=job.filename, size=job.size)
+
+    def reap(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished and job.finished < cutoff]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            if job.tmpdir:
+                shutil.rmtree(job.tmpdir, ignore_errors=True)
+
+
+def sse(index, event, data):
+    return f'id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
@@ -0,0 +1,180 @@
+import bisect
+import threading
+import time
+
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        return self.header() + [f'{self.name}{_labels(self.labelnames, k)} {v}' for k, v in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            series = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._series.items())
+        lines = self.header()
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    """Holds metrics plus callbacks that report values owned by other
+    objects (caches, pools, queues) at scrape time."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def collector(self, fn):
+        """``fn`` returns ``(name, kind, help, value)`` tuples."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for fn in self._collectors:
+            for name, kind, help, value in fn():
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+class MeteredBody:
+    """Wraps a streamed response body and reports time to first byte, total
+    duration, bytes sent and whether the body failed once the response is closed. The per-chunk work
+    is a local add, no locks."""
+
+    def __init__(self, body, on_first_byte, on_close):
+        self._body = iter(body)
+        self._close_body = getattr(body, 'close', None)
+        self._on_first_byte = on_first_byte
+        self._on_close = on_close
+        self.bytes_sent = 0
+        self.failed = False
+        self._first = True
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._body)
+        except StopIteration:
+            raise
+        except Exception:
+            self.failed = True
+            raise
+        if self._first:
+            self._first = False
+            self._on_first_byte()
+        self.bytes_sent += len(chunk)
+        return chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._close_body:
+            self._close_body()
+        self._on_close(self.bytes_sent, self.failed)
@@ -0,0 +1,93 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from yt_dlp.utils import PagedList
+
+
+ENTRY_FIELDS = ('id', 'title', 'url', 'duration', 'channel', 'view_count', 'thumbnails')
+
+
+def flat_entry(entry):
+    entry = entry or {}
+    data = {k: entry.get(k) for k in ENTRY_FIELDS if entry.get(k) is not None}
+    data.setdefault('url', entry.get('webpage_url'))
+    return data
+
+
+def iter_entries(result, start=0):
+    """Yield the entries of an unprocessed playlist result from ``start`` on
+    without materializing the ones before it when the extractor pages."""
+    entries = result.get('entries')
+    if entries is None:
+        return iter([result] if start == 0 else [])
+    if isinstance(entries, PagedList):
+        return _iter_paged(entries, start)
+    return itertools.islice(iter(entries), start, None)
+
+
+def _iter_paged(entries, start):
+    # PagedList.getslice only fetches the pages that cover the slice
+    step = 50
+    while True:
+        page = entries.getslice(start, start + step)
+        yield from page
+        if len(page) < step:
+            return
+        start += step
+
+
+class PlaylistCursors:
+    """Keeps the live entry iterators of recently served pages so the next
+    page continues where the previous one stopped instead of walking the
+    playlist again from the first entry.
+
+    States that are evicted or expire are passed to ``discard`` so whatever
+    they hold (a pooled ``YoutubeDL``) can be given back.
+    """
+
+    def __init__(self, maxsize=64, ttl=600, discard=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.discard = discard
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, state):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._cursors[token] = (time.monotonic() + self.ttl, state)
+            dropped = self._prune()
+        self._discard(dropped)
+        return token
+
+    def take(self, token):
+        with self._lock:
+            expires, state = self._cursors.pop(token, (0, None))
+            dropped = self._prune()
+        if state is not None and expires < time.monotonic():
+            dropped.append(state)
+            state = None
+        self._discard(dropped)
+        return state
+
+    def _prune(self):
+        dropped = []
+        while len(self._cursors) > self.maxsize:
+            dropped.append(self._cursors.popitem(last=False)[1][1])
+        # every cursor gets the same ttl, so the oldest expire first
+        now = time.monotonic()
+        while self._cursors:
+            token, (expires, state) = next(iter(self._cursors.items()))
+            if expires >= now:
+                break
+            del self._cursors[token]
+            dropped.append(state)
+        return dropped
+
+    def _discard(self, states):
+        if self.discard:
+            for state in states:
+                self.discard(state)
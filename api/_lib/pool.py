@@ -0,0 +1,145 @@
+import threading
+from contextlib import contextmanager
+
+from yt_dlp import YoutubeDL
+from yt_dlp.postprocessor import get_postprocessor
+
+
+_MISSING = object()
+
+
+class YDLPool:
+    """Free-list of pre-configured ``YoutubeDL`` instances, one list per
+    option profile.
+
+    Building a ``YoutubeDL`` loads the cookie file, sets up request handlers
+    and instantiates post-processors, so handlers borrow a ready instance
+    instead. At most ``size`` idle instances are kept per profile; a checkout
+    never blocks, it builds a fresh instance when the list is empty.
+
+    Overrides passed to ``acquire`` are applied for that checkout only and
+    rolled back on ``release``.
+    """
+
+    def __init__(self, profiles, size=4, base_opts=None):
+        self.profiles = profiles
+        self.size = size
+        self.base_opts = base_opts or {}
+        self.extractors = []
+        self._idle = {name: [] for name in profiles}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _create(self, profile):
+        ydl = YoutubeDL({**self.base_opts, **self.profiles[profile]})
+        ydl._pool_profile = profile
+        ydl._pool_extractors = 0
+        # cached properties: cookie file parsing and request handler setup
+        ydl.cookiejar
+        ydl._request_director
+        with self._lock:
+            self.created += 1
+        return ydl
+
+    def warm(self, count=1):
+        for profile in self.profiles:
+            for _ in range(count):
+                self.release(self._create(profile))
+
+    def acquire(self, profile, **overrides):
+        with self._lock:
+            idle = self._idle[profile]
+            ydl = idle.pop() if idle else None
+            if ydl is not None:
+                self.reused += 1
+        if ydl is None:
+            ydl = self._create(profile)
+        for ie in self.extractors[ydl._pool_extractors:]:
+            self._register(ydl, ie)
+            ydl._pool_extractors += 1
+        self._apply(ydl, overrides)
+        return ydl
+
+    def add_extractor(self, ie):
+        """Register an extra ``InfoExtractor`` class on every instance, tried
+        before the built-in ones so it wins over Generic. Instances pick it up
+        on their next checkout."""
+        self.extractors.append(ie)
+
+    @staticmethod
+    def _register(ydl, ie):
+        ydl.add_info_extractor(ie())
+        key = ie.ie_key()
+        ydl._ies = {key: ydl._ies.pop(key), **ydl._ies}
+
+    def release(self, ydl):
+        self._restore(ydl)
+        with self._lock:
+            idle = self._idle[ydl._pool_profile]
+            if len(idle) < self.size:
+                idle.append(ydl)
+                return
+        ydl.close()
+
+    @contextmanager
+    def checkout(self, profile, **overrides):
+        ydl = self.acquire(profile, **overrides)
+        try:
+            yield ydl
+        finally:
+            self.release(ydl)
+
+    def _apply(self, ydl, overrides):
+        ydl._pool_saved = {
+            'params': {},
+            'format_selector': ydl.format_selector,
+            'pps': {when: list(pps) for when, pps in ydl._pps.items()},
+            'progress_hooks': list(ydl._progress_hooks),
+            'postprocessor_hooks': list(ydl._postprocessor_hooks),
+        }
+        for key, value in overrides.items():
+            if key == 'progress_hooks':
+                for hook in value:
+                    ydl.add_progress_hook(hook)
+            elif key == 'postprocessor_hooks':
+                for hook in value:
+                    ydl.add_postprocessor_hook(hook)
+            elif key == 'postprocessors':
+                for pp_def in value:
+                    pp_def = dict(pp_def)
+                    when = pp_def.pop('when', 'post_process')
+                    ydl.add_post_processor(get_postprocessor(pp_def.pop('key'))(ydl, **pp_def), when=when)
+            else:
+                ydl._pool_saved['params'][key] = ydl.params.get(key, _MISSING)
+                if key == 'outtmpl' and not isinstance(value, dict):
+                    value = {**ydl.params['outtmpl'], 'default': value}
+                ydl.params[key] = value
+                if key == 'format':
+                    ydl.format_selector = ydl.build_format_selector(value) if value else None
+
+    def _restore(self, ydl):
+        saved = ydl.__dict__.pop('_pool_saved', None)
+        if saved is None:
+            return
+        for key, value in saved['params'].items():
+            if value is _MISSING:
+                ydl.params.pop(key, None)
+            else:
+                ydl.params[key] = value
+        ydl.format_selector = saved['format_selector']
+        ydl._pps = saved['pps']
+        ydl._progress_hooks = saved['progress_hooks']
+        ydl._postprocessor_hooks = saved['postprocessor_hooks']
+        ydl._download_retcode = 0
+        ydl._num_downloads = 0
+        ydl._playlist_level = 0
+        ydl._playlist_urls = set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'idle': {name: len(idle) for name, idle in self._idle.items()},
+            }
@@ -0,0 +1,153 @@
+import os
+import re
+import uuid
+
+from flask import Response, request, send_file
+from werkzeug.http import http_date
+
+from .stream import CHUNK_SIZE
+
+
+def _if_range_matches(etag, mtime):
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    return if_range.date.timestamp() >= int(mtime)
+
+
+def _parse_ranges(header):
+    """``(start, stop)`` pairs from a ``bytes=`` Range header in request
+    order, with ``stop`` exclusive or None and suffix ranges as a negative
+    ``start``; None when the header is malformed.
+
+    werkzeug's parser throws out overlapping or unsorted ranges, which are
+    valid and are merged by ``_resolve`` instead.
+    """
+    unit, _, specs = (header or '').partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        match = re.fullmatch(r'\s*(\d*)\s*-\s*(\d*)\s*', spec)
+        if match is None or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if not first:
+            # a zero-length suffix selects nothing
+            ranges.append((-int(last), None) if int(last) else (0, 0))
+        elif not last:
+            ranges.append((int(first), None))
+        elif int(first) <= int(last):
+            ranges.append((int(first), int(last) + 1))
+        else:
+            return None
+    return ranges
+
+
+def _resolve(ranges, size):
+    """Turn parsed ``(start, stop)`` pairs into absolute, sorted and merged
+    byte spans; overlapping or adjacent spans are coalesced so a client can't
+    make us send the same bytes twice."""
+    spans = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            spans.append([start, stop])
+
+    merged = []
+    for span in sorted(spans):
+        if merged and span[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span[1])
+        else:
+            merged.append(span)
+    return merged
+
+
+def _iter_spans(path, spans, parts=None):
+    with open(path, 'rb') as f:
+        for i, (start, stop) in enumerate(spans):
+            if parts:
+                yield parts[i]
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+            if parts:
+                yield b'\r\n'
+        if parts:
+            yield parts[-1]
+
+
+def send_artifact(path, download_name, mimetype='application/octet-stream', etag=None):
+    """Serve a file that already exists on disk with full HTTP/1.1 range and
+    conditional request support.
+
+    ``send_file`` covers the common cases (single range, ``If-Range``,
+    ``If-None-Match``, ``HEAD``) but answers multi-range requests with 416, so
+    those are answered here as ``multipart/byteranges``, with overlapping
+    ranges merged.
+
+    The default ETag is taken from the file's size, mtime and inode, so it
+    changes whenever the file at ``path`` is replaced; an ``etag`` passed in
+    must do the same, since ``If-Range`` trusts it.
+    """
+    st = os.stat(path)
+    etag = etag or f'{st.st_size:x}-{st.st_mtime_ns:x}-{st.st_ino:x}'
+
+    ranges = _parse_ranges(request.headers.get('Range'))
+    if (ranges is None or len(ranges) < 2 or request.method not in ('GET', 'HEAD')
+            or not _if_range_matches(etag, st.st_mtime)):
+        return send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+            etag=etag,
+            last_modified=st.st_mtime,
+        )
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(st.st_mtime),
+        'Content-Disposition': f'attachment; filename="{download_name}"',
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    spans = _resolve(ranges, st.st_size)
+    if not spans:
+        return Response(status=416, headers={**headers, 'Content-Range': f'bytes */{st.st_size}'})
+
+    if len(spans) == 1:
+        start, stop = spans[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{st.st_size}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(_iter_spans(path, spans), status=206, mimetype=mimetype, headers=headers)
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{st.st_size}\r\n\r\n').encode('latin-1')
+        for start, stop in spans
+    ]
+    parts.append(f'--{boundary}--\r\n'.encode('latin-1'))
+    headers['Content-Length'] = str(
+        sum(len(p) for p in parts) + sum(stop - start + 2 for start, stop in spans)
+    )
+    return Response(
+        _iter_spans(path, spans, parts),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+        headers=headers,
+    )
@@ -0,0 +1,312 @@
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from yt_dlp.networking import Request
+
+
+CHUNK_SIZE = 64 * 1024
+
+_EOF = object()
+
+
+class StreamAborted(Exception):
+    pass
+
+
+class ChunkPipe:
+    """Bounded hand-off between a producer thread and the response generator.
+
+    ``put`` blocks once ``maxchunks`` chunks are waiting, so a slow client
+    slows the upstream read down instead of piling bytes up in memory.
+    """
+
+    def __init__(self, maxchunks=16):
+        self._queue = queue.Queue(maxchunks)
+        self._aborted = threading.Event()
+        self.error = None
+
+    def put(self, chunk):
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise StreamAborted()
+
+    def finish(self, error=None):
+        self.error = error
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(_EOF, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def abort(self):
+        self._aborted.set()
+
+    @property
+    def aborted(self):
+        return self._aborted.is_set()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._aborted.is_set():
+            raise StopIteration
+        chunk = self._queue.get()
+        if chunk is _EOF:
+            self.abort()
+            if self.error is not None:
+                raise self.error
+            raise StopIteration
+        return chunk
+
+    # called by the WSGI server when the client goes away
+    def close(self):
+        self.abort()
+
+
+def pump(chunks, maxchunks=16, name='stream-pump'):
+    """Drain the iterable ``chunks`` on a background thread and return the
+    ``ChunkPipe`` it feeds, ready to be used as a response body."""
+    pipe = ChunkPipe(maxchunks)
+
+    def run():
+        try:
+            for chunk in chunks:
+                pipe.put(chunk)
+        except StreamAborted:
+            pass
+        except Exception as e:
+            pipe.finish(e)
+            return
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+        pipe.finish()
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return pipe
+
+
+def select_format(ydl, info, spec):
+    formats = info.get('formats') or [info]
+    for f in formats:
+        if f.get('format_id') == spec:
+            return f
+
+    selector = ydl.build_format_selector(spec)
+    selected = list(selector({
+        'formats': formats,
+        'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+        'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                               or all(f.get('acodec') == 'none' for f in formats)),
+    }))
+    return selected[0] if selected else None
+
+
+def is_direct(fmt):
+    return (fmt.get('protocol') in ('http', 'https')
+            and not fmt.get('requested_formats')
+            and bool(fmt.get('url')))
+
+
+AUDIO_MIMETYPES = {
+    'm4a': 'audio/mp4',
+    'mp4': 'audio/mp4',
+    'webm': 'audio/webm',
+    'mp3': 'audio/mpeg',
+    'ogg': 'audio/ogg',
+    'opus': 'audio/ogg',
+    'aac': 'audio/aac',
+    'flac': 'audio/flac',
+    'wav': 'audio/wav',
+}
+
+# acodec -> (ext, ffmpeg muxer, mimetype) for a stream-copy into a plain
+# audio container
+AUDIO_REMUX = {
+    'mp4a': ('aac', 'adts', 'audio/aac'),
+    'aac': ('aac', 'adts', 'audio/aac'),
+    'opus': ('opus', 'ogg', 'audio/ogg'),
+    'vorbis': ('ogg', 'ogg', 'audio/ogg'),
+    'mp3': ('mp3', 'mp3', 'audio/mpeg'),
+    'flac': ('flac', 'flac', 'audio/flac'),
+}
+
+
+def best_audio_format(info, spec=None):
+    """Pick ``spec`` if it names an audio-only format, otherwise the audio-only
+    format with the highest bitrate, preferring ones fetchable in one GET."""
+    formats = [
+        f for f in info.get('formats') or []
+        if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')
+    ]
+    for f in formats:
+        if f.get('format_id') == spec:
+            return f
+    return max(formats, key=lambda f: (is_direct(f), f.get('abr') or f.get('tbr') or 0), default=None)
+
+
+def audio_passthrough(fmt):
+    """How to deliver ``fmt``'s audio without re-encoding it.
+
+    Returns ``(ext, mimetype, remux_args)``; ``remux_args`` is ``None`` when
+    the bytes can be sent as they are. ``fmt`` may also be a muxed format, in
+    which case its audio track is copied out. Returns ``None`` for codecs we
+    don't know how to package, so the caller can fall back to transcoding.
+    """
+    ext = fmt.get('ext')
+    acodec = (fmt.get('acodec') or '').split('.')[0]
+    if (fmt.get('vcodec') == 'none' and not (fmt.get('protocol') or '').startswith('m3u8')
+            and ext in AUDIO_MIMETYPES):
+        return ('m4a' if ext == 'mp4' else ext), AUDIO_MIMETYPES[ext], None
+    if acodec in AUDIO_REMUX:
+        ext, muxer, mimetype = AUDIO_REMUX[acodec]
+        return ext, mimetype, ['-vn', '-c:a', 'copy', '-f', muxer]
+    return None
+
+
+# stream copy into an mp4 that can be written to a pipe
+MP4_REMUX = ['-c', 'copy', '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+
+
+def video_remux(fmt):
+    """ffmpeg args that package what ``iter_ytdlp_process`` writes for the
+    video format ``fmt`` as mp4, or None when it already comes out in the
+    container named by ``fmt['ext']``. yt-dlp pipes HLS and mp4 formats out
+    as MPEG-TS."""
+    if (fmt.get('protocol') or '').startswith('m3u8') or fmt.get('ext') == 'mp4':
+        return MP4_REMUX
+    return None
+
+
+def open_direct(ydl, fmt):
+    """Open the upstream http response for a single progressive format."""
+    return ydl.urlopen(Request(fmt['url'], headers=fmt.get('http_headers') or {}))
+
+
+def iter_response(response, chunk_size=CHUNK_SIZE, on_close=None):
+    try:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        response.close()
+        if on_close:
+            on_close()
+
+
+def iter_ytdlp_process(info, spec, extra_args=(), cookiefile=None, chunk_size=CHUNK_SIZE):
+    """Run yt-dlp in a child process writing to stdout and yield its output.
+
+    Used for formats that can't be fetched with a single GET (HLS, DASH,
+    merged video+audio). The already extracted ``info`` is handed over with
+    ``--load-info-json`` so the child doesn't repeat the extraction.
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.info.json', delete=False) as f:
+        json.dump(info, f)
+        info_path = f.name
+
+    cmd = [sys.executable, '-m', 'yt_dlp', '--quiet', '--no-progress', '--no-playlist',
+           '--load-info-json', info_path, '-f', spec, '-o', '-', *extra_args]
+    if cookiefile:
+        cmd += ['--cookies', cookiefile]
+
+    stderr = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+    try:
+        while True:
+            chunk = proc.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        if proc.wait() != 0:
+            stderr.seek(0)
+            message = stderr.read().decode('utf-8', 'replace').strip()
+            raise RuntimeError(message or f'yt-dlp exited with status {proc.returncode}')
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        stderr.close()
+        os.unlink(info_path)
+
+
+def ffmpeg_path():
+    """The ffmpeg binary to run (``FFMPEG_PATH`` or the one on ``PATH``), or
+    None when there isn't one."""
+    return shutil.which(os.getenv('FFMPEG_PATH') or 'ffmpeg')
+
+
+def mp3_args(bitrate):
+    return ['-vn', '-acodec', 'libmp3lame', '-b:a', f'{bitrate}k', '-f', 'mp3']
+
+
+def iter_transcode(chunks, output_args, chunk_size=CHUNK_SIZE):
+    """Feed ``chunks`` into ffmpeg's stdin and yield what it writes to stdout.
+
+    Encoding overlaps with the upstream download, so the first encoded bytes
+    are available a moment after the first source bytes arrive. The source
+    must be decodable from a pipe (no seeking), which holds for the fragmented
+    and webm audio streams sites generally serve.
+    """
+    stderr = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        [ffmpeg_path() or 'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', *output_args, 'pipe:1'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr,
+    )
+    feed_error = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass
+        except Exception as e:
+            feed_error.append(e)
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, name='transcode-feed', daemon=True)
+    feeder.start()
+    try:
+        while True:
+            chunk = proc.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        feeder.join()
+        if feed_error:
+            raise feed_error[0]
+        if proc.wait() != 0:
+            stderr.seek(0)
+            message = stderr.read().decode('utf-8', 'replace').strip()
+            raise RuntimeError(message or f'ffmpeg exited with status {proc.returncode}')
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        feeder.join()
+        proc.stdout.close()
+        stderr.close()
@@ -1,11 +1,32 @@
-from flask import Flask, request, render_template, Response, jsonify
-from yt_dlp import YoutubeDL
-import uuid
-import io
+from flask import Flask, request, render_template, Response, jsonify, make_response, g
+import copy
+import itertools
+import json
 import os
+import sys
 import base64
+import mimetypes
+import tempfile
+import time
 from dotenv import load_dotenv
 from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from _lib.cache import MetadataCache, video_key
+from _lib.pool import YDLPool
+from _lib.jobs import JobManager, sse
+from _lib.artifacts import ArtifactCache, artifact_key, tee_to_cache
+from _lib.ranges import send_artifact
+from _lib.encoding import cached_json
+from _lib.admission import AdmissionController, Overloaded
+from _lib.playlist import PlaylistCursors, iter_entries, flat_entry
+from _lib.metrics import Registry, MeteredBody
+from _lib.stream import (
+    pump, select_format, is_direct, open_direct, iter_response, iter_ytdlp_process,
+    iter_transcode, ffmpeg_path, mp3_args, best_audio_format, audio_passthrough, video_remux, AUDIO_MIMETYPES,
+)
 
 app = Flask(__name__)
 load_dotenv()
@@ -19,6 +40,106 @@ if cookies_encoded:
 else:
     temp_cookie_path = None
 
+formats_cache = MetadataCache(
+    maxsize=int(os.getenv("FORMATS_CACHE_SIZE", 256)),
+    ttl=int(os.getenv("FORMATS_CACHE_TTL", 600)),
+)
+
+ydl_pool = YDLPool(
+    {
+        'metadata': {'skip_download': True},
+        'download': {'noplaylist': True},
+        'audio': {'noplaylist': True, 'format': 'bestaudio/best'},
+        'playlist': {'skip_download': True, 'extract_flat': 'in_playlist', 'lazy_playlist': True},
+    },
+    size=int(os.getenv("YDL_POOL_SIZE", 4)),
+    base_opts={'quiet': True, 'noprogress': True, "cookiefile": temp_cookie_path},
+)
+ydl_pool.warm()
+
+AUDIO_BITRATES = (64, 96, 128, 160, 192, 256, 320)
+default_bitrate = int(os.getenv("AUDIO_BITRATE", 192))
+
+artifacts = ArtifactCache(
+    os.getenv("ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "download-cache")),
+    max_bytes=int(os.getenv("ARTIFACT_CACHE_BYTES", 2 * 1024 ** 3)),
+)
+
+FORMATS_MAX_AGE = int(os.getenv("FORMATS_MAX_AGE", 300))
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", 500))
+batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BATCH_WORKERS", 8)),
+    thread_name_prefix='formats-batch',
+)
+
+PLAYLIST_PAGE_SIZE = int(os.getenv("PLAYLIST_PAGE_SIZE", 50))
+PLAYLIST_MAX_PAGE_SIZE = 500
+playlist_cursors = PlaylistCursors(discard=lambda state: ydl_pool.release(state['ydl']))
+
+# reverse proxies appending to X-Forwarded-For, one on vercel
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 1))
+download_slots = AdmissionController(
+    'download',
+    limit=int(os.getenv("DOWNLOAD_CONCURRENCY", 8)),
+    queue_size=int(os.getenv("DOWNLOAD_QUEUE_SIZE", 32)),
+    timeout=float(os.getenv("DOWNLOAD_QUEUE_TIMEOUT", 10)),
+)
+transcode_slots = AdmissionController(
+    'transcode',
+    limit=int(os.getenv("TRANSCODE_CONCURRENCY", os.cpu_count() or 2)),
+    queue_size=int(os.getenv("DOWNLOAD_QUEUE_SIZE", 32)),
+    timeout=float(os.getenv("DOWNLOAD_QUEUE_TIMEOUT", 10)),
+)
+
+metrics = Registry()
+extract_seconds = metrics.histogram(
+    'ytdlp_extract_info_seconds', 'Time spent in extract_info.', ('extractor',))
+download_ttfb_seconds = metrics.histogram(
+    'download_ttfb_seconds', 'Time from request to first body byte on /download.', ('mode',))
+download_seconds = metrics.histogram(
+    'download_duration_seconds', 'Total duration of /download responses.', ('mode',))
+download_bytes = metrics.counter(
+    'download_bytes_sent_total', 'Body bytes sent by /download.', ('mode',))
+download_inflight = metrics.gauge(
+    'download_inflight', 'Downloads currently being streamed.')
+extractor_errors = metrics.counter(
+    'ytdlp_errors_total', 'Failures by extractor and stage.', ('extractor', 'stage'))
+cookiefile_uses = metrics.counter(
+    'ytdlp_cookiefile_uses_total', 'yt-dlp calls made with the cookie file loaded.', ('stage',))
+
+@metrics.collector
+def collect_stats():
+    cache, pool, disk = formats_cache.stats(), ydl_pool.stats(), artifacts.stats()
+    yield 'formats_cache_hits_total', 'counter', 'Metadata cache hits.', cache['hits']
+    yield 'formats_cache_misses_total', 'counter', 'Metadata cache misses.', cache['misses']
+    yield 'formats_cache_entries', 'gauge', 'Metadata cache entries.', cache['size']
+    yield 'ydl_pool_created_total', 'counter', 'YoutubeDL instances created.', pool['created']
+    yield 'ydl_pool_reused_total', 'counter', 'YoutubeDL instances reused.', pool['reused']
+    yield 'artifact_cache_bytes', 'gauge', 'Bytes held by the artifact cache.', disk['bytes']
+    for controller in (download_slots, transcode_slots):
+        stats = controller.stats()
+        yield f'{controller.name}_slots_active', 'gauge', f'Active {controller.name} slots.', stats['active']
+        yield f'{controller.name}_slots_queued', 'gauge', f'Queued {controller.name} requests.', stats['queued']
+        yield f'{controller.name}_rejected_total', 'counter', f'Rejected {controller.name} requests.', stats['rejected']
+
+def extractor_name(url):
+    key = video_key(url)
+    return key.split(':', 1)[0] if '://' not in key else 'generic'
+
+def extract_info(url):
+    start = time.perf_counter()
+    try:
+        with ydl_pool.checkout('metadata') as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    except Exception:
+        extractor_errors.inc(1, extractor_name(url), 'extract')
+        raise
+    finally:
+        if temp_cookie_path:
+            cookiefile_uses.inc(1, 'extract')
+    extract_seconds.observe(time.perf_counter() - start, info.get('extractor_key') or 'generic')
+    return info
+
 def format_views(count):
     if not count:
         return "0 views"
@@ -28,125 +149,595 @@ def format_views(count):
         count /= 1000
     return f"{count:.1f}b views"
 
+def format_bytes(size_bytes):
+    if not size_bytes or size_bytes <= 0:
+        return 'unknown size'
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size_bytes < 1024:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024
+    return f"{size_bytes:.1f} PB"
+
+def is_storyboard(f):
+    return f.get('vcodec') == 'none' and f.get('acodec') == 'none' or f.get('ext') == 'mhtml'
+
+def parse_format_filters(data):
+    filters = {}
+    only = data.get('only')
+    if only:
+        if only not in ('audio', 'video', 'av'):
+            raise ValueError('only must be audio, video or av')
+        filters['only'] = only
+    for name in ('max_height', 'limit'):
+        if data.get(name) not in (None, ''):
+            try:
+                filters[name] = int(data[name])
+            except (TypeError, ValueError):
+                raise ValueError(f'{name} must be an integer') from None
+    if data.get('ext'):
+        filters['ext'] = str(data['ext']).lower()
+    sort = data.get('sort') or ('bitrate' if 'limit' in filters else None)
+    if sort:
+        if sort not in FORMAT_SORT_KEYS:
+            raise ValueError(f'sort must be one of {", ".join(FORMAT_SORT_KEYS)}')
+        filters['sort'] = sort
+    return filters
+
+def select_formats(formats, filters):
+    only = filters.get('only')
+    if only:
+        formats = [f for f in formats if not is_storyboard(f)]
+    if only == 'audio':
+        formats = [f for f in formats if f['vcodec'] == 'none']
+    elif only == 'video':
+        formats = [f for f in formats if f['vcodec'] != 'none']
+    elif only == 'av':
+        formats = [f for f in formats if f['vcodec'] != 'none' and f['acodec'] != 'none']
+    if 'max_height' in filters:
+        formats = [f for f in formats if (f['height'] or 0) <= filters['max_height']]
+    if 'ext' in filters:
+        formats = [f for f in formats if f['ext'] == filters['ext']]
+    if 'sort' in filters:
+        formats = sorted(formats, key=lambda f: f[FORMAT_SORT_KEYS[filters['sort']]] or 0, reverse=True)
+    if 'limit' in filters:
+        formats = formats[:max(filters['limit'], 0)]
+    return formats
+
+FORMAT_SORT_KEYS = {'bitrate': 'tbr', 'height': 'height', 'size': 'filesize_bytes'}
+
+def build_video_info(info, filters=None):
+    formats = info.get('formats', [])
+
+    simplified_formats = []
+    duration_sec = info.get('duration') or 0
+    for f in formats:
+        bitrate = f.get('tbr') or f.get('abr') or 0
+        estimated_size = bitrate * 1000 / 8 * duration_sec if bitrate and duration_sec else 0
+        size = f.get('filesize') or f.get('filesize_approx') or estimated_size
+
+        simplified_formats.append({
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'resolution': f.get('resolution') or f.get('height') or 'unknown',
+            'audio_quality': f.get('audio_quality') or f.get('asr') or 'unknown',
+            'note': f.get('format_note') or f.get('format') or 'unknown',
+            'filesize': format_bytes(size),
+            'filesize_bytes': int(size) if size else None,
+            'filesize_exact': bool(f.get('filesize')),
+            'width': f.get('width'),
+            'height': f.get('height'),
+            'fps': f.get('fps'),
+            'tbr': bitrate or None,
+            'vcodec': f.get('vcodec') or 'none',
+            'acodec': f.get('acodec') or 'none',
+        })
+
+    if filters:
+        simplified_formats = select_formats(simplified_formats, filters)
+
+    return {
+        'title': info.get('title'),
+        'thumbnail': info.get('thumbnail'),
+        'duration': str(timedelta(seconds=info.get('duration') or 0)),
+        'duration_seconds': info.get('duration'),
+        'view_count': format_views(info.get('view_count')),
+        'views': info.get('view_count'),
+        'formats': simplified_formats,
+    }
+
 @app.route('/')
 def index():
     return render_template('app.html')
 
-@app.route('/formats', methods=['POST'])
+@app.route('/formats', methods=['GET', 'POST'])
 def get_formats():
-    data = request.get_json(force=True, silent=True) or {}
+    if request.method == 'POST':
+        data = request.get_json(force=True, silent=True) or {}
+    else:
+        data = request.args
     url = (data.get('url') or '').strip()
 
     if not url:
         return jsonify({'error': 'No URL provided'}), 400
 
     try:
-        ydl_opts = {'quiet': True, 'skip_download': True, "cookiefile": temp_cookie_path}
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            formats = info.get('formats', [])
-
-        def format_bytes(size_bytes):
-            if not size_bytes or size_bytes <= 0:
-                return 'unknown size'
-            for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-                if size_bytes < 1024:
-                    return f"{size_bytes:.1f} {unit}"
-                size_bytes /= 1024
-            return f"{size_bytes:.1f} PB"
-
-        simplified_formats = []
-        duration_sec = info.get('duration') or 0
-        for f in formats:
-            bitrate = f.get('tbr') or f.get('abr') or 0
-            estimated_size = bitrate * 1000 / 8 * duration_sec if bitrate and duration_sec else 0
-
-            simplified_formats.append({
-                'format_id': f.get('format_id'),
-                'ext': f.get('ext'),
-                'resolution': f.get('resolution') or f.get('height') or 'unknown',
-                'audio_quality': f.get('audio_quality') or f.get('asr') or 'unknown',
-                'note': f.get('format_note') or f.get('format') or 'unknown',
-                'filesize': format_bytes(
-                    f.get('filesize') or
-                    f.get('filesize_approx') or
-                    estimated_size
-                ),
-            })
-
-        video_info = {
-            'title': info.get('title'),
-            'thumbnail': info.get('thumbnail'),
-            'duration': str(timedelta(seconds=info.get('duration', 0))),
-            'view_count': format_views(info.get('view_count')),
-            'formats': simplified_formats,
-        }
+        filters = parse_format_filters(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        return jsonify(video_info)
+    try:
+        info = formats_cache.get_or_load(video_key(url), lambda: extract_info(url))
+        return cached_json(build_video_info(info, filters), FORMATS_MAX_AGE)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/download', methods=['POST'])
+@app.route('/formats/batch', methods=['POST'])
+def get_formats_batch():
+    data = request.get_json(force=True, silent=True) or {}
+    urls = data.get('urls')
+
+    if not isinstance(urls, list) or not urls:
+        return jsonify({'error': 'No URLs provided'}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({'error': f'At most {BATCH_MAX_URLS} URLs per batch'}), 400
+
+    try:
+        filters = parse_format_filters(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # one lookup per distinct video, however many times or ways it is spelled
+    by_key = {}
+    for i, url in enumerate(urls):
+        url = (url or '').strip() if isinstance(url, str) else ''
+        key = video_key(url) if url else None
+        by_key.setdefault(key, []).append((i, url))
+
+    def lookup(key, url):
+        if key is None:
+            raise ValueError('No URL provided')
+        return build_video_info(formats_cache.get_or_load(key, lambda: extract_info(url)), filters)
+
+    def stream():
+        futures = {
+            batch_executor.submit(lookup, key, items[0][1]): items
+            for key, items in by_key.items()
+        }
+        try:
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'error': str(e)}
+                for i, url in futures[future]:
+                    yield json.dumps({'index': i, 'url': url, **result}) + '\n'
+        finally:
+            # the client may have gone away; lookups still waiting for a
+            # worker would only hold up other batches
+            for future in futures:
+                future.cancel()
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/playlist', methods=['GET', 'POST'])
+def playlist():
+    if request.method == 'POST':
+        data = request.get_json(force=True, silent=True) or {}
+    else:
+        data = request.args
+    url = (data.get('url') or '').strip()
+    cursor = data.get('cursor') or ''
+
+    if not url:
+        return jsonify({'error': 'No URL provided'}), 400
+    try:
+        limit = min(max(int(data.get('limit') or PLAYLIST_PAGE_SIZE), 1), PLAYLIST_MAX_PAGE_SIZE)
+        offset = int(cursor.split('.', 1)[0] or 0)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+
+    state = playlist_cursors.take(cursor.split('.', 1)[1]) if '.' in cursor else None
+    if state is not None and state['url'] != url:
+        ydl_pool.release(state['ydl'])
+        state = None
+    if state is None:
+        ydl = ydl_pool.acquire('playlist')
+        try:
+            result = ydl.extract_info(url, download=False, process=False)
+        except Exception as e:
+            ydl_pool.release(ydl)
+            return jsonify({'error': str(e)}), 500
+        state = {
+            'url': url,
+            'ydl': ydl,
+            'entries': iter_entries(result, offset),
+            'playlist': {
+                'type': 'playlist',
+                'id': result.get('id'),
+                'title': result.get('title'),
+                'uploader': result.get('uploader') or result.get('channel'),
+                'playlist_count': result.get('playlist_count'),
+                'is_playlist': 'entries' in result,
+            },
+        }
+
+    def stream():
+        # the instance goes back to the pool unless a cursor keeps it, also
+        # when the client disconnects mid-page
+        next_cursor = None
+        try:
+            yield json.dumps(state['playlist']) + '\n'
+            entries = state['entries']
+            index = offset
+            try:
+                for entry in itertools.islice(entries, limit):
+                    yield json.dumps({'type': 'entry', 'index': index, **flat_entry(entry)}) + '\n'
+                    index += 1
+                following = next(entries, None)
+            except Exception as e:
+                yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+                return
+
+            if following is not None:
+                state['entries'] = itertools.chain([following], entries)
+                next_cursor = f'{index}.{playlist_cursors.save(state)}'
+            yield json.dumps({'type': 'page', 'count': index - offset, 'next_cursor': next_cursor}) + '\n'
+        finally:
+            if next_cursor is None:
+                ydl_pool.release(state['ydl'])
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/download/stats')
+def download_stats():
+    return jsonify({'download': download_slots.stats(), 'transcode': transcode_slots.stats()})
+
+@app.route('/formats/stats')
+def formats_stats():
+    return jsonify({**formats_cache.stats(), 'ydl_pool': ydl_pool.stats(), 'artifacts': artifacts.stats()})
+
+def client_key():
+    # every proxy appends the address it got the request from, so only the
+    # entries added by our own proxies can be trusted; anything left of
+    # them was sent by the client
+    hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    if TRUSTED_PROXIES and len(hops) >= TRUSTED_PROXIES:
+        return hops[-TRUSTED_PROXIES]
+    return request.remote_addr or 'unknown'
+
+def overloaded(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.route('/download', methods=['GET', 'POST'])
 def download():
-    data = request.json
-    url = data.get('url', '').strip()
+    start = time.perf_counter()
+    try:
+        slot = download_slots.acquire(client_key())
+    except Overloaded as e:
+        return overloaded(e)
+
+    try:
+        response = make_response(stream_download())
+    except Overloaded as e:
+        slot.release()
+        return overloaded(e)
+    except Exception:
+        slot.release()
+        raise
+    if response.direct_passthrough:
+        # file responses go straight to the server's file wrapper and never
+        # run close callbacks; serving them from disk needs no slot anyway
+        slot.release()
+    else:
+        response.call_on_close(slot.release)
+    return meter_download(response, start)
+
+def meter_download(response, start):
+    mode = g.get('download_mode', 'error')
+    extractor = g.get('download_extractor', 'generic')
+    if request.method == 'HEAD' or response.status_code >= 300:
+        return response
+
+    def first_byte():
+        download_ttfb_seconds.observe(time.perf_counter() - start, mode)
+
+    def finished(sent, failed=False):
+        download_inflight.dec()
+        if failed:
+            extractor_errors.inc(1, extractor, 'stream')
+        download_bytes.inc(sent, mode)
+        download_seconds.observe(time.perf_counter() - start, mode)
+
+    if response.direct_passthrough:
+        # left unwrapped so the server can still use sendfile; the size is
+        # known up front and nothing reports when the transfer ends
+        first_byte()
+        download_bytes.inc(response.content_length or 0, mode)
+        download_seconds.observe(time.perf_counter() - start, mode)
+    else:
+        download_inflight.inc()
+        response.response = MeteredBody(response.response, first_byte, finished)
+    return response
+
+def stream_download():
+    if request.method == 'POST':
+        data = request.get_json(force=True, silent=True) or {}
+    else:
+        data = request.args
+    url = (data.get('url') or '').strip()
     format_type = data.get('format', 'video')
     quality = data.get('quality', 'best')
 
     if not url or not quality:
         return jsonify({'error': 'Missing URL or format selection'}), 400
 
-    ext = 'mp3' if format_type == 'audio' else 'mp4'
-    filename = f"download-{uuid.uuid4()}.{ext}"
-    buffer = io.BytesIO()
-
-    def ydl_stream():
-        ydl_opts = {
-            'quiet': True,
-            'format': quality,
-            'outtmpl': '-',
-            'noplaylist': True,
-            'logtostderr': False,
-            'progress_hooks': [],
-            'postprocessors': [],
-            'buffer': buffer,
-            "cookiefile": temp_cookie_path
-        }
+    bitrate = parse_bitrate(data.get('bitrate'))
+    if bitrate is None:
+        return jsonify({'error': f'Unsupported bitrate, use one of {AUDIO_BITRATES}'}), 400
+
+    codec = data.get('codec', 'mp3')
+    if codec not in ('mp3', 'original'):
+        return jsonify({'error': 'Unsupported codec, use mp3 or original'}), 400
+
+    passthrough = format_type == 'audio' and codec == 'original'
+
+    try:
+        info = formats_cache.get_or_load(video_key(url), lambda: extract_info(url))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    extractor = g.download_extractor = info.get('extractor_key') or 'generic'
+
+    # the upstream response keeps working after the instance goes back
+    # to the pool, so it is only held while the request is being opened
+    upstream = None
+    with ydl_pool.checkout('download') as ydl:
+        # without audio-only formats, the audio is copied out of a muxed one
+        fmt = (passthrough and best_audio_format(info, quality)) or select_format(ydl, info, quality)
+        if fmt is None:
+            return jsonify({'error': f'Requested format is not available: {quality}'}), 400
+
+        remux_args = None
+        if passthrough:
+            delivery = audio_passthrough(fmt)
+            if delivery is None:
+                passthrough = False
+            else:
+                out_ext, mimetype, remux_args = delivery
+        if format_type == 'audio' and not passthrough:
+            out_ext, mimetype = 'mp3', 'audio/mpeg'
+        elif format_type != 'audio':
+            out_ext = fmt.get('ext') or 'mp4'
+            if not is_direct(fmt):
+                remux_args = video_remux(fmt)
+                if remux_args:
+                    out_ext = 'mp4'
+            mimetype = mimetypes.guess_type(f'media.{out_ext}')[0] or 'application/octet-stream'
+
+        key = media_key(info, fmt.get('format_id') or quality, format_type,
+                        'original' if passthrough else 'mp3', bitrate)
+        filename = f"download-{key[:16]}.{out_ext}"
+
+        cached = artifacts.get(key)
+        if cached:
+            g.download_mode = 'cached'
+            # a job may have stored the same media in another container, e.g.
+            # m4a where a stream copies the audio out as adts
+            cached_ext = cached.rsplit('.', 1)[-1]
+            if cached_ext != out_ext:
+                filename = f"download-{key[:16]}.{cached_ext}"
+                mimetype = (AUDIO_MIMETYPES.get(cached_ext) if format_type == 'audio'
+                            else mimetypes.guess_type(cached)[0]) or 'application/octet-stream'
+            return send_artifact(cached, filename, mimetype=mimetype)
+
+        ffmpeg_args = mp3_args(bitrate) if format_type == 'audio' and not passthrough else remux_args
+        if ffmpeg_args and ffmpeg_path() is None:
+            # checked here, while an error can still be sent as a status
+            # instead of an empty body
+            return jsonify({'error': 'ffmpeg is not available on this server'}), 503
+        transcode_slot = None
+        if ffmpeg_args and request.method != 'HEAD':
+            transcode_slot = transcode_slots.acquire(client_key())
+
+        if is_direct(fmt):
+            try:
+                upstream = open_direct(ydl, fmt)
+            except Exception as e:
+                if transcode_slot:
+                    transcode_slot.release()
+                extractor_errors.inc(1, extractor, 'open')
+                return jsonify({'error': str(e)}), 502
+
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"', 'Accept-Ranges': 'none'}
+    if ffmpeg_args is None and upstream is not None and upstream.headers.get('Content-Length'):
+        headers['Content-Length'] = upstream.headers['Content-Length']
+
+    if request.method == 'HEAD':
+        if upstream is not None:
+            upstream.close()
+        return Response(mimetype=mimetype, headers=headers)
+
+    if upstream is not None:
+        g.download_mode = 'direct'
+        chunks = iter_response(upstream)
+    else:
+        g.download_mode = 'ytdlp'
+        if temp_cookie_path:
+            cookiefile_uses.inc(1, 'download')
+        chunks = iter_ytdlp_process(info, fmt.get('format_id') or quality, cookiefile=temp_cookie_path)
+    if ffmpeg_args:
+        g.download_mode = 'transcode'
+        chunks = iter_transcode(chunks, ffmpeg_args)
+    chunks = tee_to_cache(chunks, artifacts, key, out_ext)
+
+    response = Response(
+        pump(chunks),
+        mimetype=mimetype,
+        headers=headers
+    )
+    if transcode_slot:
+        response.call_on_close(transcode_slot.release)
+    return response
 
-        if format_type == 'audio':
-            ydl_opts['postprocessors'] = [{
+def download_to(tmpdir, info, quality, profile, **overrides):
+    overrides = {'format': quality, 'outtmpl': os.path.join(tmpdir, 'media.%(ext)s'), **overrides}
+    with ydl_pool.checkout(profile, **overrides) as ydl:
+        result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+    return result['requested_downloads'][0]['filepath']
+
+def media_key(info, quality, format_type, codec='mp3', bitrate=None):
+    settings = {}
+    if format_type == 'audio':
+        settings = {'codec': codec}
+        if codec == 'mp3':
+            settings['bitrate'] = bitrate
+    return artifact_key(info.get('extractor_key'), info.get('id'), quality, format_type, **settings)
+
+def parse_bitrate(value):
+    try:
+        bitrate = int(value or default_bitrate)
+    except (TypeError, ValueError):
+        return None
+    return bitrate if bitrate in AUDIO_BITRATES else None
+
+def run_job(job):
+    url = job.params['url']
+    format_type = job.params['format_type']
+    info = formats_cache.get_or_load(video_key(url), lambda: extract_info(url))
+
+    def postprocessor_hook(d):
+        if d.get('status') == 'started':
+            job.publish('phase', phase='processing')
+
+    quality = job.params['quality']
+    codec = job.params['codec'] if format_type == 'audio' else 'mp3'
+    bitrate = job.params['bitrate']
+    fmt = best_audio_format(info, quality) if codec == 'original' else None
+    if fmt is not None:
+        quality = fmt['format_id']
+
+    key = media_key(info, quality, format_type, codec, bitrate)
+    job.path = artifacts.link_into(key, job.tmpdir)
+    if job.path is None:
+        overrides = {}
+        if format_type == 'audio' and codec == 'mp3':
+            overrides['postprocessors'] = [{
                 'key': 'FFmpegExtractAudio',
                 'preferredcodec': 'mp3',
-                'preferredquality': '192',
-                "cookiefile": temp_cookie_path
+                'preferredquality': str(bitrate),
             }]
+        elif format_type == 'audio' and fmt is None:
+            # no audio-only format to hand over as is; 'best' copies the
+            # audio track out of the muxed download without re-encoding
+            overrides['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'best'}]
+        job.publish('phase', phase='downloading')
+        job.path = download_to(
+            job.tmpdir, info, quality,
+            'audio' if format_type == 'audio' else 'download',
+            progress_hooks=[job.progress],
+            postprocessor_hooks=[postprocessor_hook],
+            **overrides,
+        )
+        artifacts.store(key, job.path)
+    else:
+        job.publish('phase', phase='cached')
+    ext = job.path.rsplit('.', 1)[-1]
+    job.size = os.path.getsize(job.path)
+    job.filename = f"download-{job.id}.{ext}"
+    if format_type == 'audio':
+        job.mimetype = AUDIO_MIMETYPES.get(ext, 'application/octet-stream')
+    else:
+        job.mimetype = mimetypes.guess_type(job.path)[0] or 'application/octet-stream'
 
-        class StreamWrapper(io.RawIOBase):
-            def writable(self): return True
-            def write(self, b):
-                buffer.write(b)
-                yield b
+jobs = JobManager(
+    run_job,
+    workers=int(os.getenv("JOB_WORKERS", 2)),
+    ttl=int(os.getenv("JOB_TTL", 3600)),
+)
 
-        try:
-            with YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-                buffer.seek(0)
-                while True:
-                    chunk = buffer.read(8192)
-                    if not chunk:
-                        break
-                    yield chunk
-        except Exception as e:
-            yield f"Error: {str(e)}".encode('utf-8')
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    data = request.get_json(force=True, silent=True) or {}
+    url = (data.get('url') or '').strip()
+    quality = data.get('quality', 'best')
+
+    if not url or not quality:
+        return jsonify({'error': 'Missing URL or format selection'}), 400
+
+    bitrate = parse_bitrate(data.get('bitrate'))
+    if bitrate is None:
+        return jsonify({'error': f'Unsupported bitrate, use one of {AUDIO_BITRATES}'}), 400
+
+    codec = data.get('codec', 'mp3')
+    if codec not in ('mp3', 'original'):
+        return jsonify({'error': 'Unsupported codec, use mp3 or original'}), 400
+
+    try:
+        job = jobs.submit(
+            url=url,
+            format_type=data.get('format', 'video'),
+            quality=quality,
+            codec=codec,
+            bitrate=bitrate,
+        )
+    except OverflowError as e:
+        return jsonify({'error': str(e)}), 503
+
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'events': f'/jobs/{job.id}/events',
+        'result': f'/jobs/{job.id}/result',
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    last_id = request.headers.get('Last-Event-ID', '')
+    start = int(last_id) + 1 if last_id.isdigit() else 0
+
+    def stream():
+        yield 'retry: 2000\n\n'
+        for item in job.iter_events(start):
+            if item is None:
+                yield ': keepalive\n\n'
+            else:
+                yield sse(*item)
 
     return Response(
-        ydl_stream(),
-        mimetype='application/octet-stream',
-        headers={
-            'Content-Disposition': f'attachment; filename="{filename}"'
-        }
+        stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
 
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    if job.status != 'finished':
+        return jsonify({'error': 'Job is not finished', 'status': job.status}), 409
+
+    return send_artifact(job.path, job.filename, mimetype=job.mimetype)
+
 if __name__ == '__main__':
     app.run(debug=True, port=8000)
\ No newline at end of file
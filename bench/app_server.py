@@ -0,0 +1,37 @@
+"""Runs ``api/index.py`` with the fake extractor registered, on a threaded
+werkzeug server. Prints the base url on the first line of stdout.
+
+    BENCH_MEDIA_URL=http://127.0.0.1:8765 python -m bench.app_server --port 8000
+"""
+import argparse
+import logging
+import os
+import sys
+
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+import index  # noqa: E402
+from bench.fake_extractor import BenchIE  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    index.ydl_pool.add_extractor(BenchIE)
+
+    server = make_server(args.host, args.port, index.app, threaded=True)
+    print(f'http://{args.host}:{server.server_port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
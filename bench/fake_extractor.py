@@ -0,0 +1,65 @@
+"""A yt-dlp extractor that fabricates ``info`` dicts instead of hitting a site.
+
+    https://bench.invalid/v/<id>?formats=40&size=20000000&delay=0.05
+
+``formats`` sets how many formats are listed (a mix of muxed, video-only and
+audio-only), ``size`` the number of bytes each format serves and ``delay``
+how long extraction pretends to take. ``bandwidth`` and ``latency`` are
+passed through to the media server. Format urls point at
+``BENCH_MEDIA_URL``, a running ``bench.media_server``.
+"""
+import os
+import time
+from urllib.parse import urlencode
+
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.utils import parse_qs
+
+
+HEIGHTS = (144, 240, 360, 480, 720, 1080, 1440, 2160)
+
+
+class BenchIE(InfoExtractor):
+    IE_NAME = 'bench'
+    _VALID_URL = r'https?://bench\.invalid/v/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        query = {k: v[-1] for k, v in parse_qs(url).items()}
+        count = int(query.get('formats', 20))
+        size = int(query.get('size', 1024 * 1024))
+        delay = float(query.get('delay', 0))
+        shaping = urlencode({k: query[k] for k in ('bandwidth', 'latency') if k in query})
+        media = os.getenv('BENCH_MEDIA_URL', 'http://127.0.0.1:8765').rstrip('/')
+
+        if delay:
+            time.sleep(delay)
+
+        formats = []
+        for i in range(count):
+            kind = ('av', 'video', 'audio')[i % 3]
+            height = HEIGHTS[(i // 3) % len(HEIGHTS)]
+            format_id = f'{kind}-{i}'
+            fmt = {
+                'format_id': format_id,
+                'url': f'{media}/media/{size}/{video_id}-{format_id}' + (f'?{shaping}' if shaping else ''),
+                'ext': 'm4a' if kind == 'audio' else 'mp4',
+                'filesize': size,
+                'tbr': 128 + i,
+                'vcodec': 'none' if kind == 'audio' else 'avc1.64001F',
+                'acodec': 'none' if kind == 'video' else 'mp4a.40.2',
+            }
+            if kind != 'audio':
+                fmt.update(width=height * 16 // 9, height=height, fps=30)
+            else:
+                fmt['abr'] = 128 + i
+            formats.append(fmt)
+
+        return {
+            'id': video_id,
+            'title': f'bench {video_id}',
+            'duration': 600,
+            'view_count': 1000,
+            'thumbnail': f'{media}/media/1024/{video_id}.jpg',
+            'formats': formats,
+        }
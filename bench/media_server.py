@@ -0,0 +1,192 @@
+"""Local HTTP server serving synthetic media of any size.
+
+``GET /media/<size>[/<name>]`` returns ``size`` bytes where the byte at
+offset ``n`` is ``n % 256``, so clients can check ranged or resumed
+transfers without a reference file. ``HEAD`` and single ``Range`` requests
+are supported, with ``If-Range`` checked against the ETag. ``bandwidth``
+(bytes/sec per connection) and ``latency`` (seconds before the response
+starts) can be set server-wide or per request with query parameters of the
+same name. For retry tests, ``fail=N`` answers the first N requests for a url
+with 503 and ``drop=N`` cuts the first response longer than N bytes there;
+``length=unknown`` leaves the total out of ``Content-Range`` (``bytes 0-0/*``).
+Bumping ``server.version`` changes the ETag, as if the file was replaced.
+
+    python -m bench.media_server --port 8765 --bandwidth 5000000 --latency 0.1
+"""
+import argparse
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+BLOCK = 64 * 1024
+_PATTERN = bytes(range(256)) * (BLOCK // 256 + 1)
+
+
+def media_bytes(start, end):
+    """The synthetic content for ``[start, end)``, for checking downloads."""
+    out = bytearray()
+    while start < end:
+        n = min(end - start, BLOCK)
+        offset = start % 256
+        out += _PATTERN[offset:offset + n]
+        start += n
+    return bytes(out)
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body):
+        parts = urlsplit(self.path)
+        match = re.fullmatch(r'/media/(\d+)(?:/.*)?', parts.path)
+        if not match:
+            self.send_error(404)
+            return
+        query = parse_qs(parts.query)
+        bandwidth = float(query.get('bandwidth', [self.server.bandwidth])[0])
+        latency = float(query.get('latency', [self.server.latency])[0])
+        size = int(match.group(1))
+        etag = f'"media-{size}-v{self.server.version}"'
+
+        if latency:
+            time.sleep(latency)
+        with self.server.lock:
+            self.server.requests += 1
+            seen = self.server.seen[self.path] = self.server.seen.get(self.path, 0) + 1
+        if seen <= int(query.get('fail', [0])[0]):
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = 0, size
+        status = 200
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and self.server.ranges and if_range in (None, etag):
+            m = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+            if m and (m.group(1) or m.group(2)):
+                if m.group(1):
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)) + 1, size) if m.group(2) else size
+                else:
+                    start = max(size - int(m.group(2)), 0)
+                if start >= size or start >= end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status = 206
+
+        drop = None
+        if 'drop' in query and end - start > int(query['drop'][0]):
+            with self.server.lock:
+                if self.path not in self.server.dropped:
+                    self.server.dropped.add(self.path)
+                    drop = int(query['drop'][0])
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('ETag', etag)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            total = '*' if query.get('length') == ['unknown'] else size
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{total}')
+        self.end_headers()
+        if body:
+            self._write(start, end, bandwidth, drop)
+
+    def _write(self, start, end, bandwidth, drop=None):
+        began = time.monotonic()
+        sent = 0
+        try:
+            while start < end:
+                n = min(end - start, BLOCK)
+                if drop is not None and sent + n > drop:
+                    n = drop - sent
+                    self.wfile.write(_PATTERN[start % 256:start % 256 + n])
+                    self.close_connection = True
+                    return
+                offset = start % 256
+                self.wfile.write(_PATTERN[offset:offset + n])
+                start += n
+                sent += n
+                with self.server.lock:
+                    self.server.bytes_sent += n
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), bandwidth=0, latency=0, ranges=True):
+        super().__init__(address, MediaHandler)
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.ranges = ranges
+        self.lock = threading.Lock()
+        self.version = 1
+        self.requests = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self.seen = {}
+        self.dropped = set()
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def serve(**kwargs):
+    """Start a server on a background thread and return it."""
+    server = MediaServer(**kwargs)
+    threading.Thread(target=server.serve_forever, name='media-server', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--bandwidth', type=float, default=0, help='bytes/sec per connection, 0 for unlimited')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before each response starts')
+    parser.add_argument('--no-ranges', action='store_true', help='ignore Range headers')
+    args = parser.parse_args()
+
+    server = MediaServer((args.host, args.port), args.bandwidth, args.latency, not args.no_ranges)
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
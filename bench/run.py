@@ -0,0 +1,269 @@
+"""Offline benchmark for ``/formats`` and ``/download``.
+
+Starts ``bench.media_server`` and ``bench.app_server`` as subprocesses,
+drives the app with concurrent clients and prints a JSON report: requests/sec,
+p50/p99 latency and time to first byte per scenario, plus the app's peak RSS
+while the scenario ran.
+
+    python -m bench.run > bench_output.txt
+    python -m bench.run --scenario download --scale 0.5 --compare bench_output.txt
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+import yt_dlp
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+SCENARIOS = {
+    'formats-cold': {'kind': 'formats', 'requests': 200, 'concurrency': 8, 'unique': True,
+                     'params': {'formats': 40}},
+    'formats-warm': {'kind': 'formats', 'requests': 1000, 'concurrency': 16, 'unique': False,
+                     'params': {'formats': 40}},
+    'download': {'kind': 'download', 'requests': 24, 'concurrency': 8, 'unique': True,
+                 'params': {'formats': 12, 'size': 20 * MB}},
+    'download-shaped': {'kind': 'download', 'requests': 16, 'concurrency': 8, 'unique': True,
+                        'params': {'formats': 12, 'size': 5 * MB, 'bandwidth': 10 * MB, 'latency': 0.1}},
+    'download-cached': {'kind': 'download', 'requests': 48, 'concurrency': 8, 'unique': False,
+                        'params': {'formats': 12, 'size': 20 * MB}},
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summary(values):
+    if not values:
+        return None
+    return {
+        'p50': round(percentile(values, 50), 6),
+        'p99': round(percentile(values, 99), 6),
+        'mean': round(sum(values) / len(values), 6),
+        'max': round(max(values), 6),
+    }
+
+
+class RssSampler:
+    """Polls a process's resident set size; ``peak`` is the highest value
+    seen since the last ``reset``."""
+
+    def __init__(self, pid, interval=0.01):
+        self.path = f'/proc/{pid}/status'
+        self.interval = interval
+        self.peak = self.current()
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, name='rss-sampler', daemon=True).start()
+
+    def current(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+
+    def reset(self):
+        self.peak = self.current()
+        return self.peak
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self.current()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def stop(self):
+        self._stop.set()
+
+
+def spawn(module, env, *args):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', module, *args], cwd=ROOT, env=env,
+        stdout=subprocess.PIPE, text=True,
+    )
+    url = proc.stdout.readline().strip()
+    if not url:
+        proc.kill()
+        raise RuntimeError(f'{module} did not start')
+    return proc, url
+
+
+def fetch(base, method, path, body=None):
+    parts = urlsplit(base)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=300)
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    start = time.perf_counter()
+    ttfb = None
+    size = 0
+    try:
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        while True:
+            chunk = response.read1(256 * 1024)
+            if not chunk:
+                break
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = None
+    finally:
+        conn.close()
+    return {'status': status, 'latency': time.perf_counter() - start, 'ttfb': ttfb, 'bytes': size}
+
+
+def scenario_requests(name, spec, run_id, scale):
+    count = max(1, int(spec['requests'] * scale))
+    query = '&'.join(f'{k}={v}' for k, v in spec['params'].items())
+    for i in range(count):
+        video_id = f'{run_id}-{name}-{i if spec["unique"] else 0}'
+        url = f'https://bench.invalid/v/{video_id}?{query}'
+        if spec['kind'] == 'formats':
+            yield 'GET', f'/formats?url={quote(url, safe="")}', None
+        else:
+            yield 'POST', '/download', {'url': url, 'quality': 'best'}
+
+
+def run_scenario(base, sampler, name, spec, run_id, scale):
+    requests = list(scenario_requests(name, spec, run_id, scale))
+    if not spec['unique']:
+        # one untimed request so repeated-id scenarios measure the warm path
+        fetch(base, *requests[0])
+
+    baseline = sampler.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=spec['concurrency']) as pool:
+        results = list(pool.map(lambda r: fetch(base, *r), requests))
+    elapsed = time.perf_counter() - start
+    peak = sampler.peak
+
+    ok = [r for r in results if r['status'] is not None and r['status'] < 400]
+    sent = sum(r['bytes'] for r in ok)
+    report = {
+        'name': name,
+        'kind': spec['kind'],
+        'requests': len(results),
+        'concurrency': spec['concurrency'],
+        'params': spec['params'],
+        'errors': len(results) - len(ok),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(results) / elapsed, 2),
+        'latency': summary([r['latency'] for r in ok]),
+        'ttfb': summary([r['ttfb'] for r in ok if r['ttfb'] is not None]),
+        'bytes': sent,
+        'throughput_mb_s': round(sent / MB / elapsed, 2),
+        'rss_baseline_bytes': baseline,
+        'rss_peak_bytes': peak,
+    }
+    if spec['kind'] == 'download' and peak is not None and baseline is not None:
+        report['rss_peak_per_download_bytes'] = (peak - baseline) // min(spec['concurrency'], len(results))
+    return report
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                             capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(previous, current):
+    old = {s['name']: s for s in previous['scenarios']}
+    lines = []
+    for s in current['scenarios']:
+        before = old.get(s['name'])
+        if not before:
+            continue
+        for label, get in (('rps', lambda x: x['rps']),
+                           ('p99', lambda x: (x['latency'] or {}).get('p99')),
+                           ('ttfb p99', lambda x: (x['ttfb'] or {}).get('p99')),
+                           ('rss peak', lambda x: x['rss_peak_bytes'])):
+            a, b = get(before), get(s)
+            if a and b is not None:
+                lines.append(f'{s["name"]:<16} {label:<9} {a:>14} -> {b:<14} {(b - a) / a * 100:+.1f}%')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='run only these scenarios (repeatable)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply request counts')
+    parser.add_argument('--bandwidth', type=float, default=0, help='media server default bytes/sec per connection')
+    parser.add_argument('--latency', type=float, default=0, help='media server default latency in seconds')
+    parser.add_argument('--output', default='-', help='report path, - for stdout')
+    parser.add_argument('--compare', help='previous report to diff against (printed to stderr)')
+    args = parser.parse_args()
+
+    names = args.scenario or list(SCENARIOS)
+    cache_dir = tempfile.mkdtemp(prefix='bench-artifacts-')
+    env = dict(os.environ)
+
+    media, media_url = spawn('bench.media_server', env,
+                             '--bandwidth', str(args.bandwidth), '--latency', str(args.latency))
+    app = None
+    try:
+        env.update(BENCH_MEDIA_URL=media_url, ARTIFACT_CACHE_DIR=cache_dir)
+        app, base = spawn('bench.app_server', env)
+        sampler = RssSampler(app.pid)
+        run_id = f'{int(time.time()):x}'
+
+        scenarios = []
+        for name in names:
+            print(f'running {name}...', file=sys.stderr)
+            scenarios.append(run_scenario(base, sampler, name, SCENARIOS[name], run_id, args.scale))
+        sampler.stop()
+    finally:
+        for proc in (app, media):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'yt_dlp': yt_dlp.version.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scale': args.scale,
+        },
+        'scenarios': scenarios,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), report), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
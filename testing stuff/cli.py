@@ -1,8 +1,7 @@
 import os
 import re
 import json
-import threading
-import queue
+import asyncio
 import time
 from pytube import YouTube, Playlist
 from rich.console import Console
@@ -10,6 +9,8 @@ from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn, TimeEl
 from rich.table import Table
 from tqdm import tqdm
 
+from modules import ratelimit, scheduler
+
 console = Console()
 CONFIG_FILE = "yt_downloader_config.json"
 LOG_FILE = "yt_downloader_log.txt"
@@ -21,7 +22,10 @@ class Config:
             "output_path": "downloads",
             "audio_only": False,
             "max_threads": 4,
-            "dry_run": False
+            "max_per_host": 2,
+            "dry_run": False,
+            "max_rate": 0,
+            "max_requests": 0
         }
         self.load()
 
@@ -46,6 +50,11 @@ class Config:
 
 config = Config()
 
+def make_limiter():
+    if not config["max_rate"] and not config["max_requests"]:
+        return None
+    return ratelimit.Limiter(rate=config["max_rate"], requests=config["max_requests"])
+
 def log(message):
     with open(LOG_FILE, 'a') as f:
         f.write(f"[{time.ctime()}] {message}\n")
@@ -69,14 +78,22 @@ def print_video_info(info):
         table.add_row(k, str(v))
     console.print(table)
 
-def download_video(url, output_path, audio_only=False, dry_run=False):
+def download_video(url, output_path, audio_only=False, dry_run=False, limiter=None, on_chunk=None):
+    def on_progress(stream, chunk, bytes_remaining):
+        if limiter:
+            limiter.consume(stream.url, len(chunk))
+        if on_chunk:
+            on_chunk()
+
     try:
-        yt = YouTube(url)
+        yt = YouTube(url, on_progress_callback=on_progress)
         title = sanitize_filename(yt.title)
         stream = yt.streams.filter(only_audio=True).first() if audio_only else yt.streams.get_highest_resolution()
         if dry_run:
             console.print(f"[DRY RUN] {title}")
             return True
+        if limiter:
+            limiter.request(stream.url)
         path = stream.download(output_path=output_path, filename=title + (".mp3" if audio_only else ".mp4"))
         log(f"Downloaded: {yt.title}")
         return True
@@ -84,51 +101,67 @@ def download_video(url, output_path, audio_only=False, dry_run=False):
         log(f"Failed: {url} | Error: {e}")
         return False
 
-def download_playlist(playlist_url, output_path, audio_only=False, dry_run=False):
-    try:
-        playlist = Playlist(playlist_url)
-        urls = playlist.video_urls
-        console.print(f"[green]Downloading Playlist: {playlist.title} with {len(urls)} videos[/green]")
-        for url in urls:
-            download_video(url, output_path, audio_only=audio_only, dry_run=dry_run)
-    except Exception as e:
-        log(f"Playlist failed: {playlist_url} | Error: {e}")
+def is_playlist(url):
+    return scheduler.normalize_url(url).startswith("youtube-playlist:")
 
-def batch_download_from_file(file_path, output_path, audio_only=False, dry_run=False, max_threads=4):
-    q = queue.Queue()
-    results = []
+def run_batch(files=(), urls=(), output_path="downloads", audio_only=False, dry_run=False, max_threads=4,
+              per_host=2, limiter=None):
+    """Download everything in ``files`` (one url per line, optionally followed by a priority)
+    and ``urls``; playlists are expanded into the same pool. Results print as they finish."""
+    def download(url):
+        if not download_video(url, output_path, audio_only=audio_only, dry_run=dry_run, limiter=limiter,
+                              on_chunk=lambda: progress.update(task, description=status())):
+            raise RuntimeError("download failed, see log")
+        return True
 
-    def worker():
-        while True:
-            url = q.get()
-            if url is None:
-                break
-            success = download_video(url, output_path, audio_only=audio_only, dry_run=dry_run)
-            results.append((url, success))
-            q.task_done()
+    def expand(url):
+        if limiter:
+            limiter.request(url)
+        return Playlist(url).video_urls
 
-    with open(file_path, 'r') as f:
-        urls = [line.strip() for line in f if line.strip()]
+    def status():
+        return f"Downloading ({limiter.describe()})" if limiter else "Downloading"
 
+    batch = scheduler.Scheduler(download, expand, concurrency=max_threads, per_host=per_host)
+    for path in files:
+        batch.add_file(path, is_playlist=is_playlist)
     for url in urls:
-        q.put(url)
+        batch.add(url, playlist=is_playlist(url))
+
+    async def consume():
+        async for result in batch.run():
+            if result.job.playlist:
+                if result.ok:
+                    progress.console.print(f"[green]Playlist {result.url}: {result.value} new videos[/green]")
+                else:
+                    log(f"Playlist failed: {result.url} | Error: {result.error}")
+                    progress.console.print(f"[red]Playlist failed: {result.url} ({result.error})[/red]")
+            elif result.ok:
+                progress.console.print(f"[green]Done[/green] {result.url} ({result.elapsed:.1f}s)")
+            else:
+                progress.console.print(f"[red]Failed[/red] {result.url} ({result.error})")
+            progress.update(task, total=batch.stats["queued"], completed=batch.stats["done"] + batch.stats["failed"],
+                            description=status())
 
-    threads = []
-    for _ in range(min(max_threads, len(urls))):
-        t = threading.Thread(target=worker)
-        t.start()
-        threads.append(t)
+    with Progress(SpinnerColumn(), TextColumn("{task.description}"), BarColumn(),
+                  TextColumn("{task.completed}/{task.total}"), TimeElapsedColumn(), console=console) as progress:
+        task = progress.add_task(status(), total=batch.stats["queued"])
+        asyncio.run(consume())
 
-    q.join()
+    stats = batch.stats
+    console.print(f"[green]Completed batch download. Success: {stats['done']}, Failures: {stats['failed']}, "
+                  f"Duplicates skipped: {stats['duplicates']}[/green]")
+    return stats
 
-    for _ in threads:
-        q.put(None)
-    for t in threads:
-        t.join()
+def download_playlist(playlist_url, output_path, audio_only=False, dry_run=False, limiter=None,
+                      max_threads=4, per_host=2):
+    return run_batch(urls=[playlist_url], output_path=output_path, audio_only=audio_only, dry_run=dry_run,
+                     max_threads=max_threads, per_host=per_host, limiter=limiter)
 
-    success_count = sum(1 for _, s in results if s)
-    fail_count = len(results) - success_count
-    console.print(f"[green]Completed batch download. Success: {success_count}, Failures: {fail_count}[/green]")
+def batch_download_from_file(file_path, output_path, audio_only=False, dry_run=False, max_threads=4, limiter=None,
+                             per_host=2):
+    return run_batch(files=[file_path], output_path=output_path, audio_only=audio_only, dry_run=dry_run,
+                     max_threads=max_threads, per_host=per_host, limiter=limiter)
 
 def show_menu():
     console.print("\n[bold cyan]YouTube Downloader[/bold cyan]")
@@ -147,7 +180,10 @@ def update_settings():
         console.print("[a] Toggle audio_only")
         console.print("[o] Change output folder")
         console.print("[t] Set max threads")
+        console.print("[h] Set max downloads per host")
         console.print("[d] Toggle dry run")
+        console.print("[r] Set max download speed")
+        console.print("[n] Set max requests per second")
         console.print("[q] Back")
         choice = input("Choice: ").lower()
         if choice == 'a':
@@ -159,8 +195,24 @@ def update_settings():
             n = input("Max threads: ").strip()
             if n.isdigit():
                 config["max_threads"] = int(n)
+        elif choice == 'h':
+            n = input("Max downloads per host: ").strip()
+            if n.isdigit() and int(n) > 0:
+                config["max_per_host"] = int(n)
         elif choice == 'd':
             config["dry_run"] = not config["dry_run"]
+        elif choice == 'r':
+            rate = input("Max download speed, e.g. 500K or 2M, 0 for unlimited: ").strip()
+            try:
+                config["max_rate"] = ratelimit.parse_rate(rate)
+            except ValueError:
+                console.print("[red]Invalid speed[/red]")
+        elif choice == 'n':
+            n = input("Max requests per second, 0 for unlimited: ").strip()
+            try:
+                config["max_requests"] = float(n)
+            except ValueError:
+                console.print("[red]Invalid number[/red]")
         elif choice == 'q':
             break
 
@@ -179,14 +231,18 @@ def main():
         choice = input("Select option: ").strip()
         if choice == '1':
             url = input("Enter video URL: ").strip()
-            download_video(url, config["output_path"], config["audio_only"], config["dry_run"])
+            run_batch(urls=[url], output_path=config["output_path"], audio_only=config["audio_only"],
+                      dry_run=config["dry_run"], max_threads=config["max_threads"],
+                      per_host=config["max_per_host"], limiter=make_limiter())
         elif choice == '2':
             url = input("Enter playlist URL: ").strip()
-            download_playlist(url, config["output_path"], config["audio_only"], config["dry_run"])
+            download_playlist(url, config["output_path"], config["audio_only"], config["dry_run"], make_limiter(),
+                              config["max_threads"], config["max_per_host"])
         elif choice == '3':
             path = input("Enter path to file with URLs: ").strip()
             if os.path.exists(path):
-                batch_download_from_file(path, config["output_path"], config["audio_only"], config["dry_run"], config["max_threads"])
+                batch_download_from_file(path, config["output_path"], config["audio_only"], config["dry_run"],
+                                         config["max_threads"], make_limiter(), config["max_per_host"])
             else:
                 console.print("[red]File not found[/red]")
         elif choice == '4':
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# the api package imports its helpers as _lib
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+
+from bench.media_server import serve  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    srv = serve()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+# the api fixtures import index lazily, it warms a YoutubeDL pool on import
+
+@pytest.fixture
+def pool(monkeypatch):
+    import index
+    from _lib.pool import YDLPool
+    from bench.fake_extractor import BenchIE
+
+    pool = YDLPool(index.ydl_pool.profiles, base_opts=index.ydl_pool.base_opts)
+    pool.add_extractor(BenchIE)
+    monkeypatch.setattr(index, 'ydl_pool', pool)
+    return pool
+
+
+@pytest.fixture
+def client(pool):
+    import index
+    return index.app.test_client()
+
+
+@pytest.fixture
+def media(server, monkeypatch, tmp_path):
+    import index
+    from _lib.artifacts import ArtifactCache
+
+    monkeypatch.setenv('BENCH_MEDIA_URL', server.url)
+    monkeypatch.setattr(index, 'artifacts', ArtifactCache(str(tmp_path / 'artifacts'), max_bytes=10 * 1024 ** 2))
+    return server
+
+
+@pytest.fixture
+def formats_cache(monkeypatch):
+    import index
+    from _lib.cache import MetadataCache
+
+    cache = MetadataCache()
+    monkeypatch.setattr(index, 'formats_cache', cache)
+    return cache
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Point FFMPEG_PATH at a stand-in that prints its arguments on the first
+    line of its output and then copies stdin through."""
+    path = tmp_path / 'ffmpeg'
+    path.write_text('#!/bin/sh\necho "$@"\nexec cat\n')
+    path.chmod(0o755)
+    monkeypatch.setenv('FFMPEG_PATH', str(path))
+    return path
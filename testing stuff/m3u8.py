@@ -1,13 +1,11 @@
+import contextlib
 import requests
 import logging
-import ffmpeg
-import random
-import m3u8
 import time
 import sys
 import os
 
-from datetime import datetime
+from alive_progress import alive_bar
 
 logger = logging.getLogger(__name__)
 logging.basicConfig()
@@ -17,6 +15,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 from modules.myargparser import parse_args
 from modules.headers import headers
 from modules.url import is_url
+from modules import transport, hls, convert, ratelimit
 
 args = parse_args(headers)
 
@@ -26,14 +25,20 @@ elif args.verbosity == 1:
     logger.setLevel(logging.INFO)
 else:
     logger.setLevel(logging.DEBUG)
+logging.getLogger('modules').setLevel(logger.level)
+
+limiter = None
+if args.limit_rate or args.limit_requests or args.host_rate or args.host_requests:
+    limiter = ratelimit.Limiter(args.limit_rate, args.limit_requests, args.host_rate, args.host_requests)
+    transport.configure(limiter=limiter)
 
 
 def get_url(url, headers):
     logger.info(f'GET {url}')
 
     try:
-        response = requests.get(url, headers=headers)
-    except requests.ConnectionError:
+        response = transport.shared().get(url, headers=headers)
+    except requests.RequestException:
         print(f'Could not connect to {url}')
         sys.exit(1)
 
@@ -51,30 +56,89 @@ def choose_url(base_url, uri):
         return base_url + uri
 
 
-def sleep(params):
-    sleep_min, sleep_max = params
-    sleep_sec = random.uniform(sleep_min, sleep_max)
-    logger.debug(f'Sleep {sleep_sec:.2f} sec')
-    time.sleep(sleep_sec)
-
-
-def download_stream_segments(stream, old_ts=None):
-    with open(args.output, 'ab') as file:
-            with alive_bar(len(stream.m3u8.segments), calibrate=50) as bar:
-                for i, segment in enumerate(stream.m3u8.segments):
-                    if old_ts != None and segment.program_date_time <= old_ts:
-                        bar(skipped=True)
-                        continue
-
-                    segment_url = choose_url(stream.base, segment.uri)
+@contextlib.contextmanager
+def open_output():
+    """The .ts file, or an ffmpeg pipe (plus the .ts with --keep_ts) when converting."""
+    if args.convert_format == None:
+        with open(args.output, 'ab') as file:
+            yield file
+        return
+
+    target = f'{args.output}.{args.convert_format}'
+    logger.info(f'Converting to {target} while downloading')
+    with convert.Converter(target, args.convert_format, args.reencode) as converter:
+        if args.keep_ts:
+            # there is no journal to resume the copy from, and ffmpeg rewrites
+            # the converted file on every run anyway
+            with open(args.output, 'wb') as file:
+                yield convert.Tee(file, converter)
+        else:
+            yield converter
+
+
+def progress(bar):
+    def on_segment(size):
+        bar()
+        if limiter:
+            bar.text = limiter.describe()
+    return on_segment
+
+
+def download_stream_segments(stream, switcher=None):
+    segments = stream.m3u8.segments
+    init_section = None
+    done = None
+    journal = None
+    # a converted file can't be cut back to a segment boundary
+    if args.convert_format == None:
+        journal = hls.Journal(args.output, stream.url or os.path.abspath(args.stream_url))
+        done = journal.resume()
+        if done != None:
+            print(f'Resuming {args.output} after media sequence {done}')
+            init_section = next((s.init_section for s in segments if s.sequence == done), None)
+            segments = [s for s in segments if s.sequence > done]
+
+    if switcher:
+        # one segment per request, so the variant can change on any boundary
+        parts = hls.adaptive_parts(switcher, done, headers=headers, init_section=init_section)
+        total = len(segments)
+    else:
+        parts = hls.plan_requests(segments, args.max_request, init_section)
+        total = len(parts)
+        logger.info(f'{len(segments)} segments in {len(parts)} requests')
 
-                    if not args.live_mode and args.sleep != (0, 0):
-                        sleep(args.sleep)
+    def on_written(part):
+        if journal:
+            journal.record(file, part)
+        if switcher:
+            switcher.observe(part)
 
-                    segment_content = get_url(segment_url, headers).content
-                    file.write(segment_content)
+    try:
+        with open_output() as file:
+            with alive_bar(total, calibrate=50) as bar:
+                try:
+                    hls.download_segments(
+                        parts,
+                        file,
+                        window=args.window,
+                        headers=headers,
+                        on_segment=progress(bar),
+                        on_written=on_written,
+                    )
+                finally:
+                    if journal:
+                        journal.sync(file)
+    except (requests.RequestException, hls.SegmentError) as e:
+        print(f'Aborting. Could not download segment: {e}')
+        sys.exit(1)
+    except convert.ConversionError as e:
+        print(f'Aborting. Conversion failed: {e}')
+        sys.exit(1)
 
-                    bar()
+    if journal:
+        journal.remove()
+    if switcher:
+        logger.info(f'Variants: {switcher.stats}')
 
 
 class MyStream:
@@ -110,7 +174,7 @@ class MyStream:
     def set_url(self, url):
         self._url = url
         self.__update_base_url()
-        self._m3u8 = m3u8.loads(get_url(self.url, headers).text)
+        self._m3u8 = hls.parse_playlist(get_url(self.url, headers).text, self.url)
 
 
     def __update_base_url(self):
@@ -124,7 +188,7 @@ class MyStream:
     def __init_from_file(self, path):
         try:
             with open(path, 'r') as f:
-                self._m3u8 = m3u8.loads(f.read())
+                self._m3u8 = hls.parse_playlist(f.read())
         except:
             print('Could not read local file')
             sys.exit(1)
@@ -134,7 +198,18 @@ def main():
 
     stream = MyStream(args.stream_url, args.local_mode)
 
+    switcher = None
     while len(stream.m3u8.playlists) != 0:
+        if args.variant != None:
+            variant = hls.select_variant(stream.m3u8.playlists, args.variant)
+            if args.variant == 'auto':
+                switcher = hls.VariantSwitcher(stream.m3u8.playlists)
+                print(f'Starting with {variant.bandwidth} bit/s ({variant.resolution}), adapting to throughput')
+            else:
+                print(f'Selected {variant.bandwidth} bit/s ({variant.resolution}) for --variant {args.variant}')
+            stream.set_url(choose_url(stream.base, variant.uri))
+            continue
+
         print('There are multiple streams available. Please select one to download:')
         for i, p in enumerate(stream.m3u8.playlists):
             print(f'{i}: {p.stream_info}')
@@ -154,70 +229,42 @@ def main():
 
         stream.set_url(choose_url(stream.base, stream.m3u8.playlists[choice].uri))
 
-    random.seed()
-
     logger.info('Downloading segments...')
 
     if args.live_mode:
         print('Entering live mode. Hit STRG + C to exit this mode...')
         print()
 
-        timer_start_ts = datetime.now()
-
-        last_ts = None
+        deadline = None
+        if args.timer != None:
+            deadline = time.monotonic() + args.timer * 60
 
-        while True:
-            try:
-                download_stream_segments(stream, last_ts)
-                last_ts = stream.m3u8.segments[-1].program_date_time
-
-                if last_ts == None:
-                    print('Stream does not provide a timestamp. Exiting live mode')
-                    break
-
-                if args.timer == None:
-                    print('Waiting for changes...')
-                else:
-                    timer_current_ts = datetime.now()
-                    timer_delta = (timer_current_ts - timer_start_ts).total_seconds() / 60
-
-                    if timer_delta > args.timer:
-                        print('Time is up! Stopping live mode')
-                        break
-                    else:
-                        remaining_mins = round(args.timer - timer_delta)
-                        print(f'Waiting for changes ({remaining_mins} min left)...')
-
-                if args.sleep == (0, 0):
-                    sleep((4, 4))
-                else:
-                    sleep(args.sleep)
-
-                stream = MyStream(stream.url)
-
-                print('\033[F\033[K', end='')
-                print('\033[F\033[K', end='')
-
-            except KeyboardInterrupt:
-                print('Stopped live mode')
-                break
+        live = hls.LivePlaylist(stream.url, headers=headers, deadline=deadline,
+                                 max_request=args.max_request, switcher=switcher)
+        try:
+            with open_output() as file:
+                with alive_bar(None, calibrate=50) as bar:
+                    hls.download_segments(live, file, window=args.window, headers=headers,
+                                          on_segment=progress(bar),
+                                          on_written=switcher and switcher.observe)
+            if deadline != None and time.monotonic() >= deadline:
+                print('Time is up! Stopping live mode')
+        except KeyboardInterrupt:
+            print('Stopped live mode')
+        except (requests.RequestException, hls.SegmentError, convert.ConversionError) as e:
+            print(f'Stopped live mode: {e}')
+        finally:
+            live.stop()
+
+        logger.info(f'Live mode: {live.stats}')
+        if switcher:
+            logger.info(f'Variants: {switcher.stats}')
 
     else:
-        download_stream_segments(stream)
+        download_stream_segments(stream, switcher)
 
     logger.info('Done downloading')
 
-    if args.convert_format != None:
-        print(args.convert_format)
-        logger.info('Converting file...')
-
-        if args.convert_format == 'mp3':
-            ffmpeg.input(args.output).output(args.output + '.mp3', vn=None, ar=44100, ac=2, **{'b:a': '192k'}).run()
-        elif args.convert_format == 'mp4':
-            ffmpeg.input(args.output).output(args.output + '.mp4', vcodec='libx264', acodec='aac').run()
-
-        logger.info('Done converting')
-
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,97 @@
+"""Convert an HLS download while it is being fetched.
+
+``Converter`` is a writable pipe into ffmpeg's stdin, so segments are
+converted as they arrive and the result is ready a moment after the last
+segment instead of after a second full pass over the ``.ts`` file. MPEG-TS
+and fragmented MP4 (segments behind an ``EXT-X-MAP`` init section) are both
+demuxable from a pipe, which is what makes this work without seeking; the
+input format is left to ffmpeg's probe.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+class ConversionError(Exception):
+    pass
+
+
+def ffmpeg_path():
+    return os.getenv('FFMPEG_PATH') or shutil.which('ffmpeg') or 'ffmpeg'
+
+
+def output_args(fmt, reencode=False):
+    """ffmpeg output options for ``fmt``. mp4 is a stream copy into the new
+    container unless ``reencode`` asks for H.264/AAC; mp3 always encodes."""
+    if fmt == 'mp3':
+        return ['-vn', '-acodec', 'libmp3lame', '-ar', '44100', '-ac', '2', '-b:a', '192k']
+    if fmt == 'mp4':
+        if reencode:
+            return ['-c:v', 'libx264', '-c:a', 'aac']
+        return ['-c', 'copy']
+    raise ValueError(f'unsupported format: {fmt}')
+
+
+class Converter:
+
+    def __init__(self, target, fmt, reencode=False):
+        self.target = target
+        self._stderr = tempfile.TemporaryFile()
+        try:
+            self._proc = subprocess.Popen(
+                [ffmpeg_path(), '-hide_banner', '-loglevel', 'error', '-y',
+                 '-i', 'pipe:0', *output_args(fmt, reencode), target],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr,
+                # keep Ctrl+C away from ffmpeg so close() can still finish the file
+                start_new_session=True,
+            )
+        except OSError as e:
+            self._stderr.close()
+            raise ConversionError(f'Could not start ffmpeg: {e}')
+
+    def write(self, data):
+        try:
+            self._proc.stdin.write(data)
+        except BrokenPipeError:
+            self._proc.wait()
+            raise ConversionError(self._error())
+
+    def close(self):
+        """Signal end of input and wait for ffmpeg to finish ``target``."""
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            if self._proc.wait() != 0:
+                raise ConversionError(self._error())
+        finally:
+            self._stderr.close()
+
+    def _error(self):
+        self._stderr.seek(0)
+        message = self._stderr.read().decode('utf-8', 'replace').strip()
+        return message or f'ffmpeg exited with status {self._proc.returncode}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except ConversionError:
+            # don't mask the error that got us here
+            if exc_type is None:
+                raise
+
+
+class Tee:
+    """Writes to several files at once, e.g. the ``.ts`` and a ``Converter``."""
+
+    def __init__(self, *files):
+        self.files = files
+
+    def write(self, data):
+        for f in self.files:
+            f.write(data)
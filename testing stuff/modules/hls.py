@@ -0,0 +1,632 @@
+"""Pipelined HLS segment fetching.
+
+Up to ``window`` segments are in flight at once. Results are written in
+playlist order: the writer waits on the oldest request while the newer ones
+keep downloading, so at most ``window`` segments are held in memory. Segment
+urls are pulled on a separate thread, so the source can be a live playlist
+that blocks between reloads.
+
+Byte-range playlists (``EXT-X-BYTERANGE``) are turned into requests by
+``plan_requests``, which merges adjacent ranges of the same resource. Init
+sections (``EXT-X-MAP``) are written before the first segment that uses
+them and fetched once per map.
+
+``Journal`` makes a VOD download resumable: it records the last segment that
+reached the disk and the file size after it.
+
+``VariantSwitcher`` picks among the variants of a master playlist from the
+throughput measured on downloaded segments; ``adaptive_parts`` and
+``LivePlaylist`` follow its choice on segment boundaries.
+"""
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+
+from . import transport
+
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_STATUS = (408, 425, 429, 500, 502, 503, 504)
+MAX_REQUEST = 8 * 1024 * 1024
+CHECKPOINT_BYTES = 8 * 1024 * 1024
+
+
+class SegmentError(Exception):
+    pass
+
+
+def parse_byterange(value):
+    """``n[@o]`` as ``(length, offset)``; offset is None when omitted."""
+    length, _, offset = value.partition('@')
+    return int(length), int(offset) if offset else None
+
+
+class InitSection:
+
+    def __init__(self, uri, base, byterange=None):
+        self.uri = uri
+        self.absolute_uri = urljoin(base, uri)
+        self.byterange = byterange
+
+    def __eq__(self, other):
+        return (isinstance(other, InitSection) and self.absolute_uri == other.absolute_uri
+                and self.byterange == other.byterange)
+
+    def __hash__(self):
+        return hash((self.absolute_uri, self.byterange))
+
+    def __repr__(self):
+        return f'InitSection({self.uri!r}, {self.byterange})'
+
+
+class MediaSegment:
+    """``byterange`` is ``(offset, length)`` within ``absolute_uri``, or None
+    for the whole resource."""
+
+    def __init__(self, uri, base, sequence, duration=None, title=None, discontinuity=False,
+                 byterange=None, init_section=None):
+        self.uri = uri
+        self.absolute_uri = urljoin(base, uri)
+        self.sequence = sequence
+        self.duration = duration
+        self.title = title
+        self.discontinuity = discontinuity
+        self.byterange = byterange
+        self.init_section = init_section
+
+    def __repr__(self):
+        return f'MediaSegment({self.sequence}, {self.uri!r})'
+
+
+class Variant:
+
+    def __init__(self, uri, base, stream_info):
+        self.uri = uri
+        self.absolute_uri = urljoin(base, uri)
+        self.stream_info = stream_info
+        self.bandwidth = int(stream_info.get('BANDWIDTH') or 0)
+        self.resolution = stream_info.get('RESOLUTION')
+
+    def __repr__(self):
+        return f'Variant({self.bandwidth}, {self.uri!r})'
+
+
+class Playlist:
+
+    def __init__(self):
+        self.segments = []
+        self.playlists = []
+        self.media_sequence = 0
+        self.discontinuity_sequence = 0
+        self.target_duration = None
+        self.is_endlist = False
+
+
+def parse_attributes(value):
+    return {k: v.strip('"') for k, v in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', value)}
+
+
+def parse_playlist(text, uri=''):
+    """Parse a media or master playlist; relative uris resolve against ``uri``."""
+    playlist = Playlist()
+    info = {}
+    stream_info = None
+    init_section = None
+    range_end = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith('#'):
+            if stream_info is not None:
+                playlist.playlists.append(Variant(line, uri, stream_info))
+                stream_info = None
+            else:
+                sequence = playlist.media_sequence + len(playlist.segments)
+                byterange = info.pop('byterange', None)
+                segment = MediaSegment(line, uri, sequence, init_section=init_section, **info)
+                if byterange is not None:
+                    length, offset = byterange
+                    if offset is None:
+                        # continues where the previous range of this resource ended
+                        offset = range_end.get(segment.absolute_uri, 0)
+                    segment.byterange = (offset, length)
+                    range_end[segment.absolute_uri] = offset + length
+                playlist.segments.append(segment)
+            info = {}
+            continue
+        tag, _, value = line.partition(':')
+        if tag == '#EXTINF':
+            duration, _, title = value.partition(',')
+            info['duration'] = float(duration)
+            info['title'] = title or None
+        elif tag == '#EXT-X-DISCONTINUITY':
+            info['discontinuity'] = True
+        elif tag == '#EXT-X-BYTERANGE':
+            info['byterange'] = parse_byterange(value)
+        elif tag == '#EXT-X-MAP':
+            attributes = parse_attributes(value)
+            byterange = None
+            if 'BYTERANGE' in attributes:
+                length, offset = parse_byterange(attributes['BYTERANGE'])
+                byterange = (offset or 0, length)
+            init_section = InitSection(attributes['URI'], uri, byterange)
+        elif tag == '#EXT-X-MEDIA-SEQUENCE':
+            playlist.media_sequence = int(value)
+        elif tag == '#EXT-X-DISCONTINUITY-SEQUENCE':
+            playlist.discontinuity_sequence = int(value)
+        elif tag == '#EXT-X-TARGETDURATION':
+            playlist.target_duration = float(value)
+        elif tag == '#EXT-X-ENDLIST':
+            playlist.is_endlist = True
+        elif tag == '#EXT-X-STREAM-INF':
+            stream_info = parse_attributes(value)
+    return playlist
+
+
+class Part:
+    """One request: ``url``, or ``byterange`` ``(offset, length)`` of it,
+    covering ``count`` playlist segments up to media sequence ``sequence``.
+    ``init`` marks an init section. ``started``, ``finished`` and ``size``
+    are set once it has been fetched (not for cached init sections)."""
+
+    def __init__(self, url, byterange=None, count=1, init=False, sequence=None):
+        self.url = url
+        self.byterange = byterange
+        self.count = count
+        self.init = init
+        self.sequence = sequence
+        self.started = None
+        self.finished = None
+        self.size = None
+
+    def __repr__(self):
+        return f'Part({self.url!r}, {self.byterange}, count={self.count}, init={self.init})'
+
+
+def plan_requests(segments, max_request=MAX_REQUEST, init_section=None):
+    """Turn playlist segments into ``Part`` requests in playlist order.
+
+    Consecutive byte ranges of the same resource that touch each other are
+    merged into one request of at most ``max_request`` bytes. The init
+    section is inserted whenever it changes; ``init_section`` is the one in
+    effect before ``segments``, for callers planning a stream in batches.
+    """
+    parts = []
+    for segment in segments:
+        if segment.init_section is not None and segment.init_section != init_section:
+            init_section = segment.init_section
+            parts.append(Part(init_section.absolute_uri, init_section.byterange, count=0, init=True))
+        last = parts[-1] if parts else None
+        if (segment.byterange is not None and last is not None and not last.init
+                and last.byterange is not None and last.url == segment.absolute_uri
+                and sum(last.byterange) == segment.byterange[0]
+                and last.byterange[1] + segment.byterange[1] <= max_request):
+            last.byterange = (last.byterange[0], last.byterange[1] + segment.byterange[1])
+            last.count += 1
+            last.sequence = segment.sequence
+        else:
+            parts.append(Part(segment.absolute_uri, segment.byterange, sequence=segment.sequence))
+    return parts
+
+
+def load_playlist(url, session=None, headers=None):
+    response = (session or transport.shared()).get(url, headers=headers)
+    if response.status_code != 200:
+        raise SegmentError(f'{url} returned HTTP {response.status_code}')
+    return parse_playlist(response.text, url)
+
+
+def select_variant(variants, policy):
+    """The variant for ``best``, ``worst`` or ``max-bandwidth=N`` (the best
+    one within N bits/s, else the lowest). ``auto`` starts at the lowest."""
+    variants = sorted(variants, key=lambda v: v.bandwidth)
+    if policy == 'best':
+        return variants[-1]
+    if policy in ('worst', 'auto'):
+        return variants[0]
+    name, _, limit = policy.partition('=')
+    if name != 'max-bandwidth':
+        raise ValueError(f'unknown variant policy: {policy}')
+    fitting = [v for v in variants if v.bandwidth <= int(limit)]
+    return fitting[-1] if fitting else variants[0]
+
+
+def fetch(url, session=None, headers=None, retries=3, backoff=0.5, byterange=None):
+    """Body of one segment, or of ``byterange`` ``(offset, length)`` of it,
+    retried with exponential backoff."""
+    session = session or transport.shared()
+    if byterange is not None:
+        offset, length = byterange
+        headers = {**(headers or {}), 'Range': f'bytes={offset}-{offset + length - 1}'}
+    attempt = 0
+    while True:
+        try:
+            response = session.get(url, headers=headers)
+            if response.status_code == 206 and byterange is not None:
+                if len(response.content) != length:
+                    raise SegmentError(f'{url} returned {len(response.content)} of {length} bytes')
+                return response.content
+            if response.status_code == 200:
+                if byterange is None:
+                    return response.content
+                logger.warning(f'{url} ignored the Range header, slicing the full response')
+                return response.content[offset:offset + length]
+            error = SegmentError(f'{url} returned HTTP {response.status_code}')
+            if response.status_code not in TRANSIENT_STATUS:
+                raise error
+        except requests.RequestException as e:
+            error = e
+        if attempt >= retries:
+            raise error
+        logger.debug(f'Retrying {url} ({error})')
+        time.sleep(backoff * 2 ** attempt)
+        attempt += 1
+
+
+def download_segments(urls, out, window=4, session=None, headers=None, retries=3, backoff=0.5,
+                      on_segment=None, on_written=None):
+    """Fetch ``urls`` with ``window`` requests in flight and write them to
+    ``out`` in order. Items are urls or ``Part``s from ``plan_requests``.
+    ``on_segment(size)`` and ``on_written(part)`` run after each item is
+    written; pacing belongs to the session (see ``transport``). Returns
+    counters."""
+    stats = {'segments': 0, 'requests': 0, 'bytes': 0, 'max_buffered': 0}
+    slots = threading.Semaphore(window)
+    ready = queue.Queue()
+    stop = threading.Event()
+    init_cache = {}
+    lock = threading.Lock()
+
+    def get(part):
+        if part.init:
+            key = (part.url, part.byterange)
+            with lock:
+                if key in init_cache:
+                    return init_cache[key]
+        part.started = time.monotonic()
+        data = fetch(part.url, session, headers, retries, backoff, part.byterange)
+        part.finished = time.monotonic()
+        part.size = len(data)
+        with lock:
+            stats['requests'] += 1
+            if part.init:
+                init_cache[key] = data
+        return data
+
+    with ThreadPoolExecutor(max_workers=window, thread_name_prefix='hls') as pool:
+        def feed():
+            try:
+                parts = iter(urls)
+                while True:
+                    # take the slot first, so the source decides as late as possible
+                    while not slots.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    part = next(parts, None)
+                    if part is None:
+                        break
+                    if isinstance(part, str):
+                        part = Part(part)
+                    future = pool.submit(get, part)
+                    future.part = part
+                    ready.put(future)
+            except BaseException as e:
+                ready.put(e)
+            else:
+                ready.put(None)
+
+        # daemon: a live source may be sleeping until its next reload
+        threading.Thread(target=feed, name='hls-feeder', daemon=True).start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                data = item.result()
+                waiting = [f for f in list(ready.queue) if isinstance(f, Future)]
+                stats['max_buffered'] = max(stats['max_buffered'], 1 + sum(f.done() for f in waiting))
+                out.write(data)
+                stats['segments'] += item.part.count
+                stats['bytes'] += len(data)
+                if on_segment:
+                    on_segment(len(data))
+                if on_written:
+                    on_written(item.part)
+                del data
+                slots.release()
+        finally:
+            stop.set()
+            while not ready.empty():
+                item = ready.get_nowait()
+                if isinstance(item, Future):
+                    item.cancel()
+    return stats
+
+
+class Journal:
+    """``<output>.journal``: the media sequence of the last segment that is
+    durably in ``output`` and the file size right after it.
+
+    ``record`` is called after every write and checkpoints (flush, fsync,
+    then an atomic journal replace) once ``every`` bytes have accumulated;
+    ``sync`` checkpoints unconditionally. ``resume`` truncates ``output`` to
+    the last checkpoint, dropping whatever a crash left half written, or
+    empties it when the journal can't be used, so appending starts over.
+    """
+
+    def __init__(self, output, source, every=CHECKPOINT_BYTES):
+        self.output = output
+        self.path = output + '.journal'
+        self.source = source
+        self.every = every
+        self.sequence = None
+        self._saved = None
+        self._offset = 0
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def resume(self):
+        """The media sequence to continue after, or None to start over."""
+        state = self.load()
+        if not state or state.get('source') != self.source:
+            if state:
+                logger.warning(f'{self.path} belongs to another playlist, starting over')
+            return self._start_over()
+        try:
+            size = os.path.getsize(self.output)
+        except OSError:
+            size = -1
+        if size < state['offset']:
+            logger.warning(f'{self.output} is shorter than its journal says, starting over')
+            return self._start_over()
+        if size > state['offset']:
+            logger.info(f'Dropping {size - state["offset"]} bytes written after the last checkpoint')
+            with open(self.output, 'r+b') as f:
+                f.truncate(state['offset'])
+        self.sequence = self._saved = state['sequence']
+        self._offset = state['offset']
+        return state['sequence']
+
+    def _start_over(self):
+        self.remove()
+        if os.path.exists(self.output):
+            with open(self.output, 'r+b') as f:
+                f.truncate(0)
+        return None
+
+    def record(self, out, part):
+        if part.sequence is None:
+            return
+        self.sequence = part.sequence
+        if self._saved is None or out.tell() - self._offset >= self.every:
+            self.sync(out)
+
+    def sync(self, out):
+        if self.sequence is None or self.sequence == self._saved:
+            return
+        out.flush()
+        os.fsync(out.fileno())
+        offset = out.tell()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'source': self.source, 'sequence': self.sequence, 'offset': offset}, f)
+        os.replace(tmp, self.path)
+        self._saved = self.sequence
+        self._offset = offset
+
+    def remove(self):
+        for path in (self.path, self.path + '.tmp'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class Throughput:
+    """Bytes per second over the last ``samples`` requests, divided by the
+    time at least one of them was in flight. Overlapping requests count once
+    and idle gaps (e.g. waiting for a live reload) not at all."""
+
+    def __init__(self, samples=6):
+        self.samples = deque(maxlen=samples)
+
+    def add(self, started, finished, size):
+        self.samples.append((started, finished, size))
+
+    def clear(self):
+        self.samples.clear()
+
+    def rate(self):
+        if not self.samples:
+            return None
+        busy = 0.0
+        end = None
+        for started, finished, _ in sorted(self.samples):
+            if end is None or started > end:
+                busy += finished - started
+                end = finished
+            elif finished > end:
+                busy += finished - end
+                end = finished
+        size = sum(sample[2] for sample in self.samples)
+        return size / busy if busy > 0 else None
+
+
+class VariantSwitcher:
+    """Chooses the best variant the measured throughput can sustain.
+
+    Starts at the lowest bandwidth. After ``samples`` segments on a variant,
+    moves to the highest one whose ``BANDWIDTH`` fits in ``headroom`` of the
+    measured rate, up when there is room and down when the current one can't
+    keep up. Feed it each written part with ``observe``.
+    """
+
+    def __init__(self, variants, samples=3, headroom=0.8):
+        self.variants = sorted(variants, key=lambda v: v.bandwidth)
+        self.current = self.variants[0]
+        self.samples = samples
+        self.headroom = headroom
+        self.throughput = Throughput(samples * 2)
+        self.stats = {'switches': 0, 'rate': None}
+        self._observed = 0
+
+    def observe(self, part):
+        if part.init or part.finished is None:
+            return
+        self.throughput.add(part.started, part.finished, part.size)
+        self._observed += 1
+        rate = self.throughput.rate()
+        if rate is None:
+            return
+        self.stats['rate'] = rate
+        logger.debug(f'Measured {rate * 8 / 1e6:.2f} Mbit/s on {self.current.bandwidth} bit/s variant')
+        if self._observed < self.samples:
+            return
+        fitting = [v for v in self.variants if v.bandwidth <= rate * 8 * self.headroom]
+        choice = fitting[-1] if fitting else self.variants[0]
+        if choice is not self.current:
+            logger.info(f'Measured {rate * 8 / 1e6:.2f} Mbit/s, switching from {self.current.bandwidth} '
+                        f'to {choice.bandwidth} bit/s ({choice.resolution or choice.uri})')
+            self.current = choice
+            self.stats['switches'] += 1
+            self.throughput.clear()
+            self._observed = 0
+
+
+def adaptive_parts(switcher, after=None, load=None, session=None, headers=None, init_section=None):
+    """Parts for a VOD master playlist, one segment at a time from whichever
+    variant ``switcher`` currently prefers. Variants are matched by media
+    sequence; ``after`` skips everything up to that sequence."""
+    load = load or (lambda url: load_playlist(url, session, headers))
+    playlists = {}
+    while True:
+        url = switcher.current.absolute_uri
+        if url not in playlists:
+            playlists[url] = load(url)
+        segment = next((s for s in playlists[url].segments if after is None or s.sequence > after), None)
+        if segment is None:
+            return
+        yield from plan_requests([segment], init_section=init_section)
+        init_section = segment.init_section
+        after = segment.sequence
+
+
+class LivePlaylist:
+    """Follows a live media playlist and yields a ``Part`` for each new
+    segment once, planned with ``plan_requests``.
+
+    Segments are identified by ``EXT-X-MEDIA-SEQUENCE`` plus their position,
+    so streams without timestamps work and nothing is fetched twice. A reload
+    that brings new segments is followed by the next one a target duration
+    after it started; an unchanged playlist is checked again after half of
+    that. A lower media sequence with a higher
+    ``EXT-X-DISCONTINUITY-SEQUENCE`` means the encoder restarted, and tracking
+    starts over. Iteration ends at ``EXT-X-ENDLIST``, at ``deadline``
+    (``time.monotonic()``) or after ``stop()``. With a ``switcher`` each
+    reload fetches its current variant; the media sequence carries over.
+    """
+
+    def __init__(self, url, session=None, headers=None, deadline=None, max_failures=3,
+                 max_request=MAX_REQUEST, switcher=None):
+        self.url = url
+        self.switcher = switcher
+        self.max_request = max_request
+        self.session = session or transport.shared()
+        self.headers = headers
+        self.deadline = deadline
+        self.max_failures = max_failures
+        self.next_sequence = None
+        self.discontinuity_sequence = None
+        self.init_section = None
+        self.stats = {'reloads': 0, 'unchanged': 0, 'segments': 0, 'missed': 0, 'discontinuities': 0}
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def load(self):
+        if self.switcher is not None:
+            self.url = self.switcher.current.absolute_uri
+        return load_playlist(self.url, self.session, self.headers)
+
+    def new_segments(self, playlist):
+        first = playlist.media_sequence
+        discontinuity = playlist.discontinuity_sequence
+        if self.next_sequence is None:
+            self.next_sequence = first
+        elif first < self.next_sequence and discontinuity > self.discontinuity_sequence:
+            logger.warning(f'Stream restarted at media sequence {first}')
+            self.next_sequence = first
+        elif first > self.next_sequence:
+            missed = first - self.next_sequence
+            logger.warning(f'Missed {missed} segment(s) that left the playlist before they were seen')
+            self.stats['missed'] += missed
+            self.next_sequence = first
+        self.discontinuity_sequence = discontinuity
+
+        new = []
+        for segment in playlist.segments:
+            if segment.sequence < self.next_sequence:
+                continue
+            if segment.discontinuity:
+                self.stats['discontinuities'] += 1
+                logger.info(f'Discontinuity before media sequence {segment.sequence}')
+            new.append(segment)
+            self.next_sequence = segment.sequence + 1
+        return new
+
+    def _expired(self):
+        return self._stopped.is_set() or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def __iter__(self):
+        failures = 0
+        while not self._expired():
+            started = time.monotonic()
+            try:
+                playlist = self.load()
+            except (requests.RequestException, SegmentError) as e:
+                failures += 1
+                if failures >= self.max_failures:
+                    raise
+                logger.warning(f'Playlist reload failed ({e}), retrying')
+                self._stopped.wait(1)
+                continue
+            failures = 0
+            self.stats['reloads'] += 1
+
+            new = self.new_segments(playlist)
+            self.stats['segments'] += len(new)
+            if not new:
+                self.stats['unchanged'] += 1
+            yield from plan_requests(new, self.max_request, self.init_section)
+            if new:
+                self.init_section = new[-1].init_section
+            if playlist.is_endlist:
+                return
+
+            target = playlist.target_duration or 6
+            delay = target if new else target / 2
+            wake = started + delay
+            if self.deadline is not None:
+                wake = min(wake, self.deadline)
+            self._stopped.wait(max(0.0, wake - time.monotonic()))
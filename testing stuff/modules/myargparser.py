@@ -0,0 +1,58 @@
+import argparse
+
+from .ratelimit import parse_rate
+
+
+def variant_policy(value):
+    name, sep, limit = value.partition('=')
+    if (not sep and value in ('best', 'worst', 'auto')) or (name == 'max-bandwidth' and limit.isdigit()):
+        return value
+    raise argparse.ArgumentTypeError(f'expected best, worst, auto or max-bandwidth=N, got {value!r}')
+
+
+def parse_args(headers, argv=None):
+    parser = argparse.ArgumentParser(description='Download an HLS (m3u8) stream')
+    parser.add_argument('stream_url', help='playlist url, or a file path with --local_mode')
+    parser.add_argument('-l', '--local_mode', action='store_true', help='read the playlist from a local file')
+    parser.add_argument('-o', '--output', default='output.ts', help='output file (default: output.ts)')
+    parser.add_argument('-v', '--verbosity', action='count', default=0, help='-v for info, -vv for debug')
+    parser.add_argument('--limit_rate', type=parse_rate, metavar='RATE',
+                        help='cap total download speed in bytes/s, e.g. 500K or 2M')
+    parser.add_argument('--limit_requests', type=float, metavar='N', help='cap total requests per second')
+    parser.add_argument('--host_rate', type=parse_rate, metavar='RATE', help='cap download speed per host')
+    parser.add_argument('--host_requests', type=float, metavar='N', help='cap requests per second per host')
+    parser.add_argument('-s', '--sleep', nargs=2, type=float, default=(0, 0), metavar=('MIN', 'MAX'),
+                        help='deprecated: same as --limit_requests 2/(MIN+MAX); ignored with --live_mode, '
+                             'which reloads the playlist by its target duration')
+    parser.add_argument('--live_mode', action='store_true', help='keep following a live playlist')
+    parser.add_argument('-t', '--timer', type=float, help='stop live mode after this many minutes')
+    parser.add_argument('-c', '--convert_format', choices=('mp3', 'mp4'),
+                        help='convert while downloading, to OUTPUT.mp3 or OUTPUT.mp4')
+    parser.add_argument('--reencode', action='store_true',
+                        help='re-encode mp4 to H.264/AAC instead of copying the streams')
+    parser.add_argument('--keep_ts', action='store_true', help='also write the .ts when converting')
+    parser.add_argument('-w', '--window', type=int, default=4, help='segments fetched in parallel (default: 4)')
+    parser.add_argument('-V', '--variant', type=variant_policy, metavar='POLICY',
+                        help='pick from a master playlist without asking: best, worst, '
+                             'max-bandwidth=N (bits/s) or auto (adapt to measured throughput)')
+    parser.add_argument('-r', '--max_request', type=float, default=8, metavar='MIB',
+                        help='largest merged byte-range request in MiB (default: 8)')
+    parser.add_argument('-H', '--header', action='append', default=[], metavar='"NAME: VALUE"',
+                        help='extra request header, can be repeated')
+
+    args = parser.parse_args(argv)
+    args.sleep = tuple(args.sleep)
+    # it only ever paced VOD segment requests, never a live playlist
+    if args.sleep != (0, 0) and args.limit_requests == None and not args.live_mode:
+        args.limit_requests = 2 / sum(args.sleep)
+    if args.window < 1:
+        parser.error('--window must be at least 1')
+    if args.max_request <= 0:
+        parser.error('--max_request must be positive')
+    args.max_request = int(args.max_request * 1024 * 1024)
+    for header in args.header:
+        name, sep, value = header.partition(':')
+        if not sep:
+            parser.error(f'malformed header: {header}')
+        headers[name.strip()] = value.strip()
+    return args
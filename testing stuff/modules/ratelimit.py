@@ -0,0 +1,128 @@
+"""Token-bucket rate limiting for bytes/sec and requests/sec.
+
+A ``Limiter`` holds one global bucket per quantity and one per host, shared
+by every transfer in the process that goes through it. Buckets hand out
+reservations in arrival order, so concurrent transfers are paced evenly
+instead of bursting and then stalling together. A bucket only refills up to
+``burst`` seconds' worth of tokens, so an idle period buys a short head start
+and no more.
+
+Attach a limiter to the HTTP transport with
+``transport.configure(limiter=Limiter(rate=2_000_000))``.
+"""
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+
+BURST_SECONDS = 0.25
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate * BURST_SECONDS, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n):
+        """Take ``n`` tokens, going into debt if needed; returns how long the
+        caller has to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= n
+            return max(0.0, -self._tokens / self.rate)
+
+
+def parse_rate(value):
+    """``500K``, ``2M``, ``1.5G`` or a plain number, in bytes."""
+    value = str(value).strip().upper().removesuffix('B')
+    for suffix, factor in (('K', 1024), ('M', 1024 ** 2), ('G', 1024 ** 3)):
+        if value.endswith(suffix):
+            return float(value[:-1]) * factor
+    return float(value)
+
+
+def format_rate(rate):
+    for unit, factor in (('GB', 1024 ** 3), ('MB', 1024 ** 2), ('KB', 1024)):
+        if rate >= factor:
+            return f'{rate / factor:.1f} {unit}/s'
+    return f'{rate:.0f} B/s'
+
+
+class Limiter:
+    """Global and per-host limits; a rate of None (or 0) leaves it unlimited.
+
+    ``request(url)`` is called before each request and ``consume(url, n)`` as
+    each chunk of a body arrives; both block for as long as the strictest
+    applicable bucket demands.
+    """
+
+    def __init__(self, rate=None, requests=None, host_rate=None, host_requests=None, window=2.0):
+        self.rate = rate or None
+        self.requests = requests or None
+        self.host_rate = host_rate or None
+        self.host_requests = host_requests or None
+        self.window = window
+        self._bytes = TokenBucket(rate) if rate else None
+        self._requests = TokenBucket(requests) if requests else None
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.stats = {'bytes': 0, 'requests': 0, 'waited': 0.0}
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            buckets = self._hosts.get(host)
+            if buckets is None:
+                buckets = self._hosts[host] = (
+                    TokenBucket(self.host_rate) if self.host_rate else None,
+                    TokenBucket(self.host_requests) if self.host_requests else None,
+                )
+            return buckets
+
+    def _wait(self, buckets, n):
+        delay = max((b.reserve(n) for b in buckets if b is not None), default=0.0)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def request(self, url):
+        host_bytes, host_requests = self._host(url)
+        waited = self._wait((self._requests, host_requests), 1)
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['waited'] += waited
+
+    def consume(self, url, n):
+        host_bytes, host_requests = self._host(url)
+        waited = self._wait((self._bytes, host_bytes), n)
+        now = time.monotonic()
+        with self._lock:
+            self.stats['bytes'] += n
+            self.stats['waited'] += waited
+            self._recent.append((now, n))
+            while self._recent and self._recent[0][0] < now - self.window:
+                self._recent.popleft()
+
+    def current_rate(self):
+        """Bytes/sec over the last ``window`` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0][0] < now - self.window:
+                self._recent.popleft()
+            return sum(n for _, n in self._recent) / self.window
+
+    def describe(self):
+        """Short status for progress output, e.g. ``1.9 MB/s of 2.0 MB/s``."""
+        text = format_rate(self.current_rate())
+        limits = [format_rate(r) for r in (self.rate, self.host_rate) if r]
+        if limits:
+            text += f' of {limits[0]}' + (' per host' if not self.rate else '')
+        return text
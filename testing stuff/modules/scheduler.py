@@ -0,0 +1,177 @@
+"""Batch scheduler for download jobs.
+
+Files, single urls and playlists all feed one pool. Playlists are expanded
+by a job of their own and their entries join the same queue with the
+playlist's priority. Urls are deduplicated on a normalised key, so the same
+video listed twice (or once directly and once through a playlist) runs once.
+
+The scheduler runs on asyncio and hands the blocking work to a thread pool.
+It always starts the highest priority job whose host has a free slot, with
+at most ``concurrency`` jobs overall and ``per_host`` per host. ``run()``
+yields a ``Result`` as each job finishes.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com')
+
+
+def normalize_url(url):
+    """Key for deduplication: YouTube videos and playlists by id, anything
+    else by its url without the fragment and with a lowercase host."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    query = parse_qs(parts.query)
+    if host in YOUTUBE_HOSTS:
+        if parts.path == '/watch' and 'v' in query:
+            return f'youtube:{query["v"][0]}'
+        if parts.path.startswith('/shorts/'):
+            return f'youtube:{parts.path.split("/")[2]}'
+        if parts.path == '/playlist' and 'list' in query:
+            return f'youtube-playlist:{query["list"][0]}'
+    if host == 'youtu.be':
+        return f'youtube:{parts.path.lstrip("/")}'
+    return parts._replace(scheme=parts.scheme.lower(), netloc=host, fragment='').geturl()
+
+
+def host_of(url):
+    host = urlsplit(url).netloc.lower()
+    if host in YOUTUBE_HOSTS or host == 'youtu.be':
+        return 'youtube.com'
+    return host
+
+
+class Job:
+
+    def __init__(self, url, priority=0, playlist=False, parent=None):
+        self.url = url
+        self.priority = priority
+        self.playlist = playlist
+        self.parent = parent
+        self.host = host_of(url)
+
+
+class Result:
+    """``value`` is what the job returned: the download's result, or for a
+    playlist the number of new entries it added."""
+
+    def __init__(self, job, ok, value=None, error=None, elapsed=0.0):
+        self.job = job
+        self.url = job.url
+        self.ok = ok
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f'Result({self.url!r}, ok={self.ok})'
+
+
+class Scheduler:
+    """``download(url)`` runs each url and ``expand(url)`` returns the urls
+    of a playlist; both are blocking and run on worker threads. An exception
+    from either makes that job's ``Result`` fail without stopping the rest.
+    Higher ``priority`` runs first; equal priorities keep insertion order.
+    """
+
+    def __init__(self, download, expand=None, concurrency=4, per_host=2):
+        self.download = download
+        self.expand = expand
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.seen = set()
+        self.stats = {'queued': 0, 'duplicates': 0, 'done': 0, 'failed': 0}
+        self._pending = {}
+        self._active = {}
+        self._order = itertools.count()
+
+    def add(self, url, priority=0, playlist=False, parent=None):
+        """Queue ``url``; returns False if it was already seen."""
+        key = normalize_url(url)
+        if key in self.seen:
+            self.stats['duplicates'] += 1
+            return False
+        self.seen.add(key)
+        job = Job(url, priority, playlist, parent)
+        heapq.heappush(self._pending.setdefault(job.host, []), (-priority, next(self._order), job))
+        self.stats['queued'] += 1
+        return True
+
+    def add_playlist(self, url, priority=0):
+        return self.add(url, priority, playlist=True)
+
+    def add_file(self, path, priority=0, is_playlist=None):
+        """One url per line, optionally followed by a priority; blank lines
+        and ``#`` comments are skipped. Returns how many were new."""
+        added = 0
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                url, _, rest = line.partition(' ')
+                line_priority = int(rest) if rest.strip().lstrip('-').isdigit() else priority
+                added += self.add(url, line_priority, playlist=bool(is_playlist and is_playlist(url)))
+        return added
+
+    @property
+    def pending(self):
+        return sum(len(heap) for heap in self._pending.values())
+
+    def _next_job(self):
+        """Highest priority job among hosts below their limit."""
+        best = None
+        for host, heap in self._pending.items():
+            if heap and self._active.get(host, 0) < self.per_host:
+                if best is None or heap[0][:2] < self._pending[best][0][:2]:
+                    best = host
+        if best is None:
+            return None
+        job = heapq.heappop(self._pending[best])[2]
+        if not self._pending[best]:
+            del self._pending[best]
+        return job
+
+    def _work(self, job):
+        if not job.playlist:
+            return self.download(job.url)
+        if self.expand is None:
+            raise ValueError(f'no way to expand playlist {job.url}')
+        return list(self.expand(job.url))
+
+    async def run(self):
+        """Run until everything queued (including playlist entries) is done,
+        yielding each ``Result`` as soon as its job finishes."""
+        loop = asyncio.get_running_loop()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch') as pool:
+            while running or self._pending:
+                while len(running) < self.concurrency:
+                    job = self._next_job()
+                    if job is None:
+                        break
+                    self._active[job.host] = self._active.get(job.host, 0) + 1
+                    future = loop.run_in_executor(pool, self._work, job)
+                    running[future] = (job, time.monotonic())
+                if not running:
+                    break
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    job, started = running.pop(future)
+                    self._active[job.host] -= 1
+                    elapsed = time.monotonic() - started
+                    error = future.exception()
+                    if error is not None:
+                        self.stats['failed'] += 1
+                        yield Result(job, False, error=error, elapsed=elapsed)
+                        continue
+                    value = future.result()
+                    if job.playlist:
+                        value = sum(self.add(url, job.priority, parent=job) for url in value)
+                    self.stats['done'] += 1
+                    yield Result(job, True, value, elapsed=elapsed)
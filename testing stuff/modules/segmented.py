@@ -0,0 +1,416 @@
+"""Multi-connection, resumable downloads.
+
+The resource is probed with a one-byte range request. If the server answers
+206 with a total length, the file is preallocated and split into ranges that
+several connections fetch at once, each writing straight to its own offset.
+A connection that runs out of work takes the back half of the largest range
+still in flight. Servers that ignore ranges get a single stream, reusing the
+probe response; one that answers 206 without saying how long the resource
+is gets a plain GET instead.
+
+Progress is kept in a ``<file>.resume`` sidecar holding the url, validators
+(ETag/Last-Modified), length and the byte ranges already on disk. A rerun
+picks up the missing ranges with ``Range`` + ``If-Range``; if the validators
+or length no longer match, the file is fetched from scratch.
+"""
+import json
+import os
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import transport
+
+
+CHUNK_SIZE = 256 * 1024
+MIN_SEGMENT = 1024 * 1024
+CHECKPOINT_BYTES = 8 * 1024 * 1024
+TRANSIENT_STATUS = (408, 425, 429, 500, 502, 503, 504)
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ResourceChanged(DownloadError):
+    pass
+
+
+class Segment:
+    __slots__ = ('pos', 'end', 'committed')
+
+    def __init__(self, pos, end):
+        self.pos = pos
+        self.end = end
+        self.committed = pos
+
+    def __repr__(self):
+        return f'Segment({self.pos}, {self.end})'
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(completed, length):
+    missing, pos = [], 0
+    for start, end in merge_ranges(completed):
+        if start > pos:
+            missing.append((pos, min(start, length)))
+        pos = max(pos, end)
+    if pos < length:
+        missing.append((pos, length))
+    return missing
+
+
+class Segments:
+    """Byte ranges left to fetch. ``take`` hands out a pending range or
+    splits the largest active one; ``claim`` advances a range and never lets
+    two connections write the same bytes; ``commit`` records flushed bytes
+    as completed."""
+
+    def __init__(self, missing, parts, min_split=MIN_SEGMENT, completed=()):
+        pending = [Segment(start, end) for start, end in missing if end > start]
+        while len(pending) < parts:
+            largest = max(pending, key=lambda s: s.end - s.pos, default=None)
+            if largest is None or largest.end - largest.pos < 2 * min_split:
+                break
+            mid = (largest.pos + largest.end) // 2
+            pending.append(Segment(mid, largest.end))
+            largest.end = mid
+        self.pending = sorted(pending, key=lambda s: s.pos)
+        self.active = []
+        self.min_split = min_split
+        self.completed = merge_ranges(completed)
+        self.done = 0
+        self.steals = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.pending:
+                segment = self.pending.pop(0)
+            else:
+                victim = max(self.active, key=lambda s: s.end - s.pos, default=None)
+                if victim is None or victim.end - victim.pos < 2 * self.min_split:
+                    return None
+                mid = (victim.pos + victim.end) // 2
+                segment = Segment(mid, victim.end)
+                victim.end = mid
+                self.steals += 1
+            self.active.append(segment)
+            return segment
+
+    def claim(self, segment, n):
+        """Reserve up to ``n`` bytes at ``segment.pos``; returns how many to write."""
+        with self._lock:
+            n = max(0, min(n, segment.end - segment.pos))
+            segment.pos += n
+            self.done += n
+            return n
+
+    def commit(self, segment):
+        with self._lock:
+            if segment.pos > segment.committed:
+                self.completed = merge_ranges(self.completed + [[segment.committed, segment.pos]])
+                segment.committed = segment.pos
+            return [list(r) for r in self.completed]
+
+    def finish(self, segment):
+        with self._lock:
+            self.active.remove(segment)
+
+
+class Sidecar:
+    """JSON progress file next to the download, replaced atomically."""
+
+    def __init__(self, path):
+        self.path = path + '.resume'
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, state):
+        with self._lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+
+    def remove(self):
+        for path in (self.path, self.path + '.tmp'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _total_length(response):
+    if response.status_code == 206:
+        match = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else None
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+class SegmentedDownload:
+
+    def __init__(self, url, path, connections=4, headers=None, session=None, start=0,
+                 retries=5, backoff=0.5, max_backoff=30, chunk_size=CHUNK_SIZE,
+                 min_segment=MIN_SEGMENT, checkpoint_bytes=CHECKPOINT_BYTES, timeout=30, progress=None):
+        self.url = url
+        self.path = path
+        self.connections = connections
+        self.headers = dict(headers or {})
+        self.session = session or transport.shared()
+        self.start = start
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.chunk_size = chunk_size
+        self.min_segment = min_segment
+        self.checkpoint_bytes = checkpoint_bytes
+        self.timeout = timeout
+        self.progress = progress
+        self.sidecar = Sidecar(path)
+        self.length = None
+        self.validators = {}
+        self.retried = 0
+        self._failed = threading.Event()
+        self._progress_lock = threading.Lock()
+
+    def run(self):
+        try:
+            return self._run()
+        except ResourceChanged:
+            # whatever is on disk belongs to the old version
+            self.sidecar.remove()
+            self.start = 0
+            self._failed.clear()
+            return self._run()
+
+    def _run(self):
+        probe = self._get({'Range': 'bytes=0-0'})
+        if probe.status_code not in (200, 206):
+            probe.close()
+            raise DownloadError(f'{self.url} returned HTTP {probe.status_code}')
+        self.length = _total_length(probe)
+        self.validators = {
+            'etag': probe.headers.get('ETag'),
+            'last_modified': probe.headers.get('Last-Modified'),
+        }
+
+        if probe.status_code != 206 or self.length is None:
+            self.sidecar.remove()
+            if probe.status_code == 206:
+                # a range with no total to split on; that one byte is no use
+                probe.close()
+                probe = None
+            return self._single(probe)
+        # read the one byte so the connection goes back to the pool
+        probe.content
+        return self._segmented(self._completed())
+
+    def _completed(self):
+        """Ranges already on disk that still belong to the current resource."""
+        state = self.sidecar.load()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else None
+        if state is not None:
+            if (state.get('url') == self.url and state.get('length') == self.length
+                    and state.get('etag') == self.validators['etag']
+                    and state.get('last_modified') == self.validators['last_modified']
+                    and size == self.length):
+                return merge_ranges(state.get('completed', []))
+            self.sidecar.remove()
+            return []
+        if self.start and size is not None and size >= self.start:
+            return [[0, min(self.start, self.length)]]
+        return []
+
+    def _if_range(self):
+        etag = self.validators['etag']
+        # weak validators are not allowed in If-Range
+        if etag and not etag.startswith('W/'):
+            return etag
+        return self.validators['last_modified']
+
+    def _sleep(self, attempt, retry_after=None):
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(int(retry_after), self.max_backoff))
+        self.retried += 1
+        self._failed.wait(delay)
+
+    def _get(self, headers):
+        """GET with exponential backoff on connection errors and transient statuses."""
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = self.session.get(self.url, headers={**self.headers, **headers},
+                                            stream=True, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code not in TRANSIENT_STATUS:
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                error = DownloadError(f'{self.url} returned HTTP {response.status_code}')
+                response.close()
+            if attempt >= self.retries or self._failed.is_set():
+                raise error
+            self._sleep(attempt, retry_after)
+            attempt += 1
+
+    def _report(self, done):
+        if self.progress:
+            with self._progress_lock:
+                self.progress(done, self.length)
+
+    def _single(self, response=None):
+        """Fetch the whole resource in one stream, starting with ``response``
+        if there is one. Without ranges a dropped connection can only be
+        retried from the start, with the same backoff the segments use."""
+        attempt = 0
+        while True:
+            if response is None:
+                response = self._get({})
+                self.length = _total_length(response)
+            try:
+                return self._stream(response)
+            except requests.RequestException:
+                if attempt >= self.retries:
+                    raise
+                self._sleep(attempt)
+                attempt += 1
+                response = None
+
+    def _stream(self, response):
+        with response:
+            if response.status_code not in (200, 206):
+                raise DownloadError(f'{self.url} returned HTTP {response.status_code}')
+            done = 0
+            with open(self.path, 'wb') as f:
+                for chunk in response.iter_content(self.chunk_size):
+                    f.write(chunk)
+                    done += len(chunk)
+                    self._report(done)
+        return {'bytes': done, 'resumed': 0, 'connections': 1, 'segmented': False,
+                'steals': 0, 'retries': self.retried}
+
+    def _preallocate(self, fresh):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            if fresh:
+                os.ftruncate(fd, 0)
+            os.ftruncate(fd, self.length)
+            if fresh and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, self.length)
+                except OSError:
+                    pass
+        finally:
+            os.close(fd)
+
+    def _state(self, completed):
+        return {'url': self.url, 'length': self.length, **self.validators, 'completed': completed}
+
+    def _segmented(self, completed):
+        self._preallocate(fresh=not completed)
+        self.sidecar.save(self._state(completed))
+        resumed = sum(end - start for start, end in completed)
+        missing = missing_ranges(completed, self.length)
+        segments = Segments(missing, self.connections, self.min_segment, completed)
+        workers = max(1, min(self.connections, len(segments.pending)))
+        if missing:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='segment') as pool:
+                futures = [pool.submit(self._worker, segments, resumed) for _ in range(workers)]
+            errors = [f.exception() for f in futures if f.exception()]
+            if errors:
+                raise next((e for e in errors if isinstance(e, ResourceChanged)), errors[0])
+        self.sidecar.remove()
+        return {'bytes': self.length, 'resumed': resumed, 'connections': workers, 'segmented': True,
+                'steals': segments.steals, 'retries': self.retried}
+
+    def _worker(self, segments, resumed):
+        try:
+            with open(self.path, 'r+b') as f:
+                while not self._failed.is_set():
+                    segment = segments.take()
+                    if segment is None:
+                        break
+                    try:
+                        self._fetch(segments, segment, f, resumed)
+                    finally:
+                        self._checkpoint(segments, segment, f)
+                    segments.finish(segment)
+        except BaseException:
+            self._failed.set()
+            raise
+
+    def _checkpoint(self, segments, segment, f):
+        # data first, then the sidecar that vouches for it
+        f.flush()
+        os.fsync(f.fileno())
+        self.sidecar.save(self._state(segments.commit(segment)))
+
+    def _fetch(self, segments, segment, f, resumed):
+        attempt = 0
+        validator = self._if_range()
+        while segment.pos < segment.end and not self._failed.is_set():
+            headers = {'Range': f'bytes={segment.pos}-{segment.end - 1}'}
+            if validator:
+                headers['If-Range'] = validator
+            progressed = False
+            try:
+                with self._get(headers) as response:
+                    if response.status_code == 200:
+                        raise ResourceChanged(f'{self.url} changed on the server')
+                    if response.status_code != 206:
+                        raise DownloadError(f'expected a partial response, got HTTP {response.status_code}')
+                    f.seek(segment.pos)
+                    unsaved = 0
+                    for chunk in response.iter_content(self.chunk_size):
+                        n = segments.claim(segment, len(chunk))
+                        f.write(chunk if n == len(chunk) else memoryview(chunk)[:n])
+                        progressed = True
+                        unsaved += n
+                        if unsaved >= self.checkpoint_bytes:
+                            self._checkpoint(segments, segment, f)
+                            unsaved = 0
+                        self._report(resumed + segments.done)
+                        # another connection took the tail of this range
+                        if segment.pos >= segment.end or self._failed.is_set():
+                            break
+                    else:
+                        if segment.pos < segment.end:
+                            raise requests.ConnectionError('connection closed before the range was complete')
+            except requests.RequestException:
+                attempt = 0 if progressed else attempt
+                if attempt >= self.retries:
+                    raise
+                self._sleep(attempt)
+                attempt += 1
+
+
+def download(url, path, **kwargs):
+    """Fetch ``url`` into ``path``, resuming from its sidecar if there is
+    one; see ``SegmentedDownload`` for options. Returns a dict with the byte
+    count, bytes resumed, connections used, steals and retries."""
+    return SegmentedDownload(url, path, **kwargs).run()
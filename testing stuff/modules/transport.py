@@ -0,0 +1,115 @@
+"""Shared HTTP transport for the downloaders.
+
+``Transport`` is a ``requests.Session`` with keep-alive connection pools per
+host and a default timeout, so playlist refreshes, segments and ranges reuse
+connections instead of paying a TCP/TLS handshake each. It doesn't retry by
+default: ``segmented`` and ``hls`` retry with their own backoff, and a
+second layer underneath would multiply their attempts. Pass
+``retries=retry_policy()`` for callers that have no loop of their own.
+``shared()`` returns the process-wide instance; ``configure()`` replaces it.
+With a ``limiter`` (see ``ratelimit``) every request and every chunk of every
+body is paced through it.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+POOL_SIZE = 16
+TIMEOUT = (10, 30)
+
+
+def retry_policy(total=3, backoff=0.5, statuses=(429, 502, 503, 504)):
+    """Retries connection failures and transient statuses on idempotent
+    requests. The last response is returned instead of raising, so callers
+    still see the status once retries run out."""
+    return Retry(
+        total=total,
+        backoff_factor=backoff,
+        backoff_jitter=backoff / 2,
+        status_forcelist=statuses,
+        allowed_methods=('GET', 'HEAD', 'OPTIONS'),
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+
+
+class Transport(requests.Session):
+
+    def __init__(self, pool_size=POOL_SIZE, hosts=10, timeout=TIMEOUT, retries=0, headers=None,
+                 limiter=None):
+        super().__init__()
+        self.timeout = timeout
+        self.limiter = limiter
+        adapter = HTTPAdapter(
+            pool_connections=hosts,
+            pool_maxsize=pool_size,
+            max_retries=retries,
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        if headers:
+            self.headers.update(headers)
+        if limiter is not None:
+            # runs before requests reads the body, streamed or not
+            self.hooks['response'].append(self._limit_body)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.limiter is not None:
+            self.limiter.request(url)
+        return super().request(method, url, **kwargs)
+
+    def _limit_body(self, response, **kwargs):
+        limiter, url, stream = self.limiter, response.url, response.raw.stream
+
+        def limited(*args, **kw):
+            for chunk in stream(*args, **kw):
+                limiter.consume(url, len(chunk))
+                yield chunk
+
+        response.raw.stream = limited
+        return response
+
+    def stats(self):
+        """Connections opened and requests sent, per host and in total.
+        ``reused`` is how many requests went over an existing connection."""
+        hosts = {}
+        for adapter in {id(a): a for a in self.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = f'{key.key_scheme}://{key.key_host}:{key.key_port}'
+                entry = hosts.setdefault(host, {'connections': 0, 'requests': 0})
+                entry['connections'] += pool.num_connections
+                entry['requests'] += pool.num_requests
+        for entry in hosts.values():
+            entry['reused'] = max(entry['requests'] - entry['connections'], 0)
+        total = {k: sum(e[k] for e in hosts.values()) for k in ('connections', 'requests', 'reused')}
+        return {**total, 'hosts': hosts}
+
+
+_shared = None
+_lock = threading.Lock()
+
+
+def shared():
+    global _shared
+    with _lock:
+        if _shared is None:
+            _shared = Transport()
+        return _shared
+
+
+def configure(**options):
+    """Replace the shared transport, e.g. ``configure(pool_size=32, timeout=(5, 60))``."""
+    global _shared
+    with _lock:
+        old, _shared = _shared, Transport(**options)
+    if old is not None:
+        old.close()
+    return _shared
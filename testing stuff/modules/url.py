@@ -0,0 +1,6 @@
+from urllib.parse import urlsplit
+
+
+def is_url(value):
+    parts = urlsplit(value)
+    return parts.scheme in ('http', 'https') and bool(parts.netloc)
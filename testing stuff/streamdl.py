@@ -8,20 +8,30 @@ import requests
 from PIL import Image
 
 from youtube import YOUTUBE
+from modules import segmented, transport, ratelimit
 
 default_path='C:\\Users\\DELL\\Desktop\\side project'
 ffmpeg_path='C:\\ffmpeg\\ffmpeg-2024-03-11-git-3d1860ec8d-full_build\\bin\\ffmpeg.exe'
+max_download_rate=0 # bytes/sec for all downloads together, 0 for no limit
+limiter=None
 
 def clear_screen():
     os.system('cls')
 
 
-def custom_progress_bar(current, total, length=60)->str:
+def custom_progress_bar(current, total, length=60, text='')->str:
     progress = current / total
     blocks_completed = int(progress * length)
     bar = '[' + '=' * blocks_completed + '>' + ' ' * (length - blocks_completed) + ']'
     percentage = '{:.0%}'.format(progress)
-    print('\r' + bar + ' ' + percentage, end='', flush=True)
+    print('\r' + bar + ' ' + percentage + (' ' + text if text else ''), end='', flush=True)
+
+
+def set_rate_limit(rate)->None:
+    global max_download_rate,limiter
+    max_download_rate=rate
+    limiter=ratelimit.Limiter(rate=rate) if rate else None
+    transport.configure(limiter=limiter)
 
 
 def _valid_name(name:str)->str:
@@ -102,21 +112,16 @@ def _add_cover_and_meta_data(input_data,output_path,ffmpeg_path,title, artist, c
     os.unlink(temp_file)
     
 
-def download_file_with_resume(url, filename, retry=1,downloaded_bytes=0): 
+def download_file_with_resume(url, filename, retry=5,downloaded_bytes=0,connections=4):
+    def progress(current,total):
+        if total:custom_progress_bar(current,total,text=limiter.describe() if limiter else '')
     try:
-        headers = {'Range': f'bytes={downloaded_bytes}-'}
-        response = requests.get(url, headers=headers, stream=True)
-        total_size = int(response.headers.get('content-length', 0))
-        custom_progress_bar(downloaded_bytes, total_size)
-        with open(filename, 'ab') as f:
-            for chunk in response.iter_content(chunk_size=4096):
-                if not chunk: continue
-                f.write(chunk)
-                downloaded_bytes += len(chunk)
-                custom_progress_bar(downloaded_bytes, total_size)
+        segmented.download(url,filename,connections=connections,start=downloaded_bytes,retries=retry,progress=progress)
         print()
         return True
-    except Exception:return None
+    except (requests.RequestException,OSError,segmented.DownloadError) as e:
+        print(f'\nDownload failed: {e}')
+        return None
 
 
 def handeking_error_while_downloading_music(dict1,quality:str,mime_type,output_path,attempt_to_download=1):
@@ -424,8 +429,14 @@ def pinterest_downloader():pass
 def whatsapp_downloader():pass
 def spotiy_downloader():pass
 def other_downloader():pass
-def setting():pass
+def setting():
+    current=ratelimit.format_rate(max_download_rate) if max_download_rate else 'unlimited'
+    value=input(f"Max download speed, e.g. 500K or 2M, 0 for unlimited [{current}]: ").strip()
+    if not value:return
+    try:set_rate_limit(ratelimit.parse_rate(value))
+    except ValueError:_=input("Invalid speed. Press enter to continue.")
 def main():
+    set_rate_limit(max_download_rate)
     while True:
         clear_screen()
         print("Downloader Menu:")
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+import index
+from _lib.admission import AdmissionController, Overloaded
+
+
+def queue_up(controller, client, granted):
+    def wait():
+        slot = controller.acquire(client)
+        granted.append((client, slot))
+
+    thread = threading.Thread(target=wait, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_queued(controller, count):
+    deadline = time.monotonic() + 5
+    while controller.stats()['queued'] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_admits_up_to_limit_then_queues():
+    controller = AdmissionController('test', limit=2, queue_size=4, timeout=5)
+    first, second = controller.acquire('a'), controller.acquire('b')
+    granted = []
+    thread = queue_up(controller, 'c', granted)
+    wait_queued(controller, 1)
+    assert controller.stats()['active'] == 2 and not granted
+
+    first.release()
+    thread.join(5)
+    assert [client for client, _ in granted] == ['c']
+    # the slot was handed over, not freed
+    assert controller.stats()['active'] == 2
+    second.release()
+    granted[0][1].release()
+    assert controller.stats()['active'] == 0
+
+
+def test_release_is_idempotent():
+    controller = AdmissionController('test', limit=1)
+    slot = controller.acquire('a')
+    slot.release()
+    slot.release()
+    assert controller.stats()['active'] == 0
+
+
+def test_freed_slots_rotate_between_clients():
+    controller = AdmissionController('test', limit=1, queue_size=10, timeout=5)
+    held = controller.acquire('busy')
+    granted = []
+    threads = []
+    # one client queues three requests before another queues one
+    for client in ('greedy', 'greedy', 'greedy', 'polite'):
+        threads.append(queue_up(controller, client, granted))
+        wait_queued(controller, len(threads))
+
+    slot = held
+    for expected in ('greedy', 'polite', 'greedy', 'greedy'):
+        count = len(granted)
+        slot.release()
+        deadline = time.monotonic() + 5
+        while len(granted) == count:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+        client, slot = granted[-1]
+        assert client == expected
+    slot.release()
+    assert controller.stats()['active'] == 0
+
+
+def test_full_queue_rejects_with_retry_after():
+    controller = AdmissionController('test', limit=1, queue_size=0)
+    controller.acquire('a')
+    with pytest.raises(Overloaded) as info:
+        controller.acquire('b')
+    assert info.value.retry_after >= 1
+    assert controller.stats()['rejected'] == 1
+
+
+def test_waiter_times_out():
+    controller = AdmissionController('test', limit=1, queue_size=4, timeout=0.05)
+    controller.acquire('a')
+    with pytest.raises(Overloaded):
+        controller.acquire('b')
+    stats = controller.stats()
+    assert (stats['queued'], stats['queued_clients'], stats['rejected']) == (0, 0, 1)
+
+
+@pytest.mark.parametrize('forwarded, trusted, expected', [
+    (None, 1, '10.0.0.9'),
+    ('203.0.113.7', 1, '203.0.113.7'),
+    # a client can prepend whatever it likes, the proxy's entry is last
+    ('1.2.3.4, 203.0.113.7', 1, '203.0.113.7'),
+    ('1.2.3.4, 203.0.113.7, 10.0.0.2', 2, '203.0.113.7'),
+    ('203.0.113.7', 2, '10.0.0.9'),
+    ('203.0.113.7', 0, '10.0.0.9'),
+])
+def test_client_key_trusts_only_proxy_hops(monkeypatch, forwarded, trusted, expected):
+    monkeypatch.setattr(index, 'TRUSTED_PROXIES', trusted)
+    headers = {'X-Forwarded-For': forwarded} if forwarded else {}
+    with index.app.test_request_context(headers=headers, environ_base={'REMOTE_ADDR': '10.0.0.9'}):
+        assert index.client_key() == expected
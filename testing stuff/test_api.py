@@ -0,0 +1,100 @@
+import json
+
+import pytest
+from yt_dlp.extractor.common import InfoExtractor
+
+import index
+from _lib.admission import AdmissionController
+from _lib.playlist import PlaylistCursors
+from bench.fake_extractor import BenchIE
+from bench.media_server import media_bytes
+
+
+class ListIE(InfoExtractor):
+    IE_NAME = 'testlist'
+    _VALID_URL = r'https?://list\.invalid/(?P<id>\d+)'
+
+    def _real_extract(self, url):
+        count = int(self._match_id(url))
+        entries = (self.url_result(f'https://bench.invalid/v/item{i}', BenchIE, f'item{i}', f'item {i}')
+                   for i in range(count))
+        return self.playlist_result(entries, f'list{count}', f'list of {count}')
+
+
+@pytest.fixture(autouse=True)
+def pool(pool):
+    pool.add_extractor(ListIE)
+    return pool
+
+
+def lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def checked_out(pool):
+    stats = pool.stats()
+    return stats['created'] - sum(stats['idle'].values())
+
+
+def test_playlist_pages_follow_cursor(client, pool):
+    page = lines(client.get('/playlist?url=https://list.invalid/5&limit=2'))
+    assert page[0]['type'] == 'playlist' and page[0]['title'] == 'list of 5'
+    assert [e['index'] for e in page[1:-1]] == [0, 1]
+    # the cursor holds on to the instance between pages
+    assert checked_out(pool) == 1
+
+    seen = []
+    while page[-1]['next_cursor']:
+        page = lines(client.get(f'/playlist?url=https://list.invalid/5&limit=2&cursor={page[-1]["next_cursor"]}'))
+        seen += [e['id'] for e in page[1:-1]]
+    assert seen == ['item2', 'item3', 'item4']
+    assert checked_out(pool) == 0
+    assert pool.stats()['created'] == 1
+
+
+def test_evicted_cursor_releases_instance(client, pool, monkeypatch):
+    monkeypatch.setattr(index, 'playlist_cursors', PlaylistCursors(maxsize=1, discard=index.playlist_cursors.discard))
+    lines(client.get('/playlist?url=https://list.invalid/5&limit=1'))
+    lines(client.get('/playlist?url=https://list.invalid/6&limit=1'))
+    assert checked_out(pool) == 1
+    assert len(index.playlist_cursors._cursors) == 1
+
+
+def test_expired_cursor_releases_instance(client, pool, monkeypatch):
+    monkeypatch.setattr(index, 'playlist_cursors', PlaylistCursors(ttl=0, discard=index.playlist_cursors.discard))
+    cursor = lines(client.get('/playlist?url=https://list.invalid/5&limit=1'))[-1]['next_cursor']
+    page = lines(client.get(f'/playlist?url=https://list.invalid/5&limit=10&cursor={cursor}'))
+    # started over from the cursor's offset with a fresh iterator
+    assert [e['index'] for e in page[1:-1]] == [1, 2, 3, 4]
+    assert checked_out(pool) == 0
+
+
+def test_cursor_for_other_url_releases_instance(client, pool):
+    cursor = lines(client.get('/playlist?url=https://list.invalid/5&limit=1'))[-1]['next_cursor']
+    lines(client.get(f'/playlist?url=https://list.invalid/3&limit=10&cursor={cursor}'))
+    assert checked_out(pool) == 0
+
+
+def test_disconnect_mid_page_releases_instance(client, pool):
+    response = client.get('/playlist?url=https://list.invalid/50&limit=20', buffered=False)
+    next(response.response)
+    assert checked_out(pool) == 1
+    response.close()
+    assert checked_out(pool) == 0
+
+
+def test_cached_downloads_release_their_slot(client, media, monkeypatch, request):
+    slots = AdmissionController('download', limit=2, queue_size=0)
+    monkeypatch.setattr(index, 'download_slots', slots)
+    query = {'url': f'https://bench.invalid/v/{request.node.name}?formats=3&size=5000', 'quality': 'av-0'}
+
+    first = client.get('/download', query_string=query)
+    assert first.status_code == 200 and first.data == media_bytes(0, 5000)
+    first.close()
+    for _ in range(3 * slots.limit):
+        response = client.get('/download', query_string=query)
+        assert response.status_code == 200
+        assert response.headers['ETag'] and response.data == first.data
+        response.close()
+    assert index.artifacts.stats()['hits'] == 3 * slots.limit
+    assert slots.stats()['active'] == 0 and slots.stats()['rejected'] == 0
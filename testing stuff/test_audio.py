@@ -0,0 +1,69 @@
+import pytest
+
+import index
+from _lib.admission import AdmissionController
+from bench.media_server import media_bytes
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    download = AdmissionController('download', limit=2, queue_size=0)
+    transcode = AdmissionController('transcode', limit=1, queue_size=0)
+    monkeypatch.setattr(index, 'download_slots', download)
+    monkeypatch.setattr(index, 'transcode_slots', transcode)
+    return download, transcode
+
+
+def audio_query(request, **params):
+    url = f'https://bench.invalid/v/{request.node.name}?formats=6&size=3000'
+    return {'url': url, 'format': 'audio', 'quality': 'audio-5', **params}
+
+
+def test_audio_is_transcoded_at_the_requested_bitrate(client, media, fake_ffmpeg, request):
+    for bitrate in ('96', '320'):
+        response = client.get('/download', query_string=audio_query(request, bitrate=bitrate))
+        assert response.status_code == 200 and response.mimetype == 'audio/mpeg'
+        args, _, body = response.data.partition(b'\n')
+        assert f'-b:a {bitrate}k'.encode() in args
+        assert body == media_bytes(0, 3000)
+        response.close()
+
+
+def test_unsupported_bitrate_is_rejected(client, request):
+    response = client.get('/download', query_string=audio_query(request, bitrate='100'))
+    assert response.status_code == 400 and 'bitrate' in response.get_json()['error']
+    response.close()
+
+
+def test_missing_ffmpeg_is_reported_before_streaming(client, media, slots, tmp_path, monkeypatch, request):
+    monkeypatch.setenv('FFMPEG_PATH', str(tmp_path / 'missing' / 'ffmpeg'))
+    response = client.get('/download', query_string=audio_query(request))
+    assert response.status_code == 503 and 'ffmpeg' in response.get_json()['error']
+    response.close()
+    assert [s.stats()['active'] for s in slots] == [0, 0]
+
+
+def test_original_codec_without_audio_only_formats_uses_a_muxed_one(client, media, fake_ffmpeg, request):
+    query = {**audio_query(request, codec='original'), 'quality': 'av-0'}
+    query['url'] = query['url'].replace('formats=6', 'formats=2')
+    response = client.get('/download', query_string=query)
+    assert response.status_code == 200 and response.mimetype == 'audio/aac'
+    args, _, body = response.data.partition(b'\n')
+    assert b'-vn -c:a copy -f adts' in args and body == media_bytes(0, 3000)
+    response.close()
+
+
+def test_cached_artifact_keeps_its_own_container(client, media, tmp_path, request):
+    query = {**audio_query(request, codec='original'), 'quality': 'av-0'}
+    query['url'] = query['url'].replace('formats=6', 'formats=2')
+    # a job extracts the muxed format's audio into m4a, a stream into adts
+    stored = tmp_path / 'media.m4a'
+    stored.write_bytes(b'stored by a job')
+    info = {'extractor_key': 'Bench', 'id': request.node.name}
+    index.artifacts.store(index.media_key(info, 'av-0', 'audio', 'original', 192), str(stored))
+
+    response = client.get('/download', query_string=query)
+    assert response.status_code == 200 and response.data == b'stored by a job'
+    assert response.mimetype == 'audio/mp4'
+    assert response.headers['Content-Disposition'].endswith('.m4a')
+    response.close()
@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import index
+from _lib.cache import MetadataCache, signed_url_expiry, video_key
+
+
+def test_concurrent_misses_share_one_load():
+    cache = MetadataCache()
+    calls = []
+    release = threading.Event()
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return {'id': 'x'}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(cache.get_or_load, 'k', load) for _ in range(8)]
+        while cache.stats()['coalesced'] < 7:
+            time.sleep(0.01)
+        release.set()
+        results = [f.result() for f in futures]
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced'], stats['inflight']) == (1, 7, 0)
+    assert cache.get_or_load('k', load) is results[0] and cache.stats()['hits'] == 1
+
+
+def test_failed_load_reaches_waiters_and_is_not_cached():
+    cache = MetadataCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError('upstream down')
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(cache.get_or_load, 'k', fail)
+        started.wait(5)
+        follower = pool.submit(cache.get_or_load, 'k', fail)
+        while cache.stats()['coalesced'] < 1:
+            time.sleep(0.01)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+    assert cache.get_or_load('k', lambda: 'ok') == 'ok'
+
+
+def test_least_recently_used_is_evicted():
+    cache = MetadataCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire():
+    cache = MetadataCache(ttl=0.05)
+    cache.put('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    assert cache.get_or_load('a', lambda: 2) == 2
+
+
+def test_ttl_ends_before_signed_urls_expire():
+    now = int(time.time())
+    info = {'formats': [
+        {'url': f'https://cdn.invalid/a?expire={now + 1000}&sig=x'},
+        {'url': f'https://cdn.invalid/videoplayback/expire/{now + 100}/sig/y'},
+    ]}
+    assert signed_url_expiry(info) == now + 100
+    cache = MetadataCache(ttl=600, expiry_margin=60)
+    assert 30 < cache._ttl_for(info) <= 40
+    # already too close to expiry to be worth keeping
+    cache.put('k', {'formats': [{'url': f'https://cdn.invalid/a?expire={now + 30}'}]})
+    assert cache.get('k') is None
+
+
+def test_video_key_normalizes_spellings():
+    assert (video_key('https://youtu.be/dQw4w9WgXcQ?si=abc')
+            == video_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10')
+            == 'Youtube:dQw4w9WgXcQ')
+    assert video_key('HTTPS://Example.invalid/v?b=2&a=1') == video_key('https://example.invalid/v?a=1&b=2')
+
+
+def test_formats_lookups_are_coalesced(pool, formats_cache, request):
+    url = f'https://bench.invalid/v/{request.node.name}?formats=9&delay=0.2'
+
+    def lookup(_):
+        return index.app.test_client().get('/formats', query_string={'url': url}).get_json()
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(lookup, range(5)))
+    assert all(r == results[0] for r in results) and len(results[0]['formats']) == 9
+    stats = formats_cache.stats()
+    assert (stats['misses'], stats['coalesced']) == (1, 4)
+    # another spelling of the same url is a hit
+    assert index.app.test_client().get('/formats', query_string={'url': url + '&'}).status_code == 200
+    assert formats_cache.stats()['hits'] == 1
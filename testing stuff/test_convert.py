@@ -0,0 +1,94 @@
+import functools
+import io
+import shutil
+import subprocess
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from modules import convert, hls
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(convert.ffmpeg_path()) is None, reason='ffmpeg not installed')
+
+
+def _sample_ts(seconds=2):
+    return subprocess.run(
+        [convert.ffmpeg_path(), '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f'testsrc=duration={seconds}:size=160x120:rate=10',
+         '-f', 'lavfi', '-i', f'sine=duration={seconds}',
+         '-c:v', 'libx264', '-c:a', 'aac', '-f', 'mpegts', 'pipe:1'],
+        check=True, capture_output=True,
+    ).stdout
+
+
+@pytest.fixture
+def fmp4_rendition(tmp_path, request):
+    """An fMP4 HLS rendition (EXT-X-MAP init section) served over http;
+    ``single_file`` puts every segment in one file as byte ranges."""
+    flags = ['-hls_flags', 'single_file'] if request.param == 'single_file' else []
+    subprocess.run(
+        [convert.ffmpeg_path(), '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', 'testsrc=duration=3:size=160x120:rate=10',
+         '-f', 'lavfi', '-i', 'sine=duration=3',
+         '-c:v', 'libx264', '-g', '10', '-c:a', 'aac',
+         '-f', 'hls', '-hls_segment_type', 'fmp4', '-hls_time', '1', '-hls_playlist_type', 'vod',
+         *flags, str(tmp_path / 'index.m3u8')],
+        check=True, capture_output=True,
+    )
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=str(tmp_path))
+    handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/index.m3u8'
+    server.shutdown()
+    server.server_close()
+
+
+def test_output_args():
+    assert convert.output_args('mp4') == ['-c', 'copy']
+    assert '-c:v' in convert.output_args('mp4', reencode=True)
+    assert '-vn' in convert.output_args('mp3')
+    with pytest.raises(ValueError):
+        convert.output_args('avi')
+
+
+def test_tee_writes_to_every_file():
+    a, b = io.BytesIO(), io.BytesIO()
+    tee = convert.Tee(a, b)
+    tee.write(b'abc')
+    tee.write(b'def')
+    assert a.getvalue() == b.getvalue() == b'abcdef'
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize('fmt', ['mp4', 'mp3'])
+def test_converts_streamed_segments(tmp_path, fmt):
+    data = _sample_ts()
+    target = str(tmp_path / f'out.{fmt}')
+    with convert.Converter(target, fmt) as converter:
+        for i in range(0, len(data), 188 * 100):
+            converter.write(data[i:i + 188 * 100])
+    assert (tmp_path / f'out.{fmt}').stat().st_size > 0
+
+
+@needs_ffmpeg
+def test_garbage_input_raises(tmp_path):
+    with pytest.raises(convert.ConversionError):
+        with convert.Converter(str(tmp_path / 'out.mp4'), 'mp4') as converter:
+            converter.write(b'not a transport stream' * 1000)
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize('fmp4_rendition', ['segments', 'single_file'], indirect=True)
+@pytest.mark.parametrize('fmt', ['mp4', 'mp3'])
+def test_converts_fmp4_segments_with_init_section(fmp4_rendition, tmp_path, fmt):
+    playlist = hls.load_playlist(fmp4_rendition)
+    assert playlist.segments[0].init_section is not None
+    parts = hls.plan_requests(playlist.segments)
+    assert parts[0].init
+
+    target = str(tmp_path / f'out.{fmt}')
+    with convert.Converter(target, fmt) as converter:
+        hls.download_segments(parts, converter)
+    assert (tmp_path / f'out.{fmt}').stat().st_size > 0
@@ -0,0 +1,73 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import index
+
+
+def lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_formats_filters_and_etag(client, formats_cache, request):
+    query = {'url': f'https://bench.invalid/v/{request.node.name}?formats=12', 'only': 'audio'}
+    response = client.get('/formats', query_string=query)
+    formats = response.get_json()['formats']
+    assert formats and all(f['vcodec'] == 'none' for f in formats)
+    assert client.get('/formats', query_string=query,
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/formats', query_string={**query, 'only': 'nope'}).status_code == 400
+
+
+@pytest.mark.parametrize('query, error', [
+    ({'max_height': 'tall'}, 'max_height must be an integer'),
+    ({'limit': '1.5'}, 'limit must be an integer'),
+    ({'sort': 'name'}, 'sort must be one of bitrate, height, size'),
+])
+def test_bad_filters_are_named(client, query, error):
+    response = client.get('/formats', query_string={'url': 'https://bench.invalid/v/x', **query})
+    assert response.status_code == 400 and response.get_json() == {'error': error}
+
+
+def test_batch_filters_are_checked_too(client):
+    response = client.post('/formats/batch', json={'urls': ['https://bench.invalid/v/x'], 'limit': [3]})
+    assert response.status_code == 400 and response.get_json() == {'error': 'limit must be an integer'}
+
+
+def test_batch_looks_each_video_up_once(client, formats_cache, request):
+    url = f'https://bench.invalid/v/{request.node.name}?formats=6'
+    other = f'https://bench.invalid/v/{request.node.name}-2?formats=3'
+    response = client.post('/formats/batch', json={'urls': [url, other, url + '&', url], 'only': 'audio'})
+    assert response.mimetype == 'application/x-ndjson'
+    results = sorted(lines(response), key=lambda r: r['index'])
+    assert [r['url'] for r in results] == [url, other, url + '&', url]
+    assert [len(r['formats']) for r in results] == [2, 1, 2, 2]
+    assert formats_cache.stats()['misses'] == 2
+
+
+def test_batch_reports_errors_per_item(client, formats_cache, request):
+    good = f'https://bench.invalid/v/{request.node.name}?formats=3'
+    bad = f'https://bench.invalid/v/{request.node.name}-bad?formats=x'
+    results = sorted(lines(client.post('/formats/batch', json={'urls': [bad, good, '', 42]})),
+                     key=lambda r: r['index'])
+    assert 'error' in results[0] and 'formats' not in results[0]
+    assert len(results[1]['formats']) == 3
+    assert results[2]['error'] == results[3]['error'] == 'No URL provided'
+
+
+@pytest.mark.parametrize('body', [{}, {'urls': []}, {'urls': 'https://bench.invalid/v/x'}])
+def test_batch_needs_a_list_of_urls(client, body):
+    assert client.post('/formats/batch', json=body).status_code == 400
+
+
+def test_batch_cancels_pending_lookups_on_disconnect(client, formats_cache, monkeypatch, request):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(index, 'batch_executor', executor)
+    urls = [f'https://bench.invalid/v/{request.node.name}-{i}?formats=3&delay=0.05' for i in range(10)]
+    response = client.post('/formats/batch', json={'urls': urls}, buffered=False)
+    assert 'formats' in json.loads(next(response.response))
+    response.close()
+    executor.shutdown(wait=True)
+    # the one already running finishes, the rest never start
+    assert formats_cache.stats()['misses'] <= 2
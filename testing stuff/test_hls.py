@@ -0,0 +1,366 @@
+import io
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bench.media_server import media_bytes
+from modules import hls
+
+
+def test_segments_written_in_playlist_order(server):
+    sizes = [50000 + i * 997 for i in range(12)]
+    # later segments answer faster, so they finish first
+    urls = [f'{server.url}/media/{size}/seg{i}.ts?latency={0.05 * (12 - i) / 12}' for i, size in enumerate(sizes)]
+    out = io.BytesIO()
+    stats = hls.download_segments(urls, out, window=6)
+    assert out.getvalue() == b''.join(media_bytes(0, size) for size in sizes)
+    assert stats['segments'] == 12 and stats['bytes'] == sum(sizes)
+    assert stats['max_buffered'] <= 6
+
+
+def test_window_overlaps_request_latency(server):
+    urls = [f'{server.url}/media/1000/seg{i}.ts?latency=0.1' for i in range(16)]
+    start = time.monotonic()
+    hls.download_segments(urls, io.BytesIO(), window=8)
+    # one at a time this takes 1.6s
+    assert time.monotonic() - start < 0.8
+
+
+def test_failed_segment_is_retried(server):
+    urls = [f'{server.url}/media/1000/seg{i}.ts' + ('?fail=2' if i == 3 else '') for i in range(6)]
+    out = io.BytesIO()
+    hls.download_segments(urls, out, backoff=0.01)
+    assert out.getvalue() == media_bytes(0, 1000) * 6
+    assert server.requests == 8
+
+
+def test_missing_segment_raises(server):
+    urls = [f'{server.url}/media/1000/a.ts', f'{server.url}/missing.ts', f'{server.url}/media/1000/b.ts']
+    out = io.BytesIO()
+    with pytest.raises(hls.SegmentError):
+        hls.download_segments(urls, out, backoff=0.01)
+    assert out.getvalue() == media_bytes(0, 1000)
+
+
+class LiveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/live.m3u8':
+            server.playlist_requests += 1
+            body = server.playlist().encode()
+        else:
+            match = re.fullmatch(r'/seg/(\d+)\.ts', self.path)
+            if not match:
+                self.send_error(404)
+                return
+            body = f'{int(match.group(1)):08d}'.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LiveServer(ThreadingHTTPServer):
+    daemon_threads = True
+    duration = 0.2
+    size = 4
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), LiveHandler)
+        self.started = time.monotonic()
+        self.playlist_requests = 0
+        self.ended = False
+
+    def playlist(self):
+        newest = int((time.monotonic() - self.started) / self.duration) + self.size
+        first = newest - self.size
+        lines = ['#EXTM3U', f'#EXT-X-TARGETDURATION:{self.duration}', f'#EXT-X-MEDIA-SEQUENCE:{first}']
+        for n in range(first, newest):
+            lines += [f'#EXTINF:{self.duration},', f'seg/{n}.ts']
+        if self.ended:
+            lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture
+def live_server():
+    srv = LiveServer()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_live_playlist_fetches_each_segment_once(live_server):
+    url = f'http://127.0.0.1:{live_server.server_address[1]}/live.m3u8'
+    live = hls.LivePlaylist(url, deadline=time.monotonic() + 2)
+    out = io.BytesIO()
+    hls.download_segments(live, out, window=4)
+    data = out.getvalue()
+    numbers = [int(data[i:i + 8]) for i in range(0, len(data), 8)]
+    assert numbers == list(range(numbers[0], numbers[0] + len(numbers)))
+    # four in the first playlist plus one per 0.2s
+    assert len(numbers) >= 12
+    assert live.stats['missed'] == 0
+    # reloads at most every half target duration
+    assert live_server.playlist_requests <= 2 / 0.1 + 2
+
+
+def test_live_playlist_stops_at_endlist(live_server):
+    live_server.ended = True
+    url = f'http://127.0.0.1:{live_server.server_address[1]}/live.m3u8'
+    out = io.BytesIO()
+    hls.download_segments(hls.LivePlaylist(url), out)
+    assert len(out.getvalue()) == 4 * 8
+    assert live_server.playlist_requests == 1
+
+
+def _playlist(first, count, discontinuity_sequence=0):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:2', f'#EXT-X-MEDIA-SEQUENCE:{first}',
+             f'#EXT-X-DISCONTINUITY-SEQUENCE:{discontinuity_sequence}']
+    for n in range(first, first + count):
+        lines += ['#EXTINF:2,', f's{n}.ts']
+    return hls.parse_playlist('\n'.join(lines), 'http://example.com/live/index.m3u8')
+
+
+def _uris(segments):
+    return [segment.absolute_uri for segment in segments]
+
+
+def test_new_segments_tracks_media_sequence():
+    live = hls.LivePlaylist('http://example.com/live/index.m3u8')
+    assert _uris(live.new_segments(_playlist(10, 3))) == [f'http://example.com/live/s{n}.ts' for n in (10, 11, 12)]
+    assert live.new_segments(_playlist(10, 3)) == []
+    assert _uris(live.new_segments(_playlist(11, 3))) == ['http://example.com/live/s13.ts']
+
+
+def test_new_segments_counts_missed_segments():
+    live = hls.LivePlaylist('http://example.com/live/index.m3u8')
+    live.new_segments(_playlist(10, 3))
+    assert _uris(live.new_segments(_playlist(20, 2))) == ['http://example.com/live/s20.ts', 'http://example.com/live/s21.ts']
+    assert live.stats['missed'] == 7
+
+
+def test_new_segments_follows_encoder_restart():
+    live = hls.LivePlaylist('http://example.com/live/index.m3u8')
+    live.new_segments(_playlist(500, 3))
+    assert _uris(live.new_segments(_playlist(0, 2, discontinuity_sequence=1))) == [
+        'http://example.com/live/s0.ts', 'http://example.com/live/s1.ts']
+
+
+def test_parse_master_playlist():
+    playlist = hls.parse_playlist(
+        '#EXTM3U\n'
+        '#EXT-X-STREAM-INF:BANDWIDTH=1280000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"\n'
+        'low/index.m3u8\n'
+        '#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080\n'
+        'https://cdn.example.com/high/index.m3u8\n',
+        'http://example.com/master.m3u8')
+    assert [v.bandwidth for v in playlist.playlists] == [1280000, 5000000]
+    assert playlist.playlists[0].absolute_uri == 'http://example.com/low/index.m3u8'
+    assert playlist.playlists[0].stream_info['CODECS'] == 'avc1.4d401e,mp4a.40.2'
+    assert playlist.playlists[1].absolute_uri == 'https://cdn.example.com/high/index.m3u8'
+    assert not playlist.segments
+
+
+def _byterange_playlist(base, count, size, map_every=None):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:2']
+    for i in range(count):
+        if map_every and i % map_every == 0:
+            lines.append(f'#EXT-X-MAP:URI="{base}/media/1000/init{i // map_every % 2}.mp4",BYTERANGE="100@0"')
+        # first range explicit, the rest continue from the previous one
+        lines += ['#EXTINF:2,', f'#EXT-X-BYTERANGE:{size}' + ('@0' if i == 0 else ''),
+                  f'{base}/media/{count * size}/all.ts']
+    lines.append('#EXT-X-ENDLIST')
+    return hls.parse_playlist('\n'.join(lines), f'{base}/index.m3u8')
+
+
+def test_parse_byterange_and_map():
+    playlist = hls.parse_playlist(
+        '#EXTM3U\n'
+        '#EXT-X-MAP:URI="init.mp4",BYTERANGE="720@0"\n'
+        '#EXTINF:2,\n#EXT-X-BYTERANGE:1000@720\nmain.mp4\n'
+        '#EXTINF:2,\n#EXT-X-BYTERANGE:500\nmain.mp4\n'
+        '#EXTINF:2,\nother.mp4\n',
+        'http://example.com/v/index.m3u8')
+    first, second, third = playlist.segments
+    assert first.byterange == (720, 1000) and second.byterange == (1720, 500)
+    assert third.byterange is None
+    assert first.init_section == third.init_section
+    assert first.init_section.absolute_uri == 'http://example.com/v/init.mp4'
+    assert first.init_section.byterange == (0, 720)
+
+
+def test_plan_requests_merges_adjacent_ranges():
+    playlist = _byterange_playlist('http://example.com', 100, 10000)
+    parts = hls.plan_requests(playlist.segments, max_request=300000)
+    assert [p.byterange for p in parts] == [(0, 300000), (300000, 300000), (600000, 300000), (900000, 100000)]
+    assert sum(p.count for p in parts) == 100
+
+
+def test_plan_requests_inserts_init_when_map_changes():
+    playlist = _byterange_playlist('http://example.com', 6, 100, map_every=2)
+    parts = hls.plan_requests(playlist.segments)
+    assert [(p.init, p.count) for p in parts] == [(True, 0), (False, 2)] * 3
+    assert [p.url.rsplit('/', 1)[1] for p in parts if p.init] == ['init0.mp4', 'init1.mp4', 'init0.mp4']
+
+
+def test_byterange_download_coalesces_requests(server):
+    playlist = _byterange_playlist(server.url, 200, 5000)
+    out = io.BytesIO()
+    stats = hls.download_segments(hls.plan_requests(playlist.segments, max_request=250000), out)
+    assert out.getvalue() == media_bytes(0, 200 * 5000)
+    assert stats['segments'] == 200 and stats['requests'] == 4
+    assert server.requests == 4
+
+
+def test_init_section_fetched_once_per_map(server):
+    playlist = _byterange_playlist(server.url, 8, 100, map_every=2)
+    out = io.BytesIO()
+    stats = hls.download_segments(hls.plan_requests(playlist.segments), out, window=1)
+    init = media_bytes(0, 100)
+    assert out.getvalue() == b''.join(init + media_bytes(i * 200, i * 200 + 200) for i in range(4))
+    # init0 and init1 once each, then one request per pair of segments
+    assert stats['requests'] == 2 + 4
+
+
+def _vod_playlist(base, count, size):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:100']
+    for i in range(count):
+        lines += ['#EXTINF:2,', f'{base}/media/{size}/seg{i}.ts']
+    lines.append('#EXT-X-ENDLIST')
+    return hls.parse_playlist('\n'.join(lines), f'{base}/index.m3u8')
+
+
+def test_journal_resumes_after_last_checkpoint(server, tmp_path):
+    output = str(tmp_path / 'out.ts')
+    playlist = _vod_playlist(server.url, 10, 1000)
+    journal = hls.Journal(output, 'vod', every=3000)
+    assert journal.resume() is None
+
+    parts = hls.plan_requests(playlist.segments)
+    with open(output, 'ab') as out:
+        hls.download_segments(parts[:7], out, window=1, on_written=lambda part: journal.record(out, part))
+        # killed mid-write: a partial segment after the last checkpoint
+        out.write(b'x' * 500)
+    assert journal.load() == {'source': 'vod', 'sequence': 106, 'offset': 7000}
+
+    journal = hls.Journal(output, 'vod', every=3000)
+    done = journal.resume()
+    assert done == 106
+    assert os.path.getsize(output) == 7000
+    rest = [s for s in playlist.segments if s.sequence > done]
+    with open(output, 'ab') as out:
+        hls.download_segments(hls.plan_requests(rest), out, on_written=lambda part: journal.record(out, part))
+        journal.sync(out)
+    with open(output, 'rb') as f:
+        assert f.read() == media_bytes(0, 1000) * 10
+    assert journal.load()['sequence'] == 109
+
+
+def test_journal_for_other_source_starts_over(tmp_path):
+    output = str(tmp_path / 'out.ts')
+    with open(output, 'wb') as out:
+        out.write(b'abc')
+        journal = hls.Journal(output, 'first', every=1)
+        journal.record(out, hls.Part('u', sequence=1))
+    assert hls.Journal(output, 'first').load()['sequence'] == 1
+    assert hls.Journal(output, 'second').resume() is None
+    # nothing of the other playlist is left to append to
+    assert os.path.getsize(output) == 0
+    assert not os.path.exists(output + '.journal')
+
+
+def test_journal_starts_over_when_output_is_short(server, tmp_path):
+    output = str(tmp_path / 'out.ts')
+    with open(output, 'wb') as out:
+        out.write(b'abcdef')
+        hls.Journal(output, 'vod', every=1).record(out, hls.Part('u', sequence=3))
+    with open(output, 'r+b') as f:
+        f.truncate(2)
+    journal = hls.Journal(output, 'vod')
+    assert journal.resume() is None
+    assert os.path.getsize(output) == 0
+    assert journal.load() is None
+
+    # a full download into the same file, opened for append as m3u8.py does
+    with open(output, 'ab') as out:
+        hls.download_segments(hls.plan_requests(_vod_playlist(server.url, 3, 1000).segments), out)
+    with open(output, 'rb') as f:
+        assert f.read() == media_bytes(0, 1000) * 3
+
+
+def _variants(bandwidths):
+    return [hls.Variant(f'v{b}/index.m3u8', 'http://example.com/master.m3u8', {'BANDWIDTH': str(b)})
+            for b in bandwidths]
+
+
+def test_kept_ts_is_rewritten_on_rerun(server, tmp_path):
+    pytest.importorskip('alive_progress')
+    playlist = tmp_path / 'index.m3u8'
+    playlist.write_text('\n'.join(
+        ['#EXTM3U', '#EXT-X-TARGETDURATION:1', '#EXT-X-MEDIA-SEQUENCE:100']
+        + [line for i in range(3) for line in ('#EXTINF:1,', f'{server.url}/media/1000/seg{i}.ts')]
+        + ['#EXT-X-ENDLIST']
+    ))
+    # stands in for ffmpeg, copying the stream into the target file
+    ffmpeg = tmp_path / 'ffmpeg'
+    ffmpeg.write_text('#!/bin/sh\nfor target; do :; done\ncat > "$target"\n')
+    ffmpeg.chmod(0o755)
+    output = tmp_path / 'out.ts'
+    script = os.path.join(os.path.dirname(__file__), 'm3u8.py')
+    for _ in range(2):
+        subprocess.run([sys.executable, script, str(playlist), '-l', '-o', str(output), '-c', 'mp4', '--keep_ts'],
+                       check=True, capture_output=True, env={**os.environ, 'FFMPEG_PATH': str(ffmpeg)})
+    assert output.read_bytes() == (tmp_path / 'out.ts.mp4').read_bytes() == media_bytes(0, 1000) * 3
+
+
+def test_select_variant_policies():
+    variants = _variants([5000000, 800000, 2000000])
+    assert hls.select_variant(variants, 'best').bandwidth == 5000000
+    assert hls.select_variant(variants, 'worst').bandwidth == 800000
+    assert hls.select_variant(variants, 'auto').bandwidth == 800000
+    assert hls.select_variant(variants, 'max-bandwidth=3000000').bandwidth == 2000000
+    assert hls.select_variant(variants, 'max-bandwidth=100').bandwidth == 800000
+
+
+def test_throughput_counts_overlap_once_and_skips_idle_time():
+    throughput = hls.Throughput()
+    throughput.add(0.0, 1.0, 1000)
+    throughput.add(0.5, 1.5, 1000)
+    # idle from 1.5 to 10
+    throughput.add(10.0, 10.5, 1000)
+    assert throughput.rate() == pytest.approx(3000 / 2.0)
+
+
+def test_switcher_adapts_to_measured_throughput(server):
+    # half-second segments of each variant, served at 2 MB/s (16 Mbit/s)
+    bandwidths = [1000000, 4000000, 40000000]
+    playlists = {}
+    for b in bandwidths:
+        lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:1']
+        for i in range(8):
+            lines += ['#EXTINF:0.5,', f'{server.url}/media/{b // 16}/v{b}/seg{i}.ts?bandwidth=2000000']
+        playlists[f'http://example.com/v{b}/index.m3u8'] = hls.parse_playlist('\n'.join(lines))
+    switcher = hls.VariantSwitcher(_variants(bandwidths), samples=3)
+    out = io.BytesIO()
+    stats = hls.download_segments(hls.adaptive_parts(switcher, load=playlists.__getitem__), out,
+                                  window=1, on_written=switcher.observe)
+    assert stats['segments'] == 8
+    # 4 Mbit/s fits in the measured rate with headroom, 40 Mbit/s doesn't
+    assert switcher.current.bandwidth == 4000000
+    assert switcher.stats['switches'] == 1
+    assert 5e6 < switcher.stats['rate'] * 8 < 20e6
+    expected = [1000000] * 3 + [4000000] * 5
+    assert out.getvalue() == b''.join(media_bytes(0, b // 16) for b in expected)
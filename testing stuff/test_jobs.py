@@ -0,0 +1,51 @@
+import json
+
+from bench.media_server import media_bytes
+
+
+def events(response):
+    parsed = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line)
+        if 'event' in fields:
+            parsed.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return parsed
+
+
+def test_job_progress_is_streamed_as_sse(client, media, request):
+    url = f'https://bench.invalid/v/{request.node.name}?formats=3&size=200000'
+    created = client.post('/jobs', json={'url': url, 'quality': 'av-0'})
+    assert created.status_code == 202
+    job = created.get_json()
+
+    stream = events(client.get(job['events']))
+    assert [i for i, _, _ in stream] == list(range(len(stream)))
+    names = [name for _, name, _ in stream]
+    assert names[0] == 'phase' and names[-1] == 'finished'
+    assert {'phase': 'downloading'} in [data for _, _, data in stream]
+    assert stream[-1][2]['size'] == 200000
+
+    # a reconnecting client only gets what it hasn't seen
+    resumed = events(client.get(job['events'], headers={'Last-Event-ID': str(len(stream) - 2)}))
+    assert resumed == stream[-1:]
+
+    result = client.get(job['result'])
+    assert result.data == media_bytes(0, 200000)
+    result.close()
+
+    again = client.post('/jobs', json={'url': url, 'quality': 'av-0'}).get_json()
+    assert ('phase', {'phase': 'cached'}) in [(name, data) for _, name, data in events(client.get(again['events']))]
+
+
+def test_unknown_job(client):
+    assert client.get('/jobs/nope/events').status_code == 404
+    assert client.get('/jobs/nope/result').status_code == 404
+
+
+def test_failed_job_reports_the_error(client, media, request):
+    url = f'https://bench.invalid/v/{request.node.name}?formats=3&size=1000'
+    job = client.post('/jobs', json={'url': url, 'quality': 'av-99'}).get_json()
+    _, name, data = events(client.get(job['events']))[-1]
+    assert name == 'failed' and data['error']
+    result = client.get(job['result'])
+    assert result.status_code == 500 and result.get_json()['error'] == data['error']
@@ -0,0 +1,60 @@
+import pytest
+
+from _lib.metrics import MeteredBody, Registry
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    errors = registry.counter('errors_total', 'Errors.', ('extractor', 'stage'))
+    errors.inc(1, 'Some"IE', 'C:\\tmp\nnext')
+    assert 'errors_total{extractor="Some\\"IE",stage="C:\\\\tmp\\nnext"} 1' in registry.render().splitlines()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    seconds = registry.histogram('took_seconds', 'Time taken.', ('mode',), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        seconds.observe(value, 'direct')
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'took_seconds_bucket{mode="direct",le="0.1"} 1',
+        'took_seconds_bucket{mode="direct",le="1"} 2',
+        'took_seconds_bucket{mode="direct",le="+Inf"} 3',
+        'took_seconds_sum{mode="direct"} 5.55',
+        'took_seconds_count{mode="direct"} 3',
+    ]
+
+
+def test_collectors_and_unlabelled_counters():
+    registry = Registry()
+    registry.counter('hits_total', 'Hits.')
+    registry.collector(lambda: [('queue_depth', 'gauge', 'Queued requests.', 4)])
+    lines = registry.render().splitlines()
+    assert 'hits_total 0' in lines and lines[-3:] == [
+        '# HELP queue_depth Queued requests.', '# TYPE queue_depth gauge', 'queue_depth 4']
+
+
+def test_metered_body_reports_once_on_close():
+    reports, first = [], []
+
+    def body():
+        yield b'abc'
+        yield b'de'
+        raise OSError('upstream reset')
+
+    metered = MeteredBody(body(), lambda: first.append(1), lambda sent, failed: reports.append((sent, failed)))
+    assert next(metered) == b'abc' and first == [1]
+    assert next(metered) == b'de' and first == [1]
+    with pytest.raises(OSError):
+        next(metered)
+    metered.close()
+    metered.close()
+    assert reports == [(5, True)]
+
+
+def test_metrics_count_downloads(client, media, request):
+    query = {'url': f'https://bench.invalid/v/{request.node.name}?formats=3&size=3000', 'quality': 'av-0'}
+    client.get('/download', query_string=query).close()
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'download_bytes_sent_total{mode="direct"}' in text
+    assert 'download_slots_active 0' in text
@@ -0,0 +1,64 @@
+from _lib.pool import YDLPool
+from bench.fake_extractor import BenchIE
+
+
+def make_pool(**kwargs):
+    return YDLPool({'download': {'noplaylist': True}, 'audio': {'format': 'bestaudio'}},
+                   base_opts={'quiet': True}, **kwargs)
+
+
+def test_checkout_reuses_instances_per_profile():
+    pool = make_pool()
+    with pool.checkout('download') as first:
+        pass
+    with pool.checkout('download') as second:
+        assert second is first
+    with pool.checkout('audio') as audio:
+        assert audio is not first
+    assert pool.stats()['created'] == 2 and pool.stats()['reused'] == 1
+
+
+def test_overrides_are_rolled_back():
+    pool = make_pool()
+    hook = lambda d: None  # noqa: E731
+    with pool.checkout('audio', format='worstaudio', outtmpl='/tmp/x.%(ext)s', progress_hooks=[hook],
+                       postprocessors=[{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3'}]) as ydl:
+        assert ydl.params['format'] == 'worstaudio'
+        assert ydl.params['outtmpl']['default'] == '/tmp/x.%(ext)s'
+        assert hook in ydl._progress_hooks
+        assert len(ydl._pps['post_process']) == 1
+        overridden = ydl
+
+    with pool.checkout('audio') as ydl:
+        assert ydl is overridden
+        assert ydl.params['format'] == 'bestaudio'
+        assert ydl.params['outtmpl']['default'] != '/tmp/x.%(ext)s'
+        assert hook not in ydl._progress_hooks
+        assert ydl._pps['post_process'] == []
+
+
+def test_params_added_by_override_are_removed():
+    pool = make_pool()
+    with pool.checkout('download', ratelimit=1000) as ydl:
+        assert ydl.params['ratelimit'] == 1000
+    with pool.checkout('download') as ydl:
+        assert 'ratelimit' not in ydl.params
+
+
+def test_idle_list_is_capped():
+    pool = make_pool(size=1)
+    first, second = pool.acquire('download'), pool.acquire('download')
+    pool.release(first)
+    pool.release(second)
+    assert pool.stats()['idle']['download'] == 1
+
+
+def test_added_extractors_reach_idle_instances_first():
+    pool = make_pool()
+    with pool.checkout('download') as ydl:
+        pass
+    pool.add_extractor(BenchIE)
+    with pool.checkout('download') as again:
+        assert again is ydl
+        assert next(iter(again._ies)) == BenchIE.ie_key()
+        assert again.extract_info('https://bench.invalid/v/abc?formats=3', download=False)['id'] == 'abc'
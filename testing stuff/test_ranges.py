@@ -0,0 +1,97 @@
+import re
+
+import pytest
+from flask import Flask
+
+from _lib import ranges
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / 'media.bin'
+    path.write_bytes(DATA)
+    app = Flask(__name__)
+
+    @app.route('/file', methods=['GET', 'HEAD'])
+    def file():
+        return ranges.send_artifact(str(path), 'media.bin', etag='v1')
+
+    return app.test_client()
+
+
+def _parts(response):
+    boundary = response.mimetype_params['boundary'].encode()
+    parts = []
+    for chunk in response.data.split(b'--' + boundary)[1:-1]:
+        head, _, body = chunk.partition(b'\r\n\r\n')
+        match = re.search(rb'Content-Range: bytes (\d+)-(\d+)/(\d+)', head)
+        parts.append(((int(match[1]), int(match[2])), body[:-2]))
+    return parts
+
+
+def test_parse_ranges():
+    assert ranges._parse_ranges('bytes=0-99,50-149') == [(0, 100), (50, 150)]
+    assert ranges._parse_ranges('bytes=500-, 0-99') == [(500, None), (0, 100)]
+    assert ranges._parse_ranges('bytes=-100') == [(-100, None)]
+    assert ranges._parse_ranges('bytes=-0') == [(0, 0)]
+    for header in (None, '', 'bytes=', 'items=0-1', 'bytes=5-1', 'bytes=-', 'bytes=a-b', 'bytes=0-1,,'):
+        assert ranges._parse_ranges(header) is None
+
+
+def test_disjoint_ranges_are_multipart(client):
+    response = client.get('/file', headers={'Range': 'bytes=0-9,20-29'})
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert _parts(response) == [((0, 9), DATA[0:10]), ((20, 29), DATA[20:30])]
+    assert int(response.headers['Content-Length']) == len(response.data)
+
+
+def test_overlapping_ranges_are_merged(client):
+    response = client.get('/file', headers={'Range': 'bytes=0-99,50-149'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-149/{len(DATA)}'
+    assert response.data == DATA[:150]
+
+
+def test_unsorted_ranges_are_sorted(client):
+    response = client.get('/file', headers={'Range': 'bytes=500-,0-99'})
+    assert response.status_code == 206
+    assert _parts(response) == [((0, 99), DATA[:100]), ((500, len(DATA) - 1), DATA[500:])]
+
+
+def test_suffix_range_merges_with_overlap(client):
+    response = client.get('/file', headers={'Range': 'bytes=-100,900-949,10-19'})
+    assert _parts(response) == [((10, 19), DATA[10:20]), ((900, len(DATA) - 1), DATA[900:])]
+
+
+def test_unsatisfiable_ranges(client):
+    response = client.get('/file', headers={'Range': f'bytes={len(DATA)}-,-0'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_single_range_and_if_range(client):
+    response = client.get('/file', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206 and response.data == DATA[10:20]
+    response = client.get('/file', headers={'Range': 'bytes=0-9,50-59', 'If-Range': '"stale"'})
+    assert response.status_code == 200 and response.data == DATA
+
+
+def test_default_etag_changes_with_the_file(tmp_path):
+    path = tmp_path / 'media.bin'
+    path.write_bytes(DATA)
+    app = Flask(__name__)
+    app.add_url_rule('/file', 'file', lambda: ranges.send_artifact(str(path), 'media.bin'))
+    client = app.test_client()
+
+    etag = client.get('/file').headers['ETag']
+    assert client.get('/file', headers={'If-None-Match': etag}).status_code == 304
+    # same size, same name: a new artifact published over the old one
+    replacement = tmp_path / 'new.bin'
+    replacement.write_bytes(DATA[::-1])
+    replacement.replace(path)
+    response = client.get('/file', headers={'Range': 'bytes=0-9,20-29', 'If-Range': etag})
+    assert response.status_code == 200 and response.data == DATA[::-1]
+    assert response.headers['ETag'] != etag
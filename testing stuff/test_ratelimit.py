@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bench.media_server import media_bytes
+from modules import ratelimit, transport
+from modules.myargparser import parse_args
+
+
+class FakeTime:
+    """Stands in for the ``time`` module inside ratelimit: ``sleep`` moves
+    the clock forward instead of waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(ratelimit, 'time', fake)
+    return fake
+
+
+def test_bucket_paces_after_burst(clock):
+    bucket = ratelimit.TokenBucket(rate=100, burst=10)
+    assert bucket.reserve(10) == 0
+    assert bucket.reserve(10) == pytest.approx(0.1)
+    assert bucket.reserve(10) == pytest.approx(0.2)
+    clock.sleep(0.2)
+    assert bucket.reserve(10) == pytest.approx(0.1)
+
+
+def test_bucket_refill_is_capped_at_burst(clock):
+    bucket = ratelimit.TokenBucket(rate=1000, burst=10)
+    bucket.reserve(10)
+    clock.sleep(0.1)
+    # 100 tokens' worth of idle time, but only 10 are kept
+    assert bucket.reserve(20) == pytest.approx(0.01)
+
+
+def test_parse_and_format_rate():
+    assert ratelimit.parse_rate('500K') == 500 * 1024
+    assert ratelimit.parse_rate('2MB') == 2 * 1024 ** 2
+    assert ratelimit.parse_rate('1000') == 1000
+    assert ratelimit.format_rate(1.5 * 1024 ** 2) == '1.5 MB/s'
+
+
+def test_sleep_option_paces_vod_requests_only():
+    assert parse_args({}, ['index.m3u8', '--sleep', '1', '3']).limit_requests == 0.5
+    assert parse_args({}, ['index.m3u8', '--sleep', '1', '3', '--limit_requests', '4']).limit_requests == 4
+    assert parse_args({}, ['index.m3u8', '--sleep', '1', '3', '--live_mode']).limit_requests is None
+
+
+def test_concurrent_transfers_share_the_global_rate():
+    limiter = ratelimit.Limiter(rate=400_000)
+    start = time.monotonic()
+
+    def transfer(i):
+        for _ in range(10):
+            limiter.consume(f'http://host{i}.example/', 10_000)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(transfer, range(4)))
+    # 400 KB at 400 KB/s, less the 100 KB burst; only a lower bound, a
+    # loaded machine can always be slower
+    assert time.monotonic() - start >= 0.7
+    assert limiter.stats['bytes'] == 400_000
+
+
+def test_per_host_buckets_are_independent(clock):
+    limiter = ratelimit.Limiter(host_requests=10)
+    for i in range(6):
+        limiter.request('http://a.example/x')
+        limiter.request('http://b.example/x')
+    # a 2.5 request burst per host, then 10/s each, side by side
+    side_by_side = clock.now - 1000
+
+    one_host = ratelimit.Limiter(host_requests=10)
+    clock.now = 1000.0
+    for i in range(12):
+        one_host.request('http://a.example/x')
+    assert side_by_side < 0.4 and clock.now - 1000 == pytest.approx(0.95)
+
+
+def test_transport_limits_body_bandwidth(server, clock):
+    limiter = ratelimit.Limiter(rate=1_000_000)
+    session = transport.Transport(limiter=limiter)
+    assert session.get(f'{server.url}/media/1000000').content == media_bytes(0, 1000000)
+    # a 250 KB burst, the rest at 1 MB/s
+    assert clock.now - 1000 == pytest.approx(0.75)
+    assert limiter.stats['bytes'] == 1000000 and limiter.stats['requests'] == 1
+    assert 'of 976.6 KB/s' in limiter.describe()
+
+
+def test_transport_limits_request_rate(server, clock):
+    limiter = ratelimit.Limiter(requests=20)
+    session = transport.Transport(limiter=limiter)
+    for i in range(15):
+        session.get(f'{server.url}/media/10/{i}')
+    # 5 requests of burst, then 20/s
+    assert clock.now - 1000 == pytest.approx(0.5)
+    assert limiter.stats['requests'] == 15
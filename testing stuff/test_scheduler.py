@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+
+from modules import scheduler
+
+
+def run(batch):
+    async def collect():
+        return [result async for result in batch.run()]
+    return asyncio.run(collect())
+
+
+class Recorder:
+    """Download stand-in that tracks how many jobs run at once, overall and per host."""
+
+    def __init__(self, delay=0.02, fail=()):
+        self.delay = delay
+        self.fail = set(fail)
+        self.order = []
+        self.active = {}
+        self.peak = {}
+        self.peak_total = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, url):
+        host = scheduler.host_of(url)
+        with self.lock:
+            self.order.append(url)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+            self.peak_total = max(self.peak_total, sum(self.active.values()))
+        time.sleep(self.delay)
+        with self.lock:
+            self.active[host] -= 1
+        if url in self.fail:
+            raise RuntimeError('boom')
+        return url
+
+
+def test_normalize_url_dedupes_youtube_forms():
+    keys = {scheduler.normalize_url(u) for u in (
+        'https://www.youtube.com/watch?v=abc123&t=10',
+        'https://youtu.be/abc123',
+        'https://m.youtube.com/watch?v=abc123#x',
+    )}
+    assert keys == {'youtube:abc123'}
+    assert scheduler.normalize_url('HTTPS://Example.com/a#frag') == 'https://example.com/a'
+
+
+def test_limits_global_and_per_host_concurrency():
+    recorder = Recorder()
+    batch = scheduler.Scheduler(recorder, concurrency=6, per_host=2)
+    for i in range(8):
+        for host in ('a', 'b', 'c', 'd'):
+            batch.add(f'http://{host}.example/{i}')
+    results = run(batch)
+    assert len(results) == 32 and all(r.ok for r in results)
+    assert max(recorder.peak.values()) == 2
+    assert recorder.peak_total == 6
+
+
+def test_higher_priority_runs_first():
+    recorder = Recorder(delay=0)
+    batch = scheduler.Scheduler(recorder, concurrency=1)
+    batch.add('http://x.example/low', priority=0)
+    batch.add('http://x.example/high', priority=5)
+    batch.add('http://x.example/low2', priority=0)
+    batch.add('http://x.example/mid', priority=1)
+    run(batch)
+    assert recorder.order == ['http://x.example/high', 'http://x.example/mid',
+                              'http://x.example/low', 'http://x.example/low2']
+
+
+def test_busy_host_does_not_hold_up_others():
+    recorder = Recorder(delay=0.05)
+    batch = scheduler.Scheduler(recorder, concurrency=2, per_host=1)
+    for i in range(3):
+        batch.add(f'http://slow.example/{i}', priority=9)
+    batch.add('http://other.example/1')
+    run(batch)
+    # the low priority job fills the slot slow.example can't use
+    assert recorder.order.index('http://other.example/1') == 1
+
+
+def test_playlists_expand_into_the_pool_without_duplicates():
+    recorder = Recorder(delay=0)
+    playlists = {
+        'http://p.example/list1': ['http://v.example/1', 'http://v.example/2'],
+        'http://p.example/list2': ['http://v.example/2', 'http://v.example/3'],
+    }
+    batch = scheduler.Scheduler(recorder, expand=playlists.__getitem__)
+    batch.add('http://v.example/1')
+    batch.add_playlist('http://p.example/list1')
+    batch.add_playlist('http://p.example/list2')
+    assert not batch.add('http://v.example/1')
+    results = run(batch)
+    assert sorted(recorder.order) == ['http://v.example/1', 'http://v.example/2', 'http://v.example/3']
+    # the two playlists expand concurrently, so only the total is fixed
+    assert sum(r.value for r in results if r.job.playlist) == 2
+    assert batch.stats['duplicates'] == 3
+
+
+def test_failures_are_reported_and_the_rest_continue():
+    recorder = Recorder(delay=0, fail=['http://x.example/2'])
+    batch = scheduler.Scheduler(recorder)
+    for i in range(4):
+        batch.add(f'http://x.example/{i}')
+    results = run(batch)
+    failed = [r for r in results if not r.ok]
+    assert [r.url for r in failed] == ['http://x.example/2']
+    assert isinstance(failed[0].error, RuntimeError)
+    assert batch.stats == {'queued': 4, 'duplicates': 0, 'done': 3, 'failed': 1}
+
+
+def test_results_stream_as_jobs_finish():
+    batch = scheduler.Scheduler(lambda url: time.sleep(0.5 if url.endswith('slow') else 0), concurrency=2)
+    batch.add('http://a.example/slow')
+    batch.add('http://b.example/fast')
+
+    async def first():
+        started = time.monotonic()
+        async for result in batch.run():
+            return result.url, time.monotonic() - started
+
+    url, elapsed = asyncio.run(first())
+    assert url == 'http://b.example/fast' and elapsed < 0.3
+
+
+def test_add_file_reads_priorities_and_skips_comments(tmp_path):
+    path = tmp_path / 'urls.txt'
+    path.write_text('# list\nhttp://x.example/a\n\nhttp://x.example/b 3\nhttp://x.example/a\n')
+    recorder = Recorder(delay=0)
+    batch = scheduler.Scheduler(recorder, concurrency=1)
+    assert batch.add_file(str(path)) == 2
+    run(batch)
+    assert recorder.order == ['http://x.example/b', 'http://x.example/a']
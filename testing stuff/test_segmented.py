@@ -0,0 +1,203 @@
+import os
+import time
+
+import pytest
+
+from bench.media_server import serve, media_bytes
+from modules import segmented
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def plain_server():
+    srv = serve(ranges=False)
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_segmented_download_matches_source(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    size = 5 * MB + 123
+    # throttled so the ranges overlap in time
+    result = segmented.download(f'{server.url}/media/{size}?bandwidth={8 * MB}', str(path),
+                                connections=4, min_segment=MB // 2)
+    assert result['segmented'] and result['connections'] == 4
+    assert path.read_bytes() == media_bytes(0, size)
+    # one connection per range, the probe's is reused
+    assert server.connections == 4
+
+
+def test_overwrites_existing_file(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    path.write_bytes(b'x' * (8 * MB))
+    segmented.download(f'{server.url}/media/{3 * MB}', str(path), min_segment=MB // 2)
+    assert path.read_bytes() == media_bytes(0, 3 * MB)
+
+
+def test_resumes_from_start_offset(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    size = 4 * MB
+    path.write_bytes(media_bytes(0, MB))
+    requests_before = server.requests
+    segmented.download(f'{server.url}/media/{size}', str(path), start=MB, min_segment=MB // 2)
+    assert path.read_bytes() == media_bytes(0, size)
+    assert server.requests > requests_before
+
+
+def test_falls_back_to_single_stream(plain_server, tmp_path):
+    path = tmp_path / 'media.bin'
+    result = segmented.download(f'{plain_server.url}/media/{3 * MB}', str(path), min_segment=MB // 2)
+    assert not result['segmented']
+    assert path.read_bytes() == media_bytes(0, 3 * MB)
+    # the probe response is reused as the download
+    assert plain_server.requests == 1
+
+
+def test_range_without_total_length_is_fetched_whole(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    result = segmented.download(f'{server.url}/media/{3 * MB}?length=unknown', str(path))
+    assert not result['segmented']
+    assert path.read_bytes() == media_bytes(0, 3 * MB)
+    assert server.requests == 2
+
+
+def test_single_stream_retries_from_the_start(plain_server, tmp_path):
+    path = tmp_path / 'media.bin'
+    result = segmented.download(f'{plain_server.url}/media/{3 * MB}?drop={MB}', str(path), backoff=0.01)
+    assert not result['segmented'] and result['retries'] == 1
+    assert path.read_bytes() == media_bytes(0, 3 * MB)
+
+
+def test_small_files_use_one_connection(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    result = segmented.download(f'{server.url}/media/1000', str(path))
+    assert result['connections'] == 1
+    assert path.read_bytes() == media_bytes(0, 1000)
+
+
+def test_idle_connection_steals_half_of_largest_range():
+    segments = segmented.Segments([(0, 100)], parts=2, min_split=10)
+    first, second = segments.take(), segments.take()
+    assert (first.pos, first.end, second.pos, second.end) == (0, 50, 50, 100)
+
+    assert segments.claim(first, 50) == 50
+    segments.finish(first)
+    assert segments.claim(second, 10) == 10
+
+    stolen = segments.take()
+    assert (stolen.pos, stolen.end) == (80, 100)
+    assert second.end == 80
+    assert segments.steals == 1
+    # the original connection stops at the new boundary
+    assert segments.claim(second, 64) == 20
+
+
+def test_no_steal_below_minimum_split():
+    segments = segmented.Segments([(0, 30)], parts=1, min_split=10)
+    only = segments.take()
+    segments.claim(only, 15)
+    assert segments.take() is None
+
+
+def test_http_errors_raise(server, tmp_path):
+    with pytest.raises(segmented.DownloadError):
+        segmented.download(f'{server.url}/missing', str(tmp_path / 'x'))
+
+
+def test_pending_ranges_split_across_gaps():
+    segments = segmented.Segments(segmented.missing_ranges([[10, 20], [40, 60]], 100), parts=4, min_split=5)
+    assert [(s.pos, s.end) for s in segments.pending] == [(0, 10), (20, 40), (60, 80), (80, 100)]
+
+
+def test_missing_ranges():
+    assert segmented.missing_ranges([], 10) == [(0, 10)]
+    assert segmented.missing_ranges([[0, 4], [3, 6], [8, 10]], 10) == [(6, 8)]
+    assert segmented.missing_ranges([[0, 10]], 10) == []
+
+
+def test_retries_transient_errors(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    url = f'{server.url}/media/{2 * MB}?fail=2'
+    result = segmented.download(url, str(path), backoff=0.01)
+    assert path.read_bytes() == media_bytes(0, 2 * MB)
+    assert result['retries'] == 2
+    # two failed probes, the probe and two 1 MB ranges
+    assert server.requests == 5
+
+
+def test_gives_up_after_retries(server, tmp_path):
+    start = time.monotonic()
+    with pytest.raises(segmented.DownloadError):
+        segmented.download(f'{server.url}/media/{MB}?fail=10', str(tmp_path / 'x'), retries=2, backoff=0.01)
+    assert server.requests == 3
+    assert time.monotonic() - start < 1
+
+
+def test_dropped_connection_resumes_mid_range(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    size = 3 * MB
+    url = f'{server.url}/media/{size}?drop={MB}'
+    result = segmented.download(url, str(path), connections=1, backoff=0.01)
+    assert path.read_bytes() == media_bytes(0, size)
+    assert result['retries'] == 1
+    # only the part after the drop is fetched again
+    assert server.bytes_sent < size + MB // 2
+
+
+def _interrupt_after(limit):
+    def progress(done, total):
+        if done >= limit:
+            raise KeyboardInterrupt
+    return progress
+
+
+def test_interrupted_download_resumes_from_sidecar(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    size = 8 * MB
+    url = f'{server.url}/media/{size}'
+    with pytest.raises(KeyboardInterrupt):
+        segmented.download(url, str(path), connections=2, min_segment=MB,
+                           checkpoint_bytes=256 * 1024, progress=_interrupt_after(4 * MB))
+    state = segmented.Sidecar(str(path)).load()
+    assert state['url'] == url and state['length'] == size
+    assert state['etag'] == f'"media-{size}-v1"'
+    saved = sum(end - start for start, end in state['completed'])
+    assert saved >= 2 * MB
+
+    sent_before = server.bytes_sent
+    result = segmented.download(url, str(path), connections=2, min_segment=MB)
+    assert result['resumed'] == saved
+    assert path.read_bytes() == media_bytes(0, size)
+    assert server.bytes_sent - sent_before <= size - saved + 64 * 1024
+    assert not os.path.exists(str(path) + '.resume')
+
+
+def test_changed_resource_restarts(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    size = 4 * MB
+    url = f'{server.url}/media/{size}'
+    with pytest.raises(KeyboardInterrupt):
+        segmented.download(url, str(path), connections=1, checkpoint_bytes=256 * 1024,
+                           progress=_interrupt_after(MB))
+    server.version = 2
+    result = segmented.download(url, str(path))
+    assert result['resumed'] == 0
+    assert path.read_bytes() == media_bytes(0, size)
+
+
+def test_change_during_transfer_restarts(server, tmp_path):
+    path = tmp_path / 'media.bin'
+    size = 4 * MB
+    bumped = []
+
+    def progress(done, total):
+        if not bumped:
+            server.version += 1
+            bumped.append(done)
+
+    result = segmented.download(f'{server.url}/media/{size}', str(path), connections=4,
+                                min_segment=MB // 2, progress=progress)
+    assert result['resumed'] == 0
+    assert path.read_bytes() == media_bytes(0, size)
@@ -0,0 +1,164 @@
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+from _lib.stream import (
+    MP4_REMUX, ChunkPipe, StreamAborted, audio_passthrough, best_audio_format, ffmpeg_path, iter_transcode,
+    mp3_args, pump, video_remux,
+)
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_pipe_hands_over_chunks_then_stops():
+    pipe = ChunkPipe(maxchunks=4)
+    pipe.put(b'a')
+    pipe.put(b'b')
+    pipe.finish()
+    assert list(pipe) == [b'a', b'b']
+    assert pipe.aborted
+
+
+def test_pipe_reraises_producer_error():
+    pipe = ChunkPipe()
+    pipe.put(b'a')
+    pipe.finish(OSError('upstream reset'))
+    assert next(pipe) == b'a'
+    with pytest.raises(OSError):
+        next(pipe)
+
+
+def test_put_fails_once_aborted():
+    pipe = ChunkPipe(maxchunks=1)
+    pipe.put(b'a')
+    threading.Timer(0.05, pipe.close).start()
+    # blocks on the full queue until the consumer goes away
+    with pytest.raises(StreamAborted):
+        pipe.put(b'b')
+
+
+def test_pump_reads_no_further_ahead_than_the_pipe():
+    produced = []
+
+    def chunks():
+        for i in range(1000):
+            produced.append(i)
+            yield b'x'
+
+    pipe = pump(chunks(), maxchunks=4)
+    wait_for(lambda: len(produced) >= 5)
+    time.sleep(0.05)
+    # four queued and one waiting for room
+    assert len(produced) == 5
+    next(pipe)
+    wait_for(lambda: len(produced) == 6)
+    pipe.close()
+
+
+def test_pump_closes_the_source_when_the_client_goes_away():
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            while True:
+                yield b'x'
+        finally:
+            closed.set()
+
+    pipe = pump(chunks(), maxchunks=2)
+    assert next(pipe) == b'x'
+    pipe.close()
+    assert closed.wait(5)
+    assert list(pipe) == []
+
+
+def test_pump_passes_errors_to_the_response():
+    def chunks():
+        yield b'a'
+        raise RuntimeError('yt-dlp exited with status 1')
+
+    pipe = pump(chunks())
+    assert next(pipe) == b'a'
+    with pytest.raises(RuntimeError):
+        next(pipe)
+
+
+def test_mp3_args_carry_the_bitrate():
+    args = mp3_args(96)
+    assert args[args.index('-b:a') + 1] == '96k'
+    assert args[-2:] == ['-f', 'mp3']
+
+
+def test_missing_ffmpeg_resolves_to_none(tmp_path, monkeypatch):
+    monkeypatch.setenv('FFMPEG_PATH', str(tmp_path / 'ffmpeg'))
+    assert ffmpeg_path() is None
+
+
+def test_transcode_streams_through_ffmpeg(fake_ffmpeg):
+    out = b''.join(iter_transcode(iter([b'abc', b'def']), mp3_args(128), chunk_size=2))
+    args, _, body = out.partition(b'\n')
+    assert args.split()[-8:] == b'-vn -acodec libmp3lame -b:a 128k -f mp3 pipe:1'.split()
+    assert body == b'abcdef'
+
+
+def test_transcode_raises_ffmpeg_errors(fake_ffmpeg):
+    fake_ffmpeg.write_text('#!/bin/sh\ncat >/dev/null\necho "Invalid data found" >&2\nexit 1\n')
+    with pytest.raises(RuntimeError, match='Invalid data found'):
+        list(iter_transcode(iter([b'abc']), mp3_args(128)))
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_transcode_encodes_mp3(monkeypatch):
+    monkeypatch.delenv('FFMPEG_PATH', raising=False)
+    wav = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=duration=1',
+         '-f', 'wav', 'pipe:1'],
+        check=True, capture_output=True,
+    ).stdout
+    out = b''.join(iter_transcode(iter([wav[i:i + 4096] for i in range(0, len(wav), 4096)]), mp3_args(64)))
+    assert out[:3] == b'ID3' or out[:2] == b'\xff\xfb'
+
+
+def fmt(format_id, vcodec='none', acodec='mp4a.40.2', ext='m4a', protocol='https', abr=128):
+    return {'format_id': format_id, 'vcodec': vcodec, 'acodec': acodec, 'ext': ext,
+            'protocol': protocol, 'url': f'https://cdn.invalid/{format_id}', 'abr': abr}
+
+
+def test_best_audio_format_prefers_single_get_formats():
+    info = {'formats': [
+        fmt('hls-256', protocol='m3u8_native', abr=256),
+        fmt('140', abr=128),
+        fmt('251', acodec='opus', ext='webm', abr=160),
+        fmt('18', vcodec='avc1', ext='mp4', abr=500),
+    ]}
+    assert best_audio_format(info)['format_id'] == '251'
+    assert best_audio_format(info, 'hls-256')['format_id'] == 'hls-256'
+    # a muxed format is never picked, even by name
+    assert best_audio_format(info, '18')['format_id'] == '251'
+    assert best_audio_format({'formats': info['formats'][3:]}) is None
+
+
+def test_audio_passthrough():
+    assert audio_passthrough(fmt('140', ext='mp4')) == ('m4a', 'audio/mp4', None)
+    assert audio_passthrough(fmt('251', acodec='opus', ext='webm')) == ('webm', 'audio/webm', None)
+    assert audio_passthrough(fmt('hls', protocol='m3u8_native', ext='mp4')) == (
+        'aac', 'audio/aac', ['-vn', '-c:a', 'copy', '-f', 'adts'])
+    # the audio track of a muxed format is copied out, never sent with the video
+    assert audio_passthrough(fmt('18', vcodec='avc1', ext='mp4')) == (
+        'aac', 'audio/aac', ['-vn', '-c:a', 'copy', '-f', 'adts'])
+    assert audio_passthrough(fmt('x', vcodec='avc1', acodec='ac-3', ext='mp4')) is None
+
+
+def test_video_remux():
+    assert video_remux(fmt('hls', vcodec='avc1', protocol='m3u8_native', ext='mp4')) == MP4_REMUX
+    assert video_remux(fmt('137+140', vcodec='avc1', ext='mp4')) == MP4_REMUX
+    assert video_remux(fmt('hls', vcodec='avc1', protocol='m3u8_native', ext='ts')) == MP4_REMUX
+    assert video_remux(fmt('248+251', vcodec='vp9', ext='webm')) is None
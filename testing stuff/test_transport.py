@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import segmented, transport
+
+MB = 1024 * 1024
+
+
+def test_sequential_requests_share_one_connection(server):
+    session = transport.Transport()
+    for i in range(20):
+        assert session.get(f'{server.url}/media/1000/{i}').content
+    assert server.connections == 1
+    stats = session.stats()
+    assert stats['requests'] == 20 and stats['connections'] == 1 and stats['reused'] == 19
+    host = next(iter(stats['hosts']))
+    assert host.startswith('http://127.0.0.1:')
+
+
+def test_concurrent_requests_bounded_by_pool_size(server):
+    session = transport.Transport(pool_size=4)
+
+    def fetch(i):
+        return len(session.get(f'{server.url}/media/100000/{i}').content)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert list(pool.map(fetch, range(40))) == [100000] * 40
+    assert server.connections <= 4
+    assert session.stats()['reused'] >= 36
+
+
+def test_retries_transient_status(server):
+    session = transport.Transport(retries=transport.retry_policy(backoff=0.01))
+    response = session.get(f'{server.url}/media/1000?fail=2')
+    assert response.status_code == 200
+    assert server.requests == 3
+
+
+def test_returns_last_response_when_retries_run_out(server):
+    session = transport.Transport(retries=transport.retry_policy(total=1, backoff=0.01))
+    assert session.get(f'{server.url}/media/1000?fail=5').status_code == 503
+
+
+def test_segmented_download_reuses_shared_connections(server, tmp_path):
+    shared = transport.configure()
+    for i in range(3):
+        segmented.download(f'{server.url}/media/{4 * MB}/{i}', str(tmp_path / f'{i}.bin'),
+                           connections=4, min_segment=MB)
+    # 3 probes and 12 ranges over at most one connection per worker
+    assert server.requests == 15
+    assert server.connections <= 5
+    assert shared.stats()['reused'] >= 10